@@ -0,0 +1,262 @@
+import json
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from envi_header import find_scenes, parse_hdr_file
+from envi_reader import cube_shape, envi_dtype
+from instrumentation import record_run
+
+# Output suffix of each conversion method
+METHOD_SUFFIXES = {
+    'naive': '_naive.nc',
+    'sigfigs': '_sigfigs.nc',
+    'int': '_int.nc',
+    'quantized': '_quantized.nc',
+    'bitround': '_bitround.nc'
+}
+
+# Blocks a streaming conversion holds at once (source block, transformed copy, chunks in flight)
+STREAM_BLOCK_COPIES = 4
+# Scene copies a non-streaming conversion holds at once (cube, transposed/rounded copy, xarray buffer)
+FULL_SCENE_COPIES = 3
+# Fixed cost of a worker process (interpreter, numpy, netCDF4, xarray)
+PROCESS_OVERHEAD_BYTES = 300 * 2**20
+
+
+def scene_nbytes(hdr_metadata):
+    """Size of the raw cube in bytes: lines x samples x bands x item size."""
+    return int(np.prod(cube_shape(hdr_metadata))) * envi_dtype(hdr_metadata).itemsize
+
+
+def estimate_memory(hdr_metadata, stream=True, block_lines=100):
+    """Peak bytes one conversion of the scene is expected to need.
+
+    Streaming conversions hold a few blocks of `block_lines` lines; the
+    in-memory path holds several copies of the whole cube.
+    """
+    nbands, nrows, ncols = cube_shape(hdr_metadata)
+    itemsize = envi_dtype(hdr_metadata).itemsize
+    if stream:
+        working = STREAM_BLOCK_COPIES * nbands * min(block_lines, nrows) * ncols * itemsize
+    else:
+        working = FULL_SCENE_COPIES * scene_nbytes(hdr_metadata)
+    return PROCESS_OVERHEAD_BYTES + working
+
+
+def physical_memory():
+    """Total physical memory in bytes."""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def output_path(binary_file, root, output_dir, method, backend='netcdf'):
+    """Output file for a scene and method, mirroring the scene's place under `root`."""
+    relative = os.path.relpath(binary_file, root)
+    stem, extension = os.path.splitext(relative)
+    if extension.lower() in ('.img', '.bin', '.dat'):
+        relative = stem
+    suffix = METHOD_SUFFIXES[method]
+    if backend == 'zarr':
+        suffix = suffix.replace('.nc', '.zarr')
+    return os.path.join(output_dir, relative + suffix)
+
+
+def _output_nbytes(path):
+    """Size of an output file, or of every file in a Zarr store."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def _convert_bitround(binary_file, hdr_file, output_file, inflevel=0.99, **kwargs):
+    """Bitround conversion with keepbits from the cached bit information of the scene."""
+    from bitinfo_cache import cached_bitinformation
+    from envi_reader import open_envi_dataset
+    from xbitinfo_analysis import compress_with_xbitinfo
+
+    hdr_metadata = parse_hdr_file(hdr_file)
+    bitinfo = cached_bitinformation(binary_file, hdr_metadata, dim="band")
+    compress_with_xbitinfo(open_envi_dataset(binary_file, hdr_metadata), output_file, inflevel=inflevel,
+                           bitinfo=bitinfo, **dict(kwargs, stream=True))
+
+
+def converter(method):
+    """Conversion function of a method, called as fn(binary_file, hdr_file, output_file, **kwargs)."""
+    if method == 'naive':
+        from naive_compression import convert_to_netcdf_cdf4
+        return convert_to_netcdf_cdf4
+    if method == 'sigfigs':
+        from naive_compression_sigfigs import convert_to_netcdf_cdf4
+        return convert_to_netcdf_cdf4
+    if method == 'int':
+        from int_compression import convert_to_netcdf
+        return convert_to_netcdf
+    if method == 'quantized':
+        from int_compression import convert_to_netcdf_quantized
+        return convert_to_netcdf_quantized
+    if method == 'bitround':
+        return _convert_bitround
+    raise ValueError(f"Unknown method: {method}. Choose from {tuple(METHOD_SUFFIXES)}")
+
+
+def convert_scene(job):
+    """Run one conversion job in a worker process and return its manifest entry.
+
+    Failures are caught and recorded, so one bad scene does not stop the batch.
+    The per-stage timings of the run (see instrumentation) are kept under
+    `stages`, with the worker's peak RSS so far.
+    """
+    entry = dict(job, started=time.time())
+    start, cpu_start = time.perf_counter(), time.process_time()
+    with record_run(job['key']) as run:
+        try:
+            os.makedirs(os.path.dirname(job['output_file']), exist_ok=True)
+            converter(job['method'])(job['binary_file'], job['hdr_file'], job['output_file'], **job['kwargs'])
+            entry.update(status='done', output_bytes=_output_nbytes(job['output_file']))
+        except Exception:
+            entry.update(status='failed', error=traceback.format_exc())
+    report = run.report()
+    entry.update(seconds=time.perf_counter() - start, cpu_seconds=time.process_time() - cpu_start,
+                 peak_rss_bytes=report['peak_rss_bytes'], stages=report['stages'])
+    if 'pipelines' in report:
+        entry['pipelines'] = report['pipelines']
+    return entry
+
+
+def load_manifest(manifest_file):
+    """Manifest entries keyed by job, or an empty dict for a new batch."""
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_file):
+    """Write the manifest atomically, so an interrupted run never leaves it half written."""
+    tmp_file = f"{manifest_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+
+def catalog_scenes(root, catalog_file):
+    """(binary_file, hdr_file, hdr_metadata) of the scenes under `root` from a scene_catalog index."""
+    from scene_catalog import catalog_metadata, query_catalog
+
+    root_prefix = os.path.join(os.path.abspath(root), '')
+    # Exact, case-sensitive prefix test; LIKE would treat the '_' in scene names as a wildcard
+    rows = query_catalog(catalog_file, "error IS NULL AND substr(hdr_file, 1, length(?)) = ?",
+                         (root_prefix, root_prefix))
+    return [(row['binary_file'], row['hdr_file'], catalog_metadata(row)) for row in rows]
+
+
+def plan_jobs(root, output_dir, methods=('naive',), manifest=None, stream=True, block_lines=100, catalog_file=None,
+              **kwargs):
+    """Jobs still to run: every scene and method not marked done with its output present.
+
+    With `catalog_file` the scenes and their sizes come from the catalog
+    (see scene_catalog.build_catalog) instead of walking `root` and reading
+    every header.
+    """
+    manifest = manifest or {}
+    backend = kwargs.get('backend', 'netcdf')
+    if catalog_file is not None:
+        root = os.path.abspath(root)
+        scenes = catalog_scenes(root, catalog_file)
+    else:
+        scenes = [(binary_file, hdr_file, parse_hdr_file(hdr_file)) for binary_file, hdr_file in find_scenes(root)]
+    jobs = []
+    for binary_file, hdr_file, hdr_metadata in scenes:
+        try:
+            input_bytes = scene_nbytes(hdr_metadata)
+        except (TypeError, ValueError) as error:
+            print(f"Skipping {hdr_file}: unreadable header ({error})")
+            continue
+        for method in methods:
+            output_file = output_path(binary_file, root, output_dir, method, backend)
+            key = f"{method}:{os.path.relpath(hdr_file, root)}"
+            done = manifest.get(key, {}).get('status') == 'done'
+            if done and os.path.exists(output_file):
+                continue
+            job_kwargs = dict(kwargs, block_lines=block_lines)
+            if method != 'quantized':
+                job_kwargs['stream'] = stream
+            jobs.append({
+                'key': key,
+                'method': method,
+                'binary_file': binary_file,
+                'hdr_file': hdr_file,
+                'output_file': output_file,
+                'input_bytes': input_bytes,
+                'memory_bytes': estimate_memory(hdr_metadata, stream=stream or method == 'quantized',
+                                                block_lines=block_lines),
+                'kwargs': job_kwargs
+            })
+    return jobs
+
+
+def run_batch(root, output_dir, methods=('naive',), manifest_file=None, workers=None, memory_budget=None,
+              stream=True, block_lines=100, catalog_file=None, **kwargs):
+    """Convert every ENVI scene under `root` with each method, resuming from the manifest.
+
+    Jobs run on a process pool; a job only starts while the memory estimated
+    for the jobs in flight plus its own stays under `memory_budget` bytes
+    (default: half the physical memory), so large scenes run fewer at a time.
+    A job bigger than the whole budget runs alone. Each finished job's status,
+    timings and sizes are written to the manifest (JSON, default
+    `output_dir/manifest.json`) straight away, so rerunning after an
+    interruption skips the finished scenes. Extra `kwargs` go to the
+    converters (e.g. codec, chunksizes, skip_nodata); `catalog_file` plans
+    from a scene catalog. Returns the manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_file = manifest_file or os.path.join(output_dir, 'manifest.json')
+    memory_budget = memory_budget or physical_memory() // 2
+    workers = workers or os.cpu_count()
+    manifest = load_manifest(manifest_file)
+
+    # Largest scenes first, so small ones fill the gaps at the end
+    pending = sorted(plan_jobs(root, output_dir, methods, manifest, stream, block_lines, catalog_file, **kwargs),
+                     key=lambda job: job['memory_bytes'], reverse=True)
+    print(f"{len(pending)} conversions to run, {sum(e.get('status') == 'done' for e in manifest.values())} "
+          f"already done")
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            # Start every job that fits in the remaining budget
+            in_use = sum(job['memory_bytes'] for job in running.values())
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                if running and in_use + job['memory_bytes'] > memory_budget:
+                    continue
+                pending.remove(job)
+                running[pool.submit(convert_scene, job)] = job
+                in_use += job['memory_bytes']
+                manifest[job['key']] = dict(job, status='running')
+            save_manifest(manifest, manifest_file)
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                entry = future.result()
+                manifest[job['key']] = entry
+                print(f"{entry['status']}: {job['key']} in {entry['seconds']:.1f} s"
+                      + (f", {entry['input_bytes'] / entry['output_bytes']:.2f}x" if entry['status'] == 'done' else ''))
+            save_manifest(manifest, manifest_file)
+    return manifest
+
+
+# Example usage
+if __name__ == "__main__":
+    root = '/Users/kitlewers/Desktop/naive_compression/imagery'
+    output_dir = '/Users/kitlewers/Desktop/naive_compression/batch_output'
+
+    # Rerunning the same call after an interruption picks up where it stopped
+    manifest = run_batch(root, output_dir, methods=('naive', 'sigfigs', 'bitround'), skip_nodata=True)
+    failed = [key for key, entry in manifest.items() if entry['status'] == 'failed']
+    print(f"Done; {len(failed)} failed: {failed}")
@@ -0,0 +1,228 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import netCDF4
+
+from bitinfo import get_bitinformation, get_keepbits
+from compression_codecs import netcdf_encoding
+from envi_reader import memmap_cube
+from int_compression import scale_and_convert_to_int
+from naive_compression import parse_hdr_file
+from netcdf_writer import write_netcdf_stream
+from rounding import bitround_inplace, round_sigfigs_inplace
+
+# Methods of this repo, with the settings their converters use
+METHODS = ('naive', 'sigfigs', 'int', 'bitround')
+INT_SCALE_FACTOR = 1e10
+SIG_FIGS = 4
+
+# Default sweep
+CODECS = ('zlib', 'blosc_zstd', 'blosc_lz4')
+LEVELS = (1, 5, 9)
+SHUFFLES = (True, False)
+CHUNK_SHAPES = ((1, 100, 100), (10, 50, 50), (50, 20, 20))
+
+# Columns of the CSV results, in order
+RESULT_FIELDS = ['method', 'codec', 'complevel', 'shuffle', 'chunksizes', 'raw_mb', 'size_mb', 'ratio',
+                 'encode_seconds', 'encode_mbps', 'decode_seconds', 'decode_mbps', 'peak_rss_mb', 'rss_delta_mb',
+                 'max_abs_error', 'rmse', 'keepbits']
+
+
+def write_synthetic_scene(output_dir, bands=60, lines=400, samples=300, interleave='bil', seed=0):
+    """Write a synthetic ENVI reflectance cube and return (binary_file, hdr_file).
+
+    Pixels are noisy mixtures of three smooth spectra, a few bands are pure
+    noise like water-absorption bands, and a margin is -9999 nodata, so every
+    method sees data shaped like the AVIRIS-NG scenes.
+    """
+    rng = np.random.default_rng(seed)
+    wavelengths = np.linspace(0, 1, bands)
+    endmembers = np.stack([0.05 + 0.4 * wavelengths, 0.3 + 0.1 * np.sin(6 * wavelengths),
+                           0.5 * np.exp(-((wavelengths - 0.4) / 0.2) ** 2)])
+    yy, xx = np.mgrid[0:lines, 0:samples]
+    weights = np.stack([np.sin(yy / 37) ** 2, np.cos(xx / 23) ** 2, np.ones((lines, samples))])
+    weights /= weights.sum(axis=0)
+    cube = np.einsum('kb,kyx->byx', endmembers, weights)
+    cube += 0.002 * rng.standard_normal(cube.shape)
+    noisy = [bands * 3 // 10, bands * 3 // 10 + 1, bands * 2 // 3]
+    cube[noisy] = rng.uniform(0, 0.02, (len(noisy), lines, samples))
+    cube = cube.astype(np.float32)
+    cube[:, :, :samples // 20] = -9999
+
+    binary_file = os.path.join(output_dir, 'synthetic_scene')
+    order = {'bsq': (0, 1, 2), 'bil': (1, 0, 2), 'bip': (1, 2, 0)}[interleave]
+    cube.transpose(order).tofile(binary_file)
+    hdr_file = binary_file + '.hdr'
+    with open(hdr_file, 'w') as f:
+        f.write(f"ENVI\nsamples = {samples}\nlines = {lines}\nbands = {bands}\nheader offset = 0\n"
+                f"data type = 4\ninterleave = {interleave}\nbyte order = 0\n")
+    return binary_file, hdr_file
+
+
+def scene_keepbits(binary_file, hdr_file, inflevel=0.99):
+    """Keepbits the xbitinfo method uses for a scene (information along `band`)."""
+    cube = memmap_cube(binary_file, parse_hdr_file(hdr_file))
+    return int(get_keepbits(get_bitinformation(cube, dim='band'), inflevel=inflevel)['data'])
+
+
+def method_codec(method, dtype, keepbits=None):
+    """(transform, output dtype, inverse) for a method; inverse maps stored values back to reflectance."""
+    if method == 'naive':
+        return None, dtype, None
+    if method == 'sigfigs':
+        return lambda block: round_sigfigs_inplace(block, SIG_FIGS), dtype, None
+    if method == 'int':
+        return (lambda block: scale_and_convert_to_int(block, scale_factor=INT_SCALE_FACTOR), np.int64,
+                lambda values: values / INT_SCALE_FACTOR)
+    if method == 'bitround':
+        return lambda block: bitround_inplace(block, keepbits), dtype, None
+    raise ValueError(f"Unknown method: {method}")
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is bytes on macOS, KB on Linux)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def run_benchmark(binary_file, hdr_file, config, output_dir, keepbits=None, keep_files=False):
+    """Encode, decode and compare one configuration; meant to run in its own process.
+
+    Decoding reads the file back one row of chunks at a time and compares it
+    with the original, ignoring -9999 nodata, so peak RSS reflects the method
+    and not the harness.
+    """
+    baseline_rss = _peak_rss_mb()
+    cube = memmap_cube(binary_file, parse_hdr_file(hdr_file))
+    transform, dtype, inverse = method_codec(config['method'], cube.dtype.newbyteorder('='), keepbits)
+    encoding = netcdf_encoding(config['codec'], config['complevel'], config['shuffle'], config['chunksizes'])
+    chunk_label = 'x'.join(str(c) for c in encoding['chunksizes'])
+    output_nc_file = os.path.join(
+        output_dir, f"{config['method']}_{config['codec']}{config['complevel']}_"
+                    f"{'shuffle' if config['shuffle'] else 'noshuffle'}_{chunk_label}.nc")
+
+    start = time.perf_counter()
+    write_netcdf_stream(cube, output_nc_file, encoding, dtype=dtype, transform=transform)
+    encode_seconds = time.perf_counter() - start
+
+    decode_seconds = 0.0
+    max_abs_error, squared_error, count = 0.0, 0.0, 0
+    block_lines = encoding['chunksizes'][1]
+    with netCDF4.Dataset(output_nc_file) as nc:
+        var = nc.variables['data']
+        var.set_auto_maskandscale(False)
+        for y0 in range(0, cube.shape[1], block_lines):
+            start = time.perf_counter()
+            decoded = var[:, y0:y0 + block_lines, :]
+            decode_seconds += time.perf_counter() - start
+            original = np.asarray(cube[:, y0:y0 + block_lines, :], dtype=np.float64)
+            values = inverse(decoded) if inverse is not None else decoded.astype(np.float64)
+            valid = original != -9999
+            error = np.abs(values[valid] - original[valid])
+            if error.size:
+                max_abs_error = max(max_abs_error, float(error.max()))
+                squared_error += float(np.dot(error, error))
+                count += error.size
+
+    raw_mb = cube.nbytes / 1e6
+    size_mb = os.path.getsize(output_nc_file) / 1e6
+    if not keep_files:
+        os.remove(output_nc_file)
+    peak_rss = _peak_rss_mb()
+    return {
+        'method': config['method'],
+        'codec': config['codec'],
+        'complevel': config['complevel'],
+        'shuffle': config['shuffle'],
+        'chunksizes': chunk_label,
+        'raw_mb': raw_mb,
+        'size_mb': size_mb,
+        'ratio': raw_mb / size_mb,
+        'encode_seconds': encode_seconds,
+        'encode_mbps': raw_mb / encode_seconds,
+        'decode_seconds': decode_seconds,
+        'decode_mbps': raw_mb / decode_seconds if decode_seconds else float('inf'),
+        'peak_rss_mb': peak_rss,
+        'rss_delta_mb': peak_rss - baseline_rss,
+        'max_abs_error': max_abs_error,
+        'rmse': float(np.sqrt(squared_error / count)) if count else 0.0,
+        'keepbits': keepbits if config['method'] == 'bitround' else None
+    }
+
+
+def sweep_configs(methods=METHODS, codecs=CODECS, levels=LEVELS, shuffles=SHUFFLES, chunk_shapes=CHUNK_SHAPES):
+    """Every combination of the sweep as a list of config dicts."""
+    configs = []
+    for method, codec, level, shuffle, chunks in itertools.product(methods, codecs, levels, shuffles, chunk_shapes):
+        # Uncompressed runs do not depend on level or shuffle
+        if codec == 'none' and (level != levels[0] or shuffle != shuffles[0]):
+            continue
+        configs.append({'method': method, 'codec': codec, 'complevel': level, 'shuffle': shuffle,
+                        'chunksizes': chunks})
+    return configs
+
+
+def run_sweep(binary_file, hdr_file, output_dir, configs=None, inflevel=0.99, keep_files=False):
+    """Run every config in a fresh process and return the list of result dicts.
+
+    A new process per run keeps one method's allocations from inflating the
+    next one's peak RSS.
+    """
+    configs = configs if configs is not None else sweep_configs()
+    os.makedirs(output_dir, exist_ok=True)
+    keepbits = None
+    if any(config['method'] == 'bitround' for config in configs):
+        keepbits = scene_keepbits(binary_file, hdr_file, inflevel=inflevel)
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for i, config in enumerate(configs, start=1):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_benchmark, binary_file, hdr_file, config, output_dir, keepbits,
+                                 keep_files).result()
+        results.append(result)
+        print(f"[{i}/{len(configs)}] {result['method']} {result['codec']}{result['complevel']} "
+              f"shuffle={result['shuffle']} chunks={result['chunksizes']}: ratio {result['ratio']:.2f}, "
+              f"encode {result['encode_mbps']:.1f} MB/s, decode {result['decode_mbps']:.1f} MB/s, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB, max error {result['max_abs_error']:.2e}")
+    return results
+
+
+def write_results(results, output_dir, name='benchmark_results'):
+    """Write results as JSON and CSV and return both paths."""
+    json_file = os.path.join(output_dir, f"{name}.json")
+    csv_file = os.path.join(output_dir, f"{name}.csv")
+    with open(json_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    return json_file, csv_file
+
+
+# Example usage
+if __name__ == "__main__":
+    from compression_comparison import plot_comparison
+
+    output_dir = '/Users/kitlewers/Desktop/naive_compression/benchmark'
+    # Set these to a real scene to benchmark it instead of a synthetic cube
+    binary_file = None
+    hdr_file = None
+
+    os.makedirs(output_dir, exist_ok=True)
+    if binary_file is None:
+        binary_file, hdr_file = write_synthetic_scene(output_dir)
+
+    results = run_sweep(binary_file, hdr_file, output_dir)
+    json_file, csv_file = write_results(results, output_dir)
+    plot_comparison(csv_file, os.path.join(output_dir, 'bar.png'))
+    print(f"Saved results to: {json_file} and {csv_file}")
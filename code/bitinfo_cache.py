@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from bitinfo import (bitinformation_dataset_from_counts, bitinformation_from_counts, bitpair_counts_by_band,
+                     info_by_band_dataframe)
+from envi_reader import cube_interleave, cube_shape, envi_dtype, memmap_cube
+
+# Default location of cached bit-pair counts
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'naive_compression', 'bitinfo')
+
+# Number and size of the blocks hashed to fingerprint a scene's content
+FINGERPRINT_BLOCKS = 64
+FINGERPRINT_BLOCK_SIZE = 1 << 20
+
+
+def file_fingerprint(binary_file):
+    """Fingerprint of a file from its size, mtime and a hash of its content.
+
+    The content hash covers `FINGERPRINT_BLOCKS` evenly spaced 1 MiB blocks
+    (the whole file when it is smaller), so it stays fast on multi-GB scenes
+    while still catching rewrites that keep size and mtime.
+    """
+    stat = os.stat(binary_file)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(binary_file, 'rb') as f:
+        if stat.st_size <= FINGERPRINT_BLOCKS * FINGERPRINT_BLOCK_SIZE:
+            for data in iter(lambda: f.read(FINGERPRINT_BLOCK_SIZE), b''):
+                digest.update(data)
+        else:
+            step = (stat.st_size - FINGERPRINT_BLOCK_SIZE) // (FINGERPRINT_BLOCKS - 1)
+            for i in range(FINGERPRINT_BLOCKS):
+                f.seek(i * step)
+                digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'content': digest.hexdigest()}
+
+
+def cache_key(binary_file, hdr_metadata, dim, masked_value):
+    """Key for the counts of one scene, analysis dimension and mask value."""
+    key = {
+        'fingerprint': file_fingerprint(binary_file),
+        'shape': cube_shape(hdr_metadata),
+        'dtype': envi_dtype(hdr_metadata).str,
+        'interleave': cube_interleave(hdr_metadata),
+        'dim': dim,
+        'masked_value': masked_value
+    }
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode(), digest_size=16).hexdigest(), key
+
+
+def cached_bitpair_counts(binary_file, hdr_metadata, dim='band', masked_value=-9999, cache_dir=None,
+                          block_lines=256):
+    """Per-band bit-pair counts for a scene, computed once and then read from the cache.
+
+    Counts are stored as .npz files named by a hash of the scene fingerprint,
+    layout and analysis settings, so a changed or replaced file is recomputed.
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    digest, key = cache_key(binary_file, hdr_metadata, dim, masked_value)
+    cache_file = os.path.join(cache_dir, f"{digest}.npz")
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return cached['counts']
+
+    cube = memmap_cube(binary_file, hdr_metadata)
+    counts = bitpair_counts_by_band(cube, dim=dim, masked_value=masked_value, block_lines=block_lines)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary name first so concurrent readers never see a partial file
+    tmp_file = os.path.join(cache_dir, f"{digest}.{os.getpid()}.tmp.npz")
+    np.savez(tmp_file, counts=counts, key=json.dumps(key, sort_keys=True), source=os.path.abspath(binary_file))
+    os.replace(tmp_file, cache_file)
+    return counts
+
+
+def cached_bitinformation(binary_file, hdr_metadata, dim='band', per_band=False, masked_value=-9999,
+                          cache_dir=None):
+    """xbitinfo-style bit information Dataset for a scene from cached counts."""
+    counts = cached_bitpair_counts(binary_file, hdr_metadata, dim=dim, masked_value=masked_value,
+                                   cache_dir=cache_dir)
+    return bitinformation_dataset_from_counts(counts, envi_dtype(hdr_metadata), dim, per_band=per_band)
+
+
+def cached_bit_information_by_band(binary_file, hdr_metadata, dim='y', masked_value=-9999, cache_dir=None):
+    """Per-band bit information table (bit_information_by_band.csv layout) from cached counts."""
+    counts = cached_bitpair_counts(binary_file, hdr_metadata, dim=dim, masked_value=masked_value,
+                                   cache_dir=cache_dir)
+    return info_by_band_dataframe(bitinformation_from_counts(counts))
@@ -0,0 +1,135 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+from bitinfo_cache import cached_bit_information_by_band
+
+
+def read_bit_information_table(csv_file):
+    """(band numbers, (bands, bits) information array) from a bit_information_by_band.csv style table."""
+    df = pd.read_csv(csv_file)
+    return table_arrays(df)
+
+
+def table_arrays(df):
+    """(band numbers, information array) of a per-band table with a `band` column and bit1..bitN."""
+    bit_columns = sorted((c for c in df.columns if c.startswith('bit')), key=lambda c: int(c[3:]))
+    df = df.sort_values('band')
+    return df['band'].to_numpy(), df[bit_columns].to_numpy(dtype=np.float64)
+
+
+def information_cutoffs(info, level=0.99):
+    """First bit position (1-based) at which each band's cumulative information reaches `level`.
+
+    Same cutoff as the notebook's melt/groupby version, computed for all
+    bands at once; bands without information get 0.
+    """
+    info = np.nan_to_num(np.asarray(info, dtype=np.float64))
+    total = info.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reached = np.cumsum(info, axis=1) / total[:, None] >= level
+    return np.where(total > 0, np.argmax(reached, axis=1) + 1, 0)
+
+
+def plot_bit_information(bands, info, output_file=None, level=0.99, cmap='viridis', figsize=(10, 12), dpi=150,
+                         title="Bitwise Information Content with 99% Retention Threshold"):
+    """Render the per-band bit information heatmap with the `level` cutoff of every band.
+
+    The whole table is one `imshow` and the cutoffs one LineCollection (a
+    staircase of one step per band), drawn on an Agg canvas, so it runs
+    headless and the cost no longer grows with one artist per band.
+    Saves to `output_file` (format from its extension) when given and
+    returns the Figure. `cmap` may be a name or a colormap, e.g. seaborn's
+    "mako" as in the notebook.
+    """
+    bands = np.asarray(bands)
+    info = np.asarray(info, dtype=np.float64)
+    nbands, nbits = info.shape
+    cutoffs = information_cutoffs(info, level)
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    image = ax.imshow(info, cmap=cmap, aspect='auto', interpolation='nearest',
+                      extent=(0.5, nbits + 0.5, nbands - 0.5, -0.5))
+    fig.colorbar(image, ax=ax, label='Information Content')
+
+    # Staircase through the cutoffs: one vertical step per band, joined between neighbouring bands
+    rows = np.arange(nbands)
+    x = np.where(cutoffs > 0, cutoffs + 0.5, np.nan)
+    vertical = np.stack([np.column_stack([x, rows - 0.5]), np.column_stack([x, rows + 0.5])], axis=1)
+    joins = np.stack([np.column_stack([x[:-1], rows[1:] - 0.5]), np.column_stack([x[1:], rows[1:] - 0.5])], axis=1)
+    segments = np.concatenate([vertical, joins])
+    segments = segments[~np.isnan(segments).any(axis=(1, 2))]
+    ax.add_collection(LineCollection(segments, colors='orange', linewidths=1.5,
+                                     label=f"{100 * level:g}% information"))
+
+    ax.set_xlim(0.5, nbits + 0.5)
+    ax.set_xticks(np.arange(1, nbits + 1, 2 if nbits <= 32 else 4))
+    tick_rows = rows[::max(1, nbands // 20)]
+    ax.set_yticks(tick_rows)
+    ax.set_yticklabels(bands[tick_rows])
+    ax.set_xlabel("Bit Position")
+    ax.set_ylabel("Band")
+    ax.set_title(title)
+    ax.legend(loc='lower right')
+    if output_file:
+        fig.savefig(output_file, bbox_inches='tight')
+    return fig
+
+
+def render_scene(job):
+    """Render one scene's figure from its cached per-band table; returns the output file or the error."""
+    binary_file, hdr_metadata, output_file, dim, level = job
+    try:
+        bands, info = table_arrays(cached_bit_information_by_band(binary_file, hdr_metadata, dim=dim))
+        plot_bit_information(bands, info, output_file, level=level)
+        return output_file, None
+    except (OSError, ValueError, KeyError) as error:
+        return output_file, f"{type(error).__name__}: {error}"
+
+
+def render_catalog(catalog_file, output_dir, dim='y', level=0.99, workers=None, where="error IS NULL",
+                   extension='.png'):
+    """Render the bit information figure of every scene in a scene_catalog index.
+
+    Per-band tables come from the bit information cache (bitinfo_cache), so
+    only scenes never analysed read their cube. Figures are named after the
+    scene, `{scene}_bit_information{extension}`, and rendered on a process
+    pool. Returns {output_file: error or None}.
+    """
+    from scene_catalog import catalog_metadata, query_catalog
+
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for row in query_catalog(catalog_file, where):
+        stem = os.path.splitext(os.path.basename(row['hdr_file']))[0]
+        output_file = os.path.join(output_dir, f"{stem}_bit_information{extension}")
+        jobs.append((row['binary_file'], catalog_metadata(row), output_file, dim, level))
+    if workers == 1 or len(jobs) < 2:
+        results = list(map(render_scene, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(render_scene, jobs))
+    for output_file, error in results:
+        if error:
+            print(f"Failed: {output_file}: {error}")
+    return dict(results)
+
+
+# Example usage
+if __name__ == "__main__":
+    csv_file = '/Users/kitlewers/Desktop/naive_compression/code/bit_information_by_band.csv'
+    catalog_file = '/Users/kitlewers/Desktop/naive_compression/scene_catalog.sqlite'
+
+    bands, info = read_bit_information_table(csv_file)
+    plot_bit_information(bands, info, csv_file.replace('.csv', '.png'))
+    print(f"99% cutoffs: {np.bincount(information_cutoffs(info))}")
+
+    figures = render_catalog(catalog_file, '/Users/kitlewers/Desktop/naive_compression/figures')
+    print(f"Rendered {sum(error is None for error in figures.values())} of {len(figures)} scenes")
@@ -0,0 +1,159 @@
+import time
+
+import numpy as np
+
+from bitinfo import bitinformation_dataset_from_counts, bitpair_counts_by_band, float_layout, keepbits_by_band
+
+# Sampled pixels per line; each line is one bootstrap cluster
+PIXELS_PER_LINE = 64
+# Bootstrap replicates per round
+BOOTSTRAP_REPLICATES = 200
+
+
+def stratified_line_order(nrows, strata=16, rng=None):
+    """All line indices in an order where every prefix is a stratified random sample.
+
+    Lines are split into `strata` equal strips and shuffled within each; the
+    strips are then visited round-robin, so the first n lines hold about
+    n / strata random lines from every strip.
+    """
+    rng = np.random.default_rng(rng)
+    strips = [rng.permutation(strip) for strip in np.array_split(np.arange(nrows), min(strata, nrows))]
+    order = np.full((len(strips), max(len(strip) for strip in strips)), -1, dtype=np.int64)
+    for k, strip in enumerate(strips):
+        order[k, :len(strip)] = strip
+    order = order.T.reshape(-1)
+    return order[order >= 0]
+
+
+def stratified_columns(valid_columns, n, rng):
+    """Up to `n` columns, one drawn at random from each of `n` equal strata of the valid columns."""
+    if len(valid_columns) <= n:
+        return valid_columns
+    return np.array([rng.choice(stratum) for stratum in np.array_split(valid_columns, n)])
+
+
+def line_counts(cube, y, dim='band', masked_value=-9999, pixels_per_line=PIXELS_PER_LINE, rng=None):
+    """Per-band bit-pair counts of a stratified sample of valid pixels on line `y`.
+
+    The pairs are the ones the full analysis counts along `dim` (the next
+    band, the next sample or the next line), so the sampled counts are an
+    unbiased subset of `bitpair_counts_by_band(cube, dim)`.
+    """
+    rng = np.random.default_rng(rng)
+    nbands, nrows, ncols = cube.shape
+    lines = np.asarray(cube[:, y:y + (2 if dim == 'y' else 1), :])
+    last_column = ncols - 1 if dim == 'x' else ncols
+    first_band = lines[0, 0, :last_column]
+    valid = ~np.isnan(first_band)
+    if masked_value is not None:
+        valid &= first_band != masked_value
+    columns = stratified_columns(np.flatnonzero(valid), pixels_per_line, rng)
+    if dim == 'x':
+        # (band, pixel, [x, x + 1]) so the pairs run along the last axis
+        block = np.stack([lines[:, 0, columns], lines[:, 0, columns + 1]], axis=-1)
+    elif dim == 'y':
+        block = lines[:, :, columns]
+    else:
+        block = lines[:, :1, columns]
+    return bitpair_counts_by_band(block, dim=dim, masked_value=masked_value, block_lines=max(1, block.shape[1]))
+
+
+def bootstrap_keepbits(counts, dtype, inflevels, replicates=BOOTSTRAP_REPLICATES, confidence=0.95, rng=None):
+    """Keepbits and bootstrap confidence intervals from per-line counts of shape (lines, ..., nbits, 2, 2).
+
+    Lines are resampled with replacement (a cluster bootstrap, since pixels
+    on one line are correlated). Returns (keepbits, low, high), each of shape
+    (inflevels, ...).
+    """
+    rng = np.random.default_rng(rng)
+    nlines = counts.shape[0]
+    weights = rng.multinomial(nlines, np.full(nlines, 1 / nlines), size=replicates)
+    resampled = (weights @ counts.reshape(nlines, -1)).reshape(replicates, *counts.shape[1:])
+    total = counts.sum(axis=0)
+    keepbits = np.stack([keepbits_by_band(total, dtype, inflevel) for inflevel in inflevels])
+    boot = np.stack([keepbits_by_band(resampled, dtype, inflevel) for inflevel in inflevels])
+    alpha = (1 - confidence) / 2
+    low = np.floor(np.quantile(boot, alpha, axis=1)).astype(np.int64)
+    high = np.ceil(np.quantile(boot, 1 - alpha, axis=1)).astype(np.int64)
+    return keepbits, low, high
+
+
+def estimate_keepbits(cube, inflevels=(0.99,), dim='band', masked_value=-9999, per_band=False, initial_lines=32,
+                      max_lines=None, max_ci_width=1, strata=16, pixels_per_line=PIXELS_PER_LINE,
+                      replicates=BOOTSTRAP_REPLICATES, confidence=0.95, seed=None):
+    """Keepbits of a (band, y, x) cube from a growing stratified sample of its valid pixels.
+
+    Starts with `initial_lines` lines spread over `strata` strips of the
+    scene, `pixels_per_line` valid (non `masked_value`) pixels on each, and
+    doubles the sample until, for every inflevel, the bootstrap confidence
+    interval is at most `max_ci_width` bits wide and the estimate did not
+    change since the previous round (or `max_lines` lines are used).
+
+    Returns a dict with `keepbits`, `ci_low` and `ci_high` (one entry per
+    inflevel; per band arrays with `per_band`), the sample size, the
+    history of rounds and `bitinfo`, the sampled bit information as the
+    Dataset get_bitinformation returns (summed over bands), which can be
+    passed to compress_with_xbitinfo(bitinfo=...).
+    """
+    start = time.perf_counter()
+    float_layout(cube.dtype)
+    rng = np.random.default_rng(seed)
+    nrows = cube.shape[1]
+    order = stratified_line_order(nrows - (dim == 'y'), strata, rng)
+    max_lines = min(max_lines or len(order), len(order))
+    inflevels = tuple(np.atleast_1d(inflevels).tolist())
+
+    counts, history = [], []
+    previous = None
+    target = min(initial_lines, max_lines)
+    while True:
+        for y in order[len(counts):target]:
+            line = line_counts(cube, int(y), dim, masked_value, pixels_per_line, rng)
+            counts.append(line if per_band else line.sum(axis=0))
+        sampled = np.stack(counts)
+        keepbits, low, high = bootstrap_keepbits(sampled, cube.dtype, inflevels, replicates, confidence, rng)
+        history.append({'lines': len(counts), 'pairs': int(sampled[..., 0, :, :].sum()),
+                        'keepbits': keepbits.tolist(), 'ci_low': low.tolist(), 'ci_high': high.tolist()})
+        converged = (high - low <= max_ci_width).all() and previous is not None and np.array_equal(keepbits, previous)
+        if converged or len(counts) >= max_lines:
+            break
+        previous = keepbits
+        target = min(2 * target, max_lines)
+
+    total = sampled.sum(axis=0)
+    return {
+        'keepbits': dict(zip(inflevels, keepbits.tolist())),
+        'ci_low': dict(zip(inflevels, low.tolist())),
+        'ci_high': dict(zip(inflevels, high.tolist())),
+        'converged': bool(converged),
+        'lines_sampled': len(counts),
+        'line_fraction': len(counts) / nrows,
+        'pairs_sampled': history[-1]['pairs'],
+        'seconds': time.perf_counter() - start,
+        'history': history,
+        'bitinfo': bitinformation_dataset_from_counts(total if per_band else total[None], cube.dtype, dim,
+                                                      per_band=per_band)
+    }
+
+
+# Example usage
+if __name__ == "__main__":
+    from bitinfo import get_bitinformation, get_keepbits
+    from envi_header import parse_hdr_file
+    from envi_reader import memmap_cube
+
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+
+    cube = memmap_cube(binary_file, parse_hdr_file(hdr_file))
+    estimate = estimate_keepbits(cube, inflevels=(0.9, 0.99, 0.999), seed=0)
+    print(f"Sampled {estimate['lines_sampled']} lines ({100 * estimate['line_fraction']:.1f}%) "
+          f"in {estimate['seconds']:.1f} s, converged: {estimate['converged']}")
+    for inflevel, keepbits in estimate['keepbits'].items():
+        print(f"  inflevel {inflevel}: {keepbits} keepbits "
+              f"[{estimate['ci_low'][inflevel]}, {estimate['ci_high'][inflevel]}]")
+
+    start = time.perf_counter()
+    full = get_keepbits(get_bitinformation(cube, dim="band"), inflevel=[0.9, 0.99, 0.999])
+    print(f"Full scene in {time.perf_counter() - start:.1f} s: {full['data'].values.tolist()}")
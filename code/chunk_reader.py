@@ -0,0 +1,283 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import netCDF4
+import xarray as xr
+import zarr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+from spectral_predictor import CF_DECODING_ATTRS, decoded_attrs, spectral_decoder
+
+# Decompressed chunks kept in memory by default
+CACHE_BYTES = 256 * 2**20
+
+
+def decoded_dtype(stored, scale_factor=None, add_offset=None, fill_value=None, inverse=None):
+    """Type xarray decodes a stored variable to, so reads match `xr.open_dataset`/`xr.open_zarr`.
+
+    With CF attributes the type follows theirs: float32 constants (NetCDF)
+    give float32 unless the data are 32-bit integers, and the float64
+    constants of a Zarr store's JSON give float64. Integers with a fill
+    value or an `inverse` become float32 up to 16 bits and float64 above.
+    """
+    if scale_factor is not None or add_offset is not None:
+        types = [np.dtype(type(value)) for value in (scale_factor, add_offset) if value is not None]
+        if add_offset is not None and scale_factor is not None and types[0] == types[1] and \
+                types[0] in (np.float32, np.float64):
+            return np.dtype(np.float64 if stored.kind in 'iu' and stored.itemsize == 4 else types[0])
+        if add_offset is not None or types[0].kind != 'f':
+            return np.dtype(np.float64)
+        return types[0]
+    if stored.kind == 'f' or (fill_value is None and inverse is None):
+        return stored
+    return np.dtype(np.float32 if stored.itemsize <= 2 else np.float64)
+
+
+class CompressedCubeReader:
+    """Spectrum, ROI and point reads from a converted NetCDF file or Zarr store with a chunk LRU cache.
+
+    Every read is served from whole decompressed chunks. Chunks are kept in
+    an LRU cache bounded by `cache_bytes`, so neighbouring spectra and
+    overlapping ROIs decompress each chunk once; the library's own chunk
+    cache is switched off so it does not hold a second copy. Values are
+    decoded like xarray does, in the same type (see `decoded_dtype`): CF
+    scale_factor/add_offset are applied and _FillValue becomes NaN (stored
+    -9999 nodata is returned as is).
+    `inverse` maps stored values of outputs without CF attributes, e.g.
+    `lambda v: v / 1e10` for int_compression.convert_to_netcdf.
+    Outputs written with a spectral predictor are decoded a whole spectral
+    column of chunks at a time, since every band depends on the ones before.
+    """
+
+    def __init__(self, path, cache_bytes=CACHE_BYTES, inverse=None, var='data'):
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.inverse = inverse
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.isdir(path) or path.endswith('.zarr'):
+            self._nc = None
+            self._var = zarr.open_array(path, path=var, mode='r')
+            self.chunks = tuple(self._var.chunks)
+            attrs = dict(self._var.attrs)
+            fill_value = self._var.fill_value
+        else:
+            self._nc = netCDF4.Dataset(path)
+            self._var = self._nc.variables[var]
+            self._var.set_auto_maskandscale(False)
+            self._var.set_var_chunk_cache(size=0)
+            chunking = self._var.chunking()
+            self.chunks = tuple(self._var.shape) if chunking == 'contiguous' else tuple(chunking)
+            attrs = {name: self._var.getncattr(name) for name in self._var.ncattrs()}
+            fill_value = attrs.get('_FillValue')
+        self.shape = tuple(self._var.shape)
+        self.spectral_decode = spectral_decoder(attrs)
+        if self.spectral_decode is not None:
+            # Fill value and CF attributes of the decoded values are stored under spectral_predictor_* names
+            attrs = decoded_attrs(attrs)
+            fill_value = attrs.get('_FillValue')
+        self.scale_factor = attrs.get('scale_factor')
+        self.add_offset = attrs.get('add_offset')
+        self.fill_value = fill_value
+        stored = np.dtype(attrs['spectral_predictor_dtype']) if self.spectral_decode else np.dtype(self._var.dtype)
+        self.dtype = decoded_dtype(stored, self.scale_factor, self.add_offset, self.fill_value, inverse)
+
+    def close(self):
+        if self._nc is not None:
+            self._nc.close()
+        self._cache.clear()
+        self._cached_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def hit_rate(self):
+        """Fraction of chunk lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def cache_info(self):
+        """Hits, misses, hit rate and current size of the chunk cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'chunks': len(self._cache), 'bytes': self._cached_bytes}
+
+    def decode(self, raw):
+        """Stored values to reflectance in `dtype`: CF scale/offset or `inverse`, then fill to NaN."""
+        values = raw.astype(self.dtype)
+        if self.scale_factor is not None:
+            values *= self.dtype.type(self.scale_factor)
+        if self.add_offset is not None:
+            values += self.dtype.type(self.add_offset)
+        if self.inverse is not None:
+            values = np.asarray(self.inverse(values), dtype=self.dtype)
+        if self.fill_value is not None and not (raw.dtype.kind == 'f' and np.isnan(self.fill_value)):
+            values[raw == self.fill_value] = np.nan
+        return values
+
+    def chunk(self, kb, ky, kx):
+        """Decoded chunk at chunk-grid position (kb, ky, kx), from the cache when possible."""
+        key = (kb, ky, kx)
+        block = self._cache.get(key)
+        if block is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return block
+        self.misses += 1
+        cb, cy, cx = self.chunks
+        if self.spectral_decode is None:
+            blocks = {key: self.decode(np.asarray(self._var[kb * cb:(kb + 1) * cb, ky * cy:(ky + 1) * cy,
+                                                            kx * cx:(kx + 1) * cx]))}
+        else:
+            column = self.decode(self.spectral_decode(self._var[:, ky * cy:(ky + 1) * cy, kx * cx:(kx + 1) * cx]))
+            blocks = {(band_chunk, ky, kx): column[band_chunk * cb:(band_chunk + 1) * cb]
+                      for band_chunk in range(-(-self.shape[0] // cb))}
+            # The requested chunk goes in last, so it is the most recently used
+            blocks[key] = blocks.pop(key)
+        for chunk_key, block in blocks.items():
+            if chunk_key in self._cache:
+                self._cached_bytes -= self._cache.pop(chunk_key).nbytes
+            self._cache[chunk_key] = block
+            self._cached_bytes += block.nbytes
+        # Evict least recently used chunks, but always keep the ones just read
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > len(blocks):
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+        return blocks[key]
+
+    def _band_groups(self, bands):
+        """(band chunk, positions in the output, offsets within the chunk) for a band selection."""
+        bands = np.atleast_1d(np.arange(self.shape[0])[bands])
+        chunk_of_band = bands // self.chunks[0]
+        return [(int(kb), np.flatnonzero(chunk_of_band == kb), bands[chunk_of_band == kb] - kb * self.chunks[0])
+                for kb in np.unique(chunk_of_band)], len(bands)
+
+    def get_roi(self, y0, y1, x0, x1, bands=slice(None)):
+        """(bands, y1 - y0, x1 - x0) window; `bands` is a slice, index list or array.
+
+        An empty window or band selection gives an empty array; bounds outside
+        the cube raise IndexError.
+        """
+        groups, nbands = self._band_groups(bands)
+        _, nrows, ncols = self.shape
+        if not (0 <= y0 <= nrows and 0 <= y1 <= nrows and 0 <= x0 <= ncols and 0 <= x1 <= ncols):
+            raise IndexError(f"Window y {y0}:{y1}, x {x0}:{x1} is outside the cube of shape {self.shape}")
+        _, cy, cx = self.chunks
+        out = np.empty((nbands, max(0, y1 - y0), max(0, x1 - x0)), dtype=self.dtype)
+        if out.size == 0:
+            return out
+        for ky in range(y0 // cy, (y1 - 1) // cy + 1):
+            ya, yb = max(y0, ky * cy), min(y1, (ky + 1) * cy)
+            for kx in range(x0 // cx, (x1 - 1) // cx + 1):
+                xa, xb = max(x0, kx * cx), min(x1, (kx + 1) * cx)
+                for kb, positions, offsets in groups:
+                    block = self.chunk(kb, ky, kx)
+                    out[positions, ya - y0:yb - y0, xa - x0:xb - x0] = \
+                        block[offsets, ya - ky * cy:yb - ky * cy, xa - kx * cx:xb - kx * cx]
+        return out
+
+    def get_spectrum(self, y, x, bands=slice(None)):
+        """Spectrum of one pixel."""
+        return self.get_roi(y, y + 1, x, x + 1, bands)[:, 0, 0]
+
+    def get_points(self, ys, xs, bands=slice(None)):
+        """(points, bands) spectra of many pixels; points in the same chunk share one chunk lookup.
+
+        Coordinates outside the cube raise IndexError.
+        """
+        ys, xs = np.atleast_1d(np.asarray(ys, dtype=np.int64)), np.atleast_1d(np.asarray(xs, dtype=np.int64))
+        if ys.shape != xs.shape or ys.ndim != 1:
+            raise ValueError("ys and xs must be 1-d and of the same length")
+        groups, nbands = self._band_groups(bands)
+        _, nrows, ncols = self.shape
+        if ((ys < 0) | (ys >= nrows) | (xs < 0) | (xs >= ncols)).any():
+            raise IndexError(f"Points outside the cube of shape {self.shape}")
+        out = np.empty((len(ys), nbands), dtype=self.dtype)
+        if out.size == 0:
+            return out
+        _, cy, cx = self.chunks
+        # Coalesce the points by spatial chunk
+        keys = (ys // cy) * (self.shape[2] // cx + 1) + xs // cx
+        order = np.argsort(keys, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(keys[order]) != 0])
+        for start, stop in zip(starts, np.r_[starts[1:], len(order)]):
+            points = order[start:stop]
+            ky, kx = int(ys[points[0]] // cy), int(xs[points[0]] // cx)
+            for kb, positions, offsets in groups:
+                block = self.chunk(kb, ky, kx)
+                out[np.ix_(points, positions)] = block[offsets][:, ys[points] - ky * cy, xs[points] - kx * cx].T
+        return out
+
+
+class _ReaderArray(BackendArray):
+    """Lazily indexed view of a CompressedCubeReader, for wrapping in an xarray Variable."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.shape = reader.shape
+        self.dtype = reader.dtype
+        # The chunk cache is not thread safe (dask may read from several threads)
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._getitem)
+
+    def _getitem(self, key):
+        selections = [np.arange(size)[k] for size, k in zip(self.shape, key)]
+        bands, ys, xs = (np.atleast_1d(selection) for selection in selections)
+        y0, y1 = (int(ys.min()), int(ys.max()) + 1) if ys.size else (0, 0)
+        x0, x1 = (int(xs.min()), int(xs.max()) + 1) if xs.size else (0, 0)
+        with self.lock:
+            window = self.reader.get_roi(y0, y1, x0, x1, bands=bands)
+        window = window[:, ys - y0][:, :, xs - x0]
+        return window[tuple(0 if np.ndim(selection) == 0 else slice(None) for selection in selections)]
+
+
+def open_predicted_dataset(path, var='data', cache_bytes=CACHE_BYTES, inverse=None):
+    """Open a converted NetCDF file as an xarray Dataset whose `var` is decoded by CompressedCubeReader.
+
+    For outputs written with a spectral predictor, which plain
+    `xr.open_dataset` shows as raw residuals: values are decoded lazily, a
+    spectral column of chunks at a time, with CF scale/offset and fill value
+    applied as xarray would. Works for any converted NetCDF file. Closing
+    the Dataset closes the reader.
+    """
+    reader = CompressedCubeReader(path, cache_bytes=cache_bytes, inverse=inverse, var=var)
+    with netCDF4.Dataset(path) as nc:
+        variable = nc.variables[var]
+        dims = variable.dimensions
+        coords = {dim: np.asarray(nc.variables[dim][:]) for dim in dims if dim in nc.variables}
+        attrs = decoded_attrs({name: variable.getncattr(name) for name in variable.ncattrs()})
+        global_attrs = {name: nc.getncattr(name) for name in nc.ncattrs()}
+    attrs = {name: value for name, value in attrs.items()
+             if name not in CF_DECODING_ATTRS and not name.startswith('spectral_predictor')}
+    data = xr.Variable(dims, indexing.LazilyIndexedArray(_ReaderArray(reader)), attrs=attrs)
+    ds = xr.Dataset({var: data}, coords=coords, attrs=global_attrs)
+    ds.set_close(reader.close)
+    return ds
+
+
+# Example usage
+if __name__ == "__main__":
+    import time
+
+    nc_file = '/Users/kitlewers/Desktop/naive_compression/imagery/output_data_spectra_chunks.nc'
+
+    with CompressedCubeReader(nc_file) as reader:
+        rng = np.random.default_rng(0)
+        ys = rng.integers(0, reader.shape[1], 1000)
+        xs = rng.integers(0, reader.shape[2], 1000)
+        start = time.perf_counter()
+        spectra = reader.get_points(ys, xs)
+        print(f"{len(ys)} spectra in {time.perf_counter() - start:.2f} s")
+        roi = reader.get_roi(1000, 1064, 200, 264, bands=[30, 60, 90])
+        print(f"ROI {roi.shape}, cache: {reader.cache_info()}")
@@ -0,0 +1,174 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+import netCDF4
+
+from envi_reader import memmap_cube
+from naive_compression import parse_hdr_file
+from netcdf_writer import write_netcdf_stream
+
+# Read workloads as weights of the three access kinds
+WORKLOADS = {
+    'spectra': {'spectra': 1.0},
+    'bands': {'bands': 1.0},
+    'rois': {'rois': 1.0},
+    'mix': {'spectra': 0.6, 'bands': 0.2, 'rois': 0.2}
+}
+
+# Size of the sample cut from the scene centre and of ROI reads
+SAMPLE_LINES = 256
+SAMPLE_SAMPLES = 256
+ROI_SIZE = 32
+
+# Chunks around this many bytes decompress quickly without too much per-chunk overhead
+TARGET_CHUNK_BYTES = 1 << 20
+
+
+def candidate_chunk_shapes(shape, dtype, target_bytes=TARGET_CHUNK_BYTES):
+    """Candidate (band, y, x) chunk shapes for a cube, from band-image to full-spectrum layouts."""
+    nbands, nrows, ncols = shape
+    itemsize = np.dtype(dtype).itemsize
+    candidates = [(1, 100, 100), (1, 256, 256)]
+    # Full spectra in every chunk, with the spatial tile sized to the target
+    for tile in (4, 8, 16, 32):
+        candidates.append((nbands, tile, tile))
+    side = int(np.sqrt(target_bytes / (nbands * itemsize)))
+    if side >= 1:
+        candidates.append((nbands, side, side))
+    # Partial spectra
+    for bands in (16, 32, 64):
+        side = int(np.sqrt(target_bytes / (bands * itemsize)))
+        candidates.append((bands, side, side))
+
+    shapes = []
+    for cb, cy, cx in candidates:
+        chunk = (max(1, min(cb, nbands)), max(1, min(cy, nrows)), max(1, min(cx, ncols)))
+        if chunk not in shapes:
+            shapes.append(chunk)
+    return shapes
+
+
+def sample_cube(cube, lines=SAMPLE_LINES, samples=SAMPLE_SAMPLES):
+    """All bands of a window from the scene centre, read into memory."""
+    _, nrows, ncols = cube.shape
+    lines, samples = min(lines, nrows), min(samples, ncols)
+    y0, x0 = (nrows - lines) // 2, (ncols - samples) // 2
+    return np.array(cube[:, y0:y0 + lines, x0:x0 + samples], dtype=cube.dtype.newbyteorder('='))
+
+
+def workload_reads(shape, workload, n_reads=20, roi_size=ROI_SIZE, seed=0):
+    """(kind, weight, index) reads making up a workload on a cube of `shape`."""
+    weights = WORKLOADS[workload] if isinstance(workload, str) else workload
+    nbands, nrows, ncols = shape
+    rng = np.random.default_rng(seed)
+    reads = []
+    for kind, weight in weights.items():
+        for _ in range(max(1, int(round(n_reads * weight)))):
+            if kind == 'spectra':
+                index = (slice(None), int(rng.integers(nrows)), int(rng.integers(ncols)))
+            elif kind == 'bands':
+                index = (int(rng.integers(nbands)), slice(None), slice(None))
+            elif kind == 'rois':
+                y, x = int(rng.integers(max(1, nrows - roi_size))), int(rng.integers(max(1, ncols - roi_size)))
+                index = (slice(None), slice(y, y + roi_size), slice(x, x + roi_size))
+            else:
+                raise ValueError(f"Unknown read kind: {kind}")
+            reads.append((kind, weight, index))
+    return reads
+
+
+def time_reads(nc_file, reads):
+    """Mean seconds per read for each kind, with the chunk cache off so every read decompresses."""
+    seconds = {}
+    with netCDF4.Dataset(nc_file) as nc:
+        var = nc.variables['data']
+        var.set_auto_maskandscale(False)
+        var.set_var_chunk_cache(size=0)
+        for kind, _, index in reads:
+            start = time.perf_counter()
+            var[index]
+            seconds.setdefault(kind, []).append(time.perf_counter() - start)
+    return {kind: float(np.mean(values)) for kind, values in seconds.items()}
+
+
+def benchmark_chunk_shapes(sample, workload='mix', encoding=None, candidates=None, n_reads=20, work_dir=None):
+    """Size and read latency of the sample for every candidate chunk shape.
+
+    Returns one dict per candidate with its compression ratio, mean latency per
+    read kind and the workload-weighted latency.
+    """
+    encoding = dict(encoding or {'zlib': True, 'complevel': 5, 'shuffle': True})
+    candidates = candidates or candidate_chunk_shapes(sample.shape, sample.dtype)
+    weights = WORKLOADS[workload] if isinstance(workload, str) else workload
+    reads = workload_reads(sample.shape, weights, n_reads=n_reads)
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for i, chunksizes in enumerate(candidates):
+            nc_file = os.path.join(tmp, f"candidate_{i}.nc")
+            write_netcdf_stream(sample, nc_file, dict(encoding, chunksizes=chunksizes))
+            latency = time_reads(nc_file, reads)
+            results.append({
+                'chunksizes': tuple(chunksizes),
+                'ratio': sample.nbytes / os.path.getsize(nc_file),
+                'latency': latency,
+                'weighted_latency': sum(weights[kind] * latency[kind] for kind in latency) / sum(weights.values())
+            })
+    return results
+
+
+def score_chunk_shapes(results, ratio_weight=0.5):
+    """Add a score to each result: ratio and speed relative to the best candidate, blended by `ratio_weight`."""
+    best_ratio = max(r['ratio'] for r in results)
+    best_latency = min(r['weighted_latency'] for r in results)
+    for r in results:
+        r['score'] = (ratio_weight * r['ratio'] / best_ratio
+                      + (1 - ratio_weight) * best_latency / r['weighted_latency'])
+    return sorted(results, key=lambda r: r['score'], reverse=True)
+
+
+def tune_chunksizes(cube, workload='mix', encoding=None, ratio_weight=0.5, n_reads=20, work_dir=None):
+    """Pick a chunk shape for a (band, y, x) cube under a declared read workload.
+
+    Candidates are sized for the full cube and benchmarked on a sample from
+    the scene centre. Returns (chunksizes, scored results, best first).
+    """
+    sample = sample_cube(cube)
+    # Candidates clipped to the sample, each remembering the full-cube shape it stands for
+    full_shapes = {}
+    for chunk in candidate_chunk_shapes(cube.shape, cube.dtype):
+        full_shapes.setdefault(tuple(min(c, s) for c, s in zip(chunk, sample.shape)), chunk)
+    results = score_chunk_shapes(
+        benchmark_chunk_shapes(sample, workload, encoding, list(full_shapes), n_reads, work_dir), ratio_weight)
+    return full_shapes[results[0]['chunksizes']], results
+
+
+def tuned_encoding(cube, compression, workload='mix', ratio_weight=0.5, var='data'):
+    """Copy of a converter's `compression` dict with `chunksizes` chosen by the tuner."""
+    chunksizes, _ = tune_chunksizes(cube, workload, compression[var], ratio_weight)
+    return {**compression, var: dict(compression[var], chunksizes=chunksizes)}
+
+
+def print_results(results):
+    """Table of the tuner's scored candidates."""
+    print(f"{'chunksizes':>16} {'ratio':>7} {'latency ms':>11} {'score':>6}")
+    for r in results:
+        print(f"{str(r['chunksizes']):>16} {r['ratio']:7.2f} {1e3 * r['weighted_latency']:11.2f} {r['score']:6.3f}")
+
+
+# Example usage
+if __name__ == "__main__":
+    from naive_compression import convert_to_netcdf_cdf4
+
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    output_nc_file = '/Users/kitlewers/Desktop/naive_compression/imagery/output_data_spectra_chunks.nc'
+
+    cube = memmap_cube(binary_file, parse_hdr_file(hdr_file))
+    chunksizes, results = tune_chunksizes(cube, workload='spectra')
+    print_results(results)
+    print(f"Chosen chunksizes: {chunksizes}")
+
+    convert_to_netcdf_cdf4(binary_file, hdr_file, output_nc_file, stream=True, chunksizes=chunksizes)
@@ -0,0 +1,72 @@
+import os
+
+import numcodecs
+import numpy as np
+
+# Codecs the converters accept; blosc_* go through the HDF5 Blosc filter plugin in NetCDF4
+CODECS = ('zlib', 'blosc_zstd', 'blosc_lz4', 'blosc_lz4hc', 'none')
+
+# netCDF4/HDF5 blosc_shuffle values
+SHUFFLE_MODES = {False: 0, 'none': 0, 'byte': 1, True: 2, 'bit': 2}
+
+
+def netcdf_encoding(codec='zlib', complevel=5, shuffle=True, chunksizes=(1, 100, 100)):
+    """Encoding dict for `data` in `to_netcdf`/`write_netcdf_stream` for a codec.
+
+    zlib keeps the converters' original keys. For Blosc, `shuffle=True` means
+    bitshuffle, which suits reflectance floats best; use 'byte' for the
+    classic byte shuffle.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec}. Choose from {CODECS}")
+    encoding = {'chunksizes': tuple(chunksizes)}
+    if codec == 'zlib':
+        encoding.update({'zlib': True, 'complevel': complevel, 'shuffle': bool(shuffle)})
+    elif codec.startswith('blosc_'):
+        encoding.update({'compression': codec, 'complevel': complevel, 'blosc_shuffle': SHUFFLE_MODES[shuffle]})
+    return encoding
+
+
+def encoding_codec(encoding):
+    """Name of the codec an encoding dict selects."""
+    if encoding.get('compression'):
+        return encoding['compression']
+    return 'zlib' if encoding.get('zlib', False) else 'none'
+
+
+def numcodecs_compressor(encoding):
+    """numcodecs compressor equivalent to a NetCDF4 encoding dict (None when uncompressed).
+
+    Used for Zarr stores and for compressing HDF5 chunks outside the library;
+    a zlib shuffle is a filter, see `numcodecs_filters`.
+    """
+    codec = encoding_codec(encoding)
+    complevel = encoding.get('complevel', 4)
+    if codec == 'zlib':
+        return numcodecs.Zlib(level=complevel)
+    if codec.startswith('blosc_'):
+        shuffle = encoding.get('blosc_shuffle', 1)
+        return numcodecs.Blosc(cname=codec.replace('blosc_', ''), clevel=complevel, shuffle=shuffle)
+    return None
+
+
+def numcodecs_filters(encoding, dtype):
+    """numcodecs filters applied before the compressor, matching the HDF5 filters of a NetCDF4 encoding.
+
+    zlib with `shuffle` gets the HDF5 byte shuffle; Blosc shuffles internally.
+    """
+    if encoding_codec(encoding) == 'zlib' and encoding.get('shuffle', False):
+        return [numcodecs.Shuffle(elementsize=np.dtype(dtype).itemsize)]
+    return None
+
+
+def set_blosc_threads(nthreads=None):
+    """Let Blosc use `nthreads` threads (default: all cores) in numcodecs and in the HDF5 plugin.
+
+    The HDF5 filter reads BLOSC_NTHREADS on every call, so this also applies
+    to files written through netCDF4.
+    """
+    nthreads = nthreads or os.cpu_count()
+    os.environ['BLOSC_NTHREADS'] = str(nthreads)
+    numcodecs.blosc.set_nthreads(nthreads)
+    return nthreads
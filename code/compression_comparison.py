@@ -1,25 +1,55 @@
 import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
-#Convert to dataframe with headers
-df = pd.read_csv("/Users/kitlewers/Desktop/naive_compression/imagery/Compression_Alexey.csv")
 
-#Quick data check of first 5 (non-header columns)
-print(df.head())
+def plot_comparison(results_csv, output_png, complevel=None, shuffle=None, chunksizes=None):
+    """Bar chart of the output size per method from benchmark.py results.
 
-# Create a scatter plot
-plt.figure(figsize=(9,8.5))
-plt.bar(df['Method'], df['Size In MB'], color='blue')
+    Each method is shown at its smallest size, optionally restricted to one
+    compression level, shuffle setting or chunk shape (e.g. '1x100x100').
+    """
+    #Convert to dataframe with headers
+    df = pd.read_csv(results_csv)
+    if complevel is not None:
+        df = df[df['complevel'] == complevel]
+    if shuffle is not None:
+        df = df[df['shuffle'] == shuffle]
+    if chunksizes is not None:
+        df = df[df['chunksizes'] == chunksizes]
 
-# Add titles and labels
-plt.title('Compression Methods vs. Size in MB')
-plt.xlabel('Method')
-plt.ylabel('Size in MB')
+    # Best run of each method
+    df = df.loc[df.groupby('method')['size_mb'].idxmin()].sort_values('size_mb', ascending=False)
 
-# Rotate x-axis labels for better readability
-plt.xticks(rotation=20)
+    #Quick data check of the selected runs
+    print(df[['method', 'codec', 'complevel', 'shuffle', 'chunksizes', 'size_mb', 'ratio']])
 
-# Save the scatter plot as an image
-plt.savefig('/Users/kitlewers/Desktop/naive_compression/imagery/bar.png')
+    # Create a bar plot
+    plt.figure(figsize=(9,8.5))
+    bars = plt.bar(df['method'], df['size_mb'], color='blue')
+    raw_mb = df['raw_mb'].iloc[0] if len(df) else np.nan
+    plt.axhline(raw_mb, color='gray', linestyle='--', label=f'Uncompressed ({raw_mb:.1f} MB)')
+    for bar, ratio in zip(bars, df['ratio']):
+        plt.annotate(f'{ratio:.1f}x', (bar.get_x() + bar.get_width() / 2, bar.get_height()),
+                     ha='center', va='bottom')
 
+    # Add titles and labels
+    plt.title('Compression Methods vs. Size in MB')
+    plt.xlabel('Method')
+    plt.ylabel('Size in MB')
+    plt.legend()
+
+    # Rotate x-axis labels for better readability
+    plt.xticks(rotation=20)
+
+    # Save the bar plot as an image
+    plt.savefig(output_png)
+    plt.close()
+
+
+# Example usage
+if __name__ == "__main__":
+    plot_comparison('/Users/kitlewers/Desktop/naive_compression/benchmark/benchmark_results.csv',
+                    '/Users/kitlewers/Desktop/naive_compression/imagery/bar.png')
@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+
+# Header fields with integer values
+INT_FIELDS = ('samples', 'lines', 'bands', 'header offset', 'data type', 'byte order', 'x start', 'y start')
+# Header fields with a single floating point value
+FLOAT_FIELDS = ('data ignore value', 'reflectance scale factor')
+# Header fields holding one number per band
+ARRAY_FIELDS = ('wavelength', 'fwhm', 'bbl', 'data gain values', 'data offset values')
+# Brace fields that are free text rather than comma-separated lists
+TEXT_FIELDS = ('description',)
+
+# Water vapour absorption windows in nm, where AVIRIS-NG reflectance is mostly noise
+ABSORPTION_WINDOWS_NM = ((1340, 1445), (1790, 1955))
+
+# Positions of the `map info` list items
+MAP_INFO_KEYS = ('projection', 'reference_x', 'reference_y', 'easting', 'northing', 'pixel_size_x', 'pixel_size_y')
+
+
+def iter_header_fields(lines):
+    """Yield (key, raw value) for every `key = value` field, joining `{...}` values that span lines.
+
+    Keys are lower-case; a brace value is returned with its braces and
+    newlines, so the caller decides how to split it.
+    """
+    key, parts = None, []
+    for line in lines:
+        if key is not None:
+            # Inside a multi-line {...} value
+            parts.append(line.strip())
+            if '}' in line:
+                yield key, ' '.join(parts)
+                key, parts = None, []
+            continue
+        name, sep, value = line.partition('=')
+        if not sep:
+            continue
+        name, value = name.strip().lower(), value.strip()
+        if value.startswith('{') and '}' not in value:
+            key, parts = name, [value]
+        else:
+            yield name, value
+    if key is not None:
+        raise ValueError(f"Unterminated {{...}} value for header field '{key}'")
+
+
+def split_brace_value(value):
+    """Items of a `{a, b, c}` value as stripped strings."""
+    return [item.strip() for item in value.strip().lstrip('{').rstrip('}').split(',')]
+
+
+def parse_map_info(items):
+    """`map info` items as a dict with numbers where ENVI defines them (zone, datum and units kept as text)."""
+    info = {}
+    for i, key in enumerate(MAP_INFO_KEYS):
+        if i < len(items):
+            info[key] = items[i] if key == 'projection' else float(items[i])
+    rest = items[len(MAP_INFO_KEYS):]
+    if info.get('projection', '').upper().startswith('UTM') and len(rest) >= 2:
+        info['zone'], info['hemisphere'] = int(rest[0]), rest[1]
+        rest = rest[2:]
+    for item in rest:
+        name, sep, value = item.partition('=')
+        if sep:
+            info[name.strip().lower()] = value.strip()
+        elif 'datum' not in info:
+            info['datum'] = item
+    return info
+
+
+def typed_value(key, value):
+    """Convert a raw header value to int, float, numpy array, dict (map info), list or str."""
+    if value.startswith('{'):
+        if key in TEXT_FIELDS:
+            return value.strip()[1:-1].strip()
+        items = split_brace_value(value)
+        if key in ARRAY_FIELDS:
+            return np.array([float(item) for item in items if item])
+        if key == 'map info':
+            return parse_map_info(items)
+        return items
+    if key in INT_FIELDS:
+        return int(value)
+    if key in FLOAT_FIELDS or key in ARRAY_FIELDS:
+        return float(value)
+    return value
+
+
+def read_envi_header(hdr_file):
+    """Parse an ENVI .hdr file in one pass into typed values.
+
+    Integers (shape, data type, byte order, offset) become int, per-band lists
+    (wavelength, fwhm, bbl, gains/offsets) numpy arrays, `map info` a dict and
+    other {...} lists lists of strings; multi-line {...} blocks are joined.
+    """
+    with open(hdr_file, 'r') as file:
+        return {key: typed_value(key, value) for key, value in iter_header_fields(file)}
+
+
+def parse_hdr_file(hdr_file):
+    """Parse the ENVI .hdr file to extract metadata.
+
+    Values are strings and {...} values lists of strings, as the converters
+    have always used them, but multi-line blocks such as `wavelength` and
+    `map info` are no longer dropped.
+    """
+    metadata = {}
+    with open(hdr_file, 'r') as file:
+        for key, value in iter_header_fields(file):
+            if value.startswith('{'):
+                value = value.strip()[1:-1].strip() if key in TEXT_FIELDS else split_brace_value(value)
+            metadata[key] = value
+    return metadata
+
+
+def wavelengths_nm(header):
+    """Band centre wavelengths in nm from a typed header, or None if the header has none."""
+    wavelength = header.get('wavelength')
+    if wavelength is None:
+        return None
+    units = str(header.get('wavelength units', '')).lower()
+    if units.startswith('micro') or units == 'um' or (not units and wavelength.max() < 100):
+        return wavelength * 1000
+    return wavelength
+
+
+def absorption_bands(wavelength, windows=ABSORPTION_WINDOWS_NM):
+    """Boolean mask of the bands whose wavelength (nm) falls in an absorption window."""
+    wavelength = np.asarray(wavelength)
+    mask = np.zeros(wavelength.shape, dtype=bool)
+    for low, high in windows:
+        mask |= (wavelength >= low) & (wavelength <= high)
+    return mask
+
+
+def find_scenes(root, binary_suffixes=('', '.img', '.bin', '.dat')):
+    """(binary_file, hdr_file) pairs of every ENVI scene under `root`, sorted by path.
+
+    A header `scene.hdr` (or `scene.img.hdr`) is paired with the first of
+    `scene`, `scene.img`, `scene.bin` or `scene.dat` that exists.
+    """
+    scenes = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.lower().endswith('.hdr'):
+                continue
+            hdr_file = os.path.join(dirpath, filename)
+            base = hdr_file[:-4]
+            for suffix in binary_suffixes:
+                if os.path.isfile(base + suffix):
+                    scenes.append((base + suffix, hdr_file))
+                    break
+    return sorted(scenes)
+
+
+# Example usage
+if __name__ == "__main__":
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+
+    header = read_envi_header(hdr_file)
+    wavelength = wavelengths_nm(header)
+    print(f"{header['bands']} bands, {header['lines']} x {header['samples']}, map info: {header.get('map info')}")
+    if wavelength is not None:
+        print(f"Absorption bands: {np.flatnonzero(absorption_bands(wavelength)).tolist()}")
@@ -0,0 +1,141 @@
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+# ENVI data type codes mapped to numpy types
+ENVI_DATA_TYPES = {
+    '1': np.uint8,
+    '2': np.int16,
+    '3': np.int32,
+    '4': np.float32,
+    '5': np.float64,
+    '12': np.uint16,
+    '13': np.uint32,
+    '14': np.int64,
+    '15': np.uint64
+}
+
+# Axis order of the raw file for each interleave, and the transpose that gives (band, y, x)
+INTERLEAVE_LAYOUTS = {
+    'bsq': (('band', 'y', 'x'), (0, 1, 2)),
+    'bil': (('y', 'band', 'x'), (1, 0, 2)),
+    'bip': (('y', 'x', 'band'), (2, 0, 1))
+}
+
+
+def header_value(hdr_metadata, key, default=None):
+    """Return a scalar header value as a stripped string (first item for {...} lists)."""
+    value = hdr_metadata.get(key, default)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else default
+    return None if value is None else str(value).strip()
+
+
+def envi_dtype(hdr_metadata):
+    """Numpy dtype for the cube, including the byte order declared in the header."""
+    code = header_value(hdr_metadata, 'data type')
+    if code not in ENVI_DATA_TYPES:
+        raise ValueError(f"Unsupported or unknown data type: {code}")
+    byte_order = '>' if header_value(hdr_metadata, 'byte order', '0') == '1' else '<'
+    return np.dtype(ENVI_DATA_TYPES[code]).newbyteorder(byte_order)
+
+
+def cube_shape(hdr_metadata):
+    """(bands, lines, samples) of the cube described by the header."""
+    return (int(header_value(hdr_metadata, 'bands')),
+            int(header_value(hdr_metadata, 'lines')),
+            int(header_value(hdr_metadata, 'samples')))
+
+
+def cube_interleave(hdr_metadata):
+    """Interleave of the raw file ('bsq', 'bil' or 'bip')."""
+    interleave = header_value(hdr_metadata, 'interleave', 'bsq').lower()
+    if interleave not in INTERLEAVE_LAYOUTS:
+        raise ValueError(f"Unsupported interleave format: {interleave}")
+    return interleave
+
+
+def open_memmap(binary_file, hdr_metadata, mode='r'):
+    """Memory-map the binary file in its on-disk interleave, honoring `header offset`."""
+    nbands, nrows, ncols = cube_shape(hdr_metadata)
+    interleave = cube_interleave(hdr_metadata)
+    sizes = {'band': nbands, 'y': nrows, 'x': ncols}
+    raw_shape = tuple(sizes[dim] for dim in INTERLEAVE_LAYOUTS[interleave][0])
+    offset = int(header_value(hdr_metadata, 'header offset', '0'))
+    return np.memmap(binary_file, dtype=envi_dtype(hdr_metadata), mode=mode,
+                     offset=offset, shape=raw_shape)
+
+
+def memmap_cube(binary_file, hdr_metadata, mode='r'):
+    """(band, y, x) view of the memory-mapped cube. Nothing is read until it is indexed."""
+    raw = open_memmap(binary_file, hdr_metadata, mode=mode)
+    return raw.transpose(INTERLEAVE_LAYOUTS[cube_interleave(hdr_metadata)][1])
+
+
+def read_band(cube, band):
+    """View of a single band (y, x) without copying."""
+    return cube[band]
+
+
+def read_lines(cube, start, stop):
+    """View of all bands for image lines [start, stop) without copying."""
+    return cube[:, start:stop, :]
+
+
+def read_window(cube, y0, y1, x0, x1, bands=slice(None)):
+    """View of a spatial window, optionally restricted to a band slice.
+
+    Slices are views of the memory map; a list of band indices produces a copy
+    of just the selected bands.
+    """
+    return cube[bands, y0:y1, x0:x1]
+
+
+class EnviBackendArray(BackendArray):
+    """Lazily indexed ENVI cube that only reads the pages a selection touches."""
+
+    def __init__(self, binary_file, hdr_metadata):
+        self.binary_file = binary_file
+        self.hdr_metadata = hdr_metadata
+        self.shape = cube_shape(hdr_metadata)
+        self.dtype = envi_dtype(hdr_metadata).newbyteorder('=')
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._raw_indexing_method)
+
+    def _raw_indexing_method(self, key):
+        cube = memmap_cube(self.binary_file, self.hdr_metadata)
+        # Slices and integers stay views of the memory map
+        cube = cube[tuple(k if isinstance(k, (slice, int, np.integer)) else slice(None) for k in key)]
+        # Index arrays are applied one axis at a time so only the selected items are read
+        axis = 0
+        for k in key:
+            if isinstance(k, (int, np.integer)):
+                continue
+            if not isinstance(k, slice):
+                cube = np.take(cube, k, axis=axis)
+            axis += 1
+        return np.asarray(cube, dtype=self.dtype)
+
+
+def open_envi_dataarray(binary_file, hdr_metadata, name='data'):
+    """Open the cube as a lazily indexed (band, y, x) xarray DataArray."""
+    backend_array = EnviBackendArray(binary_file, hdr_metadata)
+    nbands, nrows, ncols = backend_array.shape
+    variable = xr.Variable(('band', 'y', 'x'), indexing.LazilyIndexedArray(backend_array))
+    return xr.DataArray(
+        variable,
+        coords={
+            'band': np.arange(1, nbands + 1),
+            'y': np.arange(nrows),
+            'x': np.arange(ncols)
+        },
+        name=name
+    )
+
+
+def open_envi_dataset(binary_file, hdr_metadata, name='data'):
+    """Open the cube as a lazily indexed xarray Dataset with a single `data` variable."""
+    return open_envi_dataarray(binary_file, hdr_metadata, name=name).to_dataset()
@@ -0,0 +1,191 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from bitinfo import bitinformation_from_counts, bitpair_counts_by_band
+from chunk_reader import CompressedCubeReader
+from envi_header import parse_hdr_file
+from envi_reader import memmap_cube
+
+# Originals closer to zero than this are left out of the relative error
+REL_ERROR_FLOOR = 1e-4
+
+
+def open_compressed(path):
+    """Lazily opened Dataset of a converted NetCDF file or Zarr store, decoded by xarray.
+
+    CF scale_factor/add_offset are applied and _FillValue becomes NaN; only
+    the blocks of `data` that are indexed are read and decompressed. Close
+    it (or use it as a context manager) when done.
+    """
+    if os.path.isdir(path) or path.endswith('.zarr'):
+        return xr.open_zarr(path, chunks=None)
+    return xr.open_dataset(path)
+
+
+def stored_block_lines(data, default=100):
+    """Lines per chunk of a stored variable, so blocks line up with whole chunks."""
+    chunks = data.encoding.get('chunksizes') or data.encoding.get('chunks') or data.encoding.get('preferred_chunks')
+    if isinstance(chunks, dict):
+        chunks = [chunks.get(dim) for dim in data.dims]
+    return int(chunks[1]) if chunks and chunks[1] else default
+
+
+def compare_to_original(binary_file, hdr_file, compressed_path, inverse=None, nodata=-9999, block_lines=None,
+                        bit_information=True, angle_map=False, rel_floor=REL_ERROR_FLOOR):
+    """Error metrics of a compressed output against its ENVI original in one streaming pass.
+
+    Both cubes are read a block of whole chunk rows at a time, so memory is
+    bounded by the block and not the scene. Pixels that are `nodata` in the
+    original are ignored. `inverse` maps stored values back to reflectance
+    for outputs without CF attributes (e.g. `lambda v: v / 1e10` for
+    int_compression.convert_to_netcdf). Outputs written with a spectral
+    predictor are read and decoded through chunk_reader.
+
+    Returns (per_band, summary[, angle]): a DataFrame with per-band max
+    absolute error, RMSE, bias, mean/max relative error (originals above
+    `rel_floor`) and the fraction of bit information preserved (information
+    along x, as bitinfo computes it; above 1 when quantization adds regular
+    patterns of its own); a dict of scene-wide values including
+    the mean and max spectral angle between original and decoded spectra;
+    and with `angle_map` the (y, x) spectral angle in degrees.
+    """
+    cube = memmap_cube(binary_file, parse_hdr_file(hdr_file))
+    ds = open_compressed(compressed_path)
+    reader = None
+    try:
+        data = ds['data']
+        if data.shape != cube.shape:
+            raise ValueError(f"Shape mismatch: original {cube.shape}, compressed {data.shape}")
+        nbands, nrows, ncols = cube.shape
+        block_lines = block_lines or stored_block_lines(data)
+        # xarray would apply CF decoding to the prediction residuals themselves
+        if 'spectral_predictor' in data.attrs:
+            reader = CompressedCubeReader(compressed_path)
+        float_source = cube.dtype.kind == 'f'
+        bit_information = bit_information and float_source
+
+        count = np.zeros(nbands, dtype=np.int64)
+        sum_error = np.zeros(nbands)
+        sum_squared = np.zeros(nbands)
+        max_abs = np.zeros(nbands)
+        rel_count = np.zeros(nbands, dtype=np.int64)
+        sum_rel = np.zeros(nbands)
+        max_rel = np.zeros(nbands)
+        counts_original = counts_decoded = 0
+        angle_sum, angle_max, angle_count = 0.0, 0.0, 0
+        angles = np.full((nrows, ncols), np.nan, dtype=np.float32) if angle_map else None
+
+        for y0 in range(0, nrows, block_lines):
+            y1 = min(y0 + block_lines, nrows)
+            source = np.array(cube[:, y0:y1, :], dtype=cube.dtype.newbyteorder('='))
+            if reader is not None:
+                decoded = np.asarray(reader.get_roi(y0, y1, 0, ncols), dtype=np.float64)
+            else:
+                decoded = np.asarray(data[:, y0:y1, :].values, dtype=np.float64)
+            if inverse is not None:
+                decoded = np.asarray(inverse(decoded), dtype=np.float64)
+            original = source.astype(np.float64)
+            valid = (original != nodata) & ~np.isnan(original)
+
+            error = np.where(valid, decoded - original, 0.0)
+            abs_error = np.abs(error)
+            count += valid.sum(axis=(1, 2))
+            sum_error += error.sum(axis=(1, 2))
+            sum_squared += np.einsum('byx,byx->b', error, error)
+            max_abs = np.maximum(max_abs, np.nanmax(abs_error, axis=(1, 2), initial=0.0))
+            rel_valid = valid & (np.abs(original) >= rel_floor)
+            relative = np.where(rel_valid, abs_error / np.where(rel_valid, np.abs(original), 1.0), 0.0)
+            rel_count += rel_valid.sum(axis=(1, 2))
+            sum_rel += relative.sum(axis=(1, 2))
+            max_rel = np.maximum(max_rel, relative.max(axis=(1, 2), initial=0.0))
+
+            # Spectral angle over the bands valid in each pixel
+            masked_original = np.where(valid, original, 0.0)
+            masked_decoded = np.where(valid, np.nan_to_num(decoded), 0.0)
+            dot = np.einsum('byx,byx->yx', masked_original, masked_decoded)
+            norms = np.sqrt(np.einsum('byx,byx->yx', masked_original, masked_original)
+                            * np.einsum('byx,byx->yx', masked_decoded, masked_decoded))
+            has_spectrum = norms > 0
+            angle = np.degrees(np.arccos(np.clip(dot[has_spectrum] / norms[has_spectrum], -1.0, 1.0)))
+            angle_sum += float(angle.sum())
+            angle_count += angle.size
+            angle_max = max(angle_max, float(angle.max(initial=0.0)))
+            if angles is not None:
+                angles[y0:y1][has_spectrum] = angle
+
+            if bit_information:
+                # Same pixels on both sides: nodata in the original is nodata in the decoded block too
+                decoded_bits = np.where(valid, decoded, nodata).astype(source.dtype)
+                counts_original = counts_original + bitpair_counts_by_band(source, dim='x', masked_value=nodata,
+                                                                           block_lines=block_lines)
+                counts_decoded = counts_decoded + bitpair_counts_by_band(decoded_bits, dim='x', masked_value=nodata,
+                                                                         block_lines=block_lines)
+    finally:
+        if reader is not None:
+            reader.close()
+        ds.close()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per_band = pd.DataFrame({
+            'band': np.arange(1, nbands + 1),
+            'valid_pixels': count,
+            'max_abs_error': np.where(count > 0, max_abs, np.nan),
+            'rmse': np.sqrt(sum_squared / count),
+            'bias': sum_error / count,
+            'mean_rel_error': sum_rel / rel_count,
+            'max_rel_error': np.where(rel_count > 0, max_rel, np.nan)
+        })
+        if bit_information:
+            info_original = bitinformation_from_counts(counts_original).sum(axis=-1)
+            info_decoded = bitinformation_from_counts(counts_decoded).sum(axis=-1)
+            per_band['bitinfo_original'] = info_original
+            per_band['bitinfo_preserved'] = np.where(info_original > 0, info_decoded / info_original, np.nan)
+
+    total = count.sum()
+    summary = {
+        'original': binary_file,
+        'compressed': compressed_path,
+        'valid_values': int(total),
+        'max_abs_error': float(max_abs.max()) if total else float('nan'),
+        'rmse': float(np.sqrt(sum_squared.sum() / total)) if total else float('nan'),
+        'bias': float(sum_error.sum() / total) if total else float('nan'),
+        'mean_rel_error': float(sum_rel.sum() / rel_count.sum()) if rel_count.sum() else float('nan'),
+        'max_rel_error': float(max_rel.max()) if rel_count.sum() else float('nan'),
+        'mean_spectral_angle_deg': angle_sum / angle_count if angle_count else float('nan'),
+        'max_spectral_angle_deg': angle_max
+    }
+    if bit_information:
+        total_info = info_original.sum()
+        summary['bitinfo_preserved'] = float(info_decoded.sum() / total_info) if total_info else float('nan')
+    if angle_map:
+        return per_band, summary, angles
+    return per_band, summary
+
+
+def write_metrics(per_band, summary, output_prefix):
+    """Write per-band metrics as CSV and the summary as JSON; returns both paths."""
+    csv_file, json_file = f"{output_prefix}_by_band.csv", f"{output_prefix}_summary.json"
+    per_band.to_csv(csv_file, index=False)
+    with open(json_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return csv_file, json_file
+
+
+# Example usage
+if __name__ == "__main__":
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    outputs = {
+        'sigfigs': ('/Users/kitlewers/Desktop/naive_compression/imagery/output_data_four_sigfigs.nc', None),
+        'int': ('/Users/kitlewers/Desktop/naive_compression/imagery/int_10_output_data.nc', lambda v: v / 1e10),
+        'bitround': ('/Users/kitlewers/Desktop/naive_compression/imagery/lossy_xbitinfo_compression.nc', None)
+    }
+
+    for method, (compressed_path, inverse) in outputs.items():
+        per_band, summary = compare_to_original(binary_file, hdr_file, compressed_path, inverse=inverse)
+        write_metrics(per_band, summary, compressed_path.replace('.nc', '_errors'))
+        print(f"{method}: max error {summary['max_abs_error']:.2e}, RMSE {summary['rmse']:.2e}, "
+              f"mean angle {summary['mean_spectral_angle_deg']:.4f} deg")
@@ -0,0 +1,173 @@
+import cProfile
+import io
+import json
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Recorder the pipeline stages report to; None means stages cost nothing but two attribute lookups
+_active = None
+_lock = threading.Lock()
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes (ru_maxrss is bytes on macOS, KB on Linux)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RunRecorder:
+    """Wall time, CPU time, bytes in/out and peak-RSS growth of each stage of one conversion run.
+
+    A stage name can be entered many times (once per block in the streaming
+    writers); its calls are summed. CPU time is process-wide, so a stage
+    that waits on worker threads includes their CPU. With `profile_stage`,
+    that stage runs under cProfile and the top functions go into the report.
+    """
+
+    def __init__(self, name, profile_stage=None, profile_top=25):
+        self.name = name
+        self.stages = {}
+        self.profile_stage = profile_stage
+        self.profile_top = profile_top
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._rss_start = peak_rss_bytes()
+        self.pipelines = []
+        self.finished = None
+
+    def add(self, name, wall, cpu, bytes_in=0, bytes_out=0, rss_delta=0, calls=1):
+        """Add one call of a stage (or `calls` calls already summed, e.g. by a worker process)."""
+        with _lock:
+            stats = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                  'bytes_in': 0, 'bytes_out': 0, 'rss_delta_bytes': 0})
+            stats['calls'] += calls
+            stats['wall_seconds'] += wall
+            stats['cpu_seconds'] += cpu
+            stats['bytes_in'] += int(bytes_in)
+            stats['bytes_out'] += int(bytes_out)
+            stats['rss_delta_bytes'] += int(rss_delta)
+
+    def finish(self):
+        """Close the run; totals are taken here."""
+        self.finished = {
+            'wall_seconds': time.perf_counter() - self._start,
+            'cpu_seconds': time.process_time() - self._cpu_start,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'rss_delta_bytes': peak_rss_bytes() - self._rss_start
+        }
+
+    def report(self):
+        """The run as a JSON-serializable dict, with throughput per stage and the profile if any."""
+        stages = {}
+        for name, stats in self.stages.items():
+            stats = dict(stats)
+            stats['in_mbps'] = stats['bytes_in'] / 1e6 / stats['wall_seconds'] if stats['wall_seconds'] else None
+            stages[name] = stats
+        report = {'name': self.name, 'started': self.started, **(self.finished or {}), 'stages': stages}
+        if self.pipelines:
+            report['pipelines'] = self.pipelines
+        if self.profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(self.profile_top)
+            report['profile_stage'] = self.profile_stage
+            report['profile'] = stream.getvalue()
+        return report
+
+    def write_json(self, json_file):
+        with open(json_file, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return json_file
+
+
+@contextmanager
+def record_run(name, json_file=None, profile_stage=None, profile_file=None):
+    """Record every instrumented stage run inside the block; yields the RunRecorder.
+
+    The report is written to `json_file` when given, and the raw profile of
+    `profile_stage` to `profile_file` (open with pstats or snakeviz).
+    """
+    global _active
+    recorder = RunRecorder(name, profile_stage=profile_stage)
+    previous, _active = _active, recorder
+    try:
+        yield recorder
+    finally:
+        _active = previous
+        recorder.finish()
+        if json_file:
+            recorder.write_json(json_file)
+        if profile_file and recorder.profiler is not None:
+            recorder.profiler.dump_stats(profile_file)
+
+
+@contextmanager
+def stage(name, bytes_in=0):
+    """Time a pipeline stage for the active run; a no-op outside `record_run`.
+
+    Set `bytes_out` on the yielded dict once the output is known.
+    """
+    recorder = _active
+    info = {'bytes_out': 0}
+    if recorder is None:
+        yield info
+        return
+    profile = recorder.profiler is not None and recorder.profile_stage == name
+    rss_before = peak_rss_bytes()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    if profile:
+        recorder.profiler.enable()
+    try:
+        yield info
+    finally:
+        if profile:
+            recorder.profiler.disable()
+        recorder.add(name, time.perf_counter() - start, time.process_time() - cpu_start, bytes_in,
+                     info['bytes_out'], peak_rss_bytes() - rss_before)
+
+
+def merge_stages(stages):
+    """Add the stages a worker process recorded (its RunRecorder.stages) to the active run."""
+    recorder = _active
+    if recorder is not None:
+        for name, stats in stages.items():
+            recorder.add(name, stats['wall_seconds'], stats['cpu_seconds'], stats['bytes_in'], stats['bytes_out'],
+                         stats['rss_delta_bytes'], calls=stats['calls'])
+
+
+def record_queues(stats):
+    """Attach the queue and stall statistics of a pipelined write (see pipeline) to the active run."""
+    recorder = _active
+    if recorder is not None:
+        with _lock:
+            recorder.pipelines.append(stats)
+
+
+def print_report(report):
+    """Table of a run's stages, slowest first."""
+    print(f"{report['name']}: {report.get('wall_seconds', 0):.2f} s wall, {report.get('cpu_seconds', 0):.2f} s CPU, "
+          f"peak RSS {report.get('peak_rss_bytes', 0) / 1e6:.0f} MB")
+    print(f"{'stage':>12} {'calls':>6} {'wall s':>8} {'cpu s':>8} {'MB in':>9} {'MB out':>9} {'MB/s':>8} {'+RSS MB':>8}")
+    for name, s in sorted(report['stages'].items(), key=lambda item: -item[1]['wall_seconds']):
+        mbps = f"{s['in_mbps']:8.1f}" if s['in_mbps'] else f"{'':>8}"
+        print(f"{name:>12} {s['calls']:6d} {s['wall_seconds']:8.2f} {s['cpu_seconds']:8.2f} {s['bytes_in'] / 1e6:9.1f} "
+              f"{s['bytes_out'] / 1e6:9.1f} {mbps} {s['rss_delta_bytes'] / 1e6:8.1f}")
+
+
+# Example usage
+if __name__ == "__main__":
+    from naive_compression_sigfigs import convert_to_netcdf_cdf4
+
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    output_nc_file = '/Users/kitlewers/Desktop/naive_compression/imagery/output_data_four_sigfigs.nc'
+
+    with record_run('sigfigs', json_file=output_nc_file.replace('.nc', '_stages.json'),
+                    profile_stage='transform', profile_file=output_nc_file.replace('.nc', '_transform.prof')) as run:
+        convert_to_netcdf_cdf4(binary_file, hdr_file, output_nc_file, stream=True)
+    print_report(run.report())
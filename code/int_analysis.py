@@ -1,88 +1,125 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
-
-def parse_hdr_file(hdr_file):
-    """Parse the ENVI .hdr file to extract metadata."""
-    metadata = {}
-    with open(hdr_file, 'r') as file:
-        for line in file:
-            key_value = line.strip().split('=')
-            if len(key_value) == 2:
-                key, value = key_value
-                key = key.strip().lower()
-                value = value.strip()
-                if '{' in value:  # Handle lists
-                    value = value.replace('{', '').replace('}', '').split(',')
-                    value = [v.strip() for v in value]
-                metadata[key] = value
-    return metadata
-
-def map_envi_data_type(envi_data_type):
-    """Map ENVI data types to numpy data types."""
-    data_type_mapping = {
-        '1': np.uint8,
-        '2': np.int16,
-        '3': np.int32,
-        '4': np.float32,
-        '5': np.float64,
-        '12': np.uint16,
-        '13': np.uint32,
-        '14': np.int64,
-        '15': np.uint64
-    }
-    return data_type_mapping.get(envi_data_type, None)
+from envi_header import parse_hdr_file
+from envi_reader import memmap_cube
 
 def load_binary_file(binary_file, hdr_metadata):
-    """Load binary data using the metadata from the .hdr file."""
-    nrows = int(hdr_metadata['lines'])
-    ncols = int(hdr_metadata['samples'])
-    nbands = int(hdr_metadata['bands'])
-    dtype = map_envi_data_type(hdr_metadata['data type'][0])  # Map the ENVI data type
+    """Memory-map binary data using the metadata from the .hdr file.
+
+    Returns a (band, y, x) view of the file; pages are only read when indexed.
+    """
+    return memmap_cube(binary_file, hdr_metadata)
+
+def str_decimal_places(values):
+    """Decimal places of each value read off `str(val)` (the original per-pixel method)."""
+    places = np.zeros(values.shape, dtype=np.int64)
+    for i, val in enumerate(values):
+        text = str(val)
+        places[i] = len(text.split('.')[-1]) if '.' in text else 0
+    return places
 
-    if dtype is None:
-        raise ValueError(f"Unsupported or unknown data type: {hdr_metadata['data type'][0]}")
+def decimal_places(values):
+    """Decimal places `str(val)` shows for each value, computed without Python loops.
 
-    interleave = hdr_metadata['interleave'].lower()
+    numpy prints the shortest decimal string that round-trips, so the count is
+    the fewest fraction digits (at least one) whose rounding maps back to the
+    same float. Values numpy prints in scientific notation (below 1e-4 or from
+    1e6 up for float32) count the mantissa fraction plus the exponent suffix
+    (e.g. '1.5e-05' -> 5), as splitting `str(val)` on '.' does.
 
-    # Read the binary data
-    data = np.fromfile(binary_file, dtype=dtype)
+    The search runs in float64, which is exact for float32 data. Other float
+    types fall back to `str()` per value.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind != 'f':
+        return np.zeros(values.shape, dtype=np.int64)  # No decimal point for integers
+    flat = values.reshape(-1)
+    if values.dtype != np.float32:
+        return str_decimal_places(flat).reshape(values.shape)
 
-    # Reshape the data based on interleave format
-    if interleave == 'bil':
-        data = data.reshape((nrows, nbands, ncols)).transpose(1, 0, 2)  # Band Interleaved by Line
-    elif interleave == 'bsq':
-        data = data.reshape((nbands, nrows, ncols))  # Band Sequential
-    elif interleave == 'bip':
-        data = data.reshape((nrows, ncols, nbands)).transpose(2, 0, 1)  # Band Interleaved by Pixel
-    else:
-        raise ValueError(f"Unsupported interleave format: {interleave}")
+    x = flat.astype(np.float64)
+    absx = np.abs(x)
+    places = np.zeros(flat.shape, dtype=np.int64)  # nan and inf have no decimal point
+    finite = np.isfinite(x)
+    scientific = finite & (absx != 0) & ((absx < 1e-4) | (absx >= 1e6))
 
-    return data
+    # Positional values: grow the fraction digits until the value round-trips (at most 13)
+    idx = np.flatnonzero(finite & ~scientific)
+    digits = 1
+    while idx.size:
+        round_trips = np.round(x[idx], digits).astype(np.float32) == flat[idx]
+        places[idx[round_trips]] = digits
+        idx = idx[~round_trips]
+        digits += 1
+
+    # Scientific values: grow the significant digits until the value round-trips (at most 9)
+    idx = np.flatnonzero(scientific)
+    exponent = np.floor(np.log10(absx[idx]))
+    significant = 1
+    while idx.size:
+        # Divide by exact powers of ten for large values so ties are decided exactly
+        shift = significant - 1 - exponent
+        up = np.power(10.0, np.maximum(shift, 0))
+        down = np.power(10.0, np.maximum(-shift, 0))
+        round_trips = (np.rint(x[idx] * up / down) * down / up).astype(np.float32) == flat[idx]
+        if significant > 1:
+            places[idx[round_trips]] = significant - 1 + 4  # 'e-05' style exponent suffix
+        idx = idx[~round_trips]
+        exponent = exponent[~round_trips]
+        significant += 1
+    return places.reshape(values.shape)
 
 def count_decimal_places(data):
-    """Count the number of decimal places for each value."""
-    decimal_places = []
-    for val in data.flatten():
-        if val != -9999:  # Ignore invalid values
-            if '.' in str(val):  # Only consider values with decimal points
-                decimal_part = str(val).split('.')[-1]
-                decimal_places.append(len(decimal_part))
-            else:
-                decimal_places.append(0)  # No decimal places for integers
-    return np.array(decimal_places)
+    """Count the number of decimal places for each value, ignoring -9999."""
+    data = np.asarray(data).reshape(-1)
+    return decimal_places(data[data != -9999])
+
+def decimal_place_histogram(data, per_band=False, sample_fraction=None, block_lines=256, seed=None):
+    """Histogram of decimal places over a (band, y, x) cube, excluding -9999.
+
+    The cube is processed `block_lines` lines at a time and counts are
+    accumulated with `bincount`, so memory stays bounded for full scenes.
+    With `per_band=True` the result has one row per band. `sample_fraction`
+    counts a random subsample of the pixels for a quick look.
+    """
+    rng = np.random.default_rng(seed)
+    nbands, nrows, _ = data.shape
+    histogram = np.zeros((nbands, 1), dtype=np.int64)
+    for y0 in range(0, nrows, block_lines):
+        block = np.asarray(data[:, y0:y0 + block_lines, :])
+        valid = block != -9999  # Ignore invalid values
+        if sample_fraction is not None:
+            valid &= rng.random(block.shape) < sample_fraction
+        places = decimal_places(block[valid])
+        band_index = np.broadcast_to(np.arange(nbands)[:, None, None], block.shape)[valid]
+        width = max(histogram.shape[1], int(places.max(initial=0)) + 1)
+        if width > histogram.shape[1]:
+            histogram = np.pad(histogram, ((0, 0), (0, width - histogram.shape[1])))
+        histogram += np.bincount(band_index * width + places, minlength=nbands * width).reshape(nbands, width)
+    return histogram if per_band else histogram.sum(axis=0)
+
+def histogram_median(histogram):
+    """Median of the values counted by a histogram (same convention as np.median)."""
+    cumulative = np.cumsum(histogram)
+    total = cumulative[-1]
+    lower = np.searchsorted(cumulative, (total - 1) // 2, side='right')
+    upper = np.searchsorted(cumulative, total // 2, side='right')
+    return (lower + upper) / 2
 
 # Function to generate distribution plot and summary table
-def analyze_decimal_places(binary_file, hdr_file):
+def analyze_decimal_places(binary_file, hdr_file, sample_fraction=None):
     # Load binary data
     hdr_metadata = parse_hdr_file(hdr_file)
     data = load_binary_file(binary_file, hdr_metadata)
 
     # Count decimal places excluding -9999 values
-    decimal_places = count_decimal_places(data)
+    histogram = decimal_place_histogram(data, sample_fraction=sample_fraction)
+    places = np.arange(len(histogram))
+    counted = places[histogram > 0]
 
     # Plot the distribution of decimal places
-    plt.hist(decimal_places, bins=np.arange(0, max(decimal_places) + 2) - 0.5, edgecolor='black')
+    plt.bar(places, histogram, width=1.0, edgecolor='black')
     plt.xlabel('Number of Decimal Places')
     plt.ylabel('Frequency')
     plt.title('Distribution of Decimal Places in the Data')
@@ -90,11 +127,11 @@ def analyze_decimal_places(binary_file, hdr_file):
 
     # Create a summary table of statistics
     summary_stats = {
-        "Mean Decimal Places": [np.mean(decimal_places)],
-        "Median Decimal Places": [np.median(decimal_places)],
-        "Max Decimal Places": [np.max(decimal_places)],
-        "Min Decimal Places": [np.min(decimal_places)],
-        "Total Valid Values": [len(decimal_places)]
+        "Mean Decimal Places": [np.sum(places * histogram) / np.sum(histogram)],
+        "Median Decimal Places": [histogram_median(histogram)],
+        "Max Decimal Places": [counted.max()],
+        "Min Decimal Places": [counted.min()],
+        "Total Valid Values": [np.sum(histogram)]
     }
 
     summary_df = pd.DataFrame(summary_stats)
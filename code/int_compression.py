@@ -1,91 +1,174 @@
 import numpy as np
 import xarray as xr
 import os
-
-def parse_hdr_file(hdr_file):
-    """Parse the ENVI .hdr file to extract metadata."""
-    metadata = {}
-    with open(hdr_file, 'r') as file:
-        for line in file:
-            key_value = line.strip().split('=')
-            if len(key_value) == 2:
-                key, value = key_value
-                key = key.strip().lower()
-                value = value.strip()
-                if '{' in value:  # Handle lists
-                    value = value.replace('{', '').replace('}', '').split(',')
-                    value = [v.strip() for v in value]
-                metadata[key] = value
-    return metadata
-
-def map_envi_data_type(envi_data_type):
-    """Map ENVI data types to numpy data types."""
-    data_type_mapping = {
-        '1': np.uint8,
-        '2': np.int16,
-        '3': np.int32,
-        '4': np.float32,  # Your data type
-        '5': np.float64,
-        '12': np.uint16,
-        '13': np.uint32,
-        '14': np.int64,
-        '15': np.uint64
-    }
-    return data_type_mapping.get(envi_data_type, None)
+from functools import partial
+from compression_codecs import netcdf_encoding
+from envi_header import parse_hdr_file
+from envi_reader import memmap_cube
+from instrumentation import stage
+from netcdf_writer import write_netcdf_stream
+from zarr_writer import write_zarr_from_envi
 
 def load_binary_file(binary_file, hdr_metadata):
-    """Load binary data using the metadata from the .hdr file."""
-    nrows = int(hdr_metadata['lines'])
-    ncols = int(hdr_metadata['samples'])
-    nbands = int(hdr_metadata['bands'])
-    dtype = map_envi_data_type(hdr_metadata['data type'][0])  # Map the ENVI data type
-
-    if dtype is None:
-        raise ValueError(f"Unsupported or unknown data type: {hdr_metadata['data type'][0]}")
-
-    interleave = hdr_metadata['interleave'].lower()
-
-    # Read the binary data
-    data = np.fromfile(binary_file, dtype=dtype)
+    """Memory-map binary data using the metadata from the .hdr file.
 
-    # Reshape the data based on interleave format
-    if interleave == 'bil':
-        data = data.reshape((nrows, nbands, ncols)).transpose(1, 0, 2)  # Band Interleaved by Line
-    elif interleave == 'bsq':
-        data = data.reshape((nbands, nrows, ncols))  # Band Sequential
-    elif interleave == 'bip':
-        data = data.reshape((nrows, ncols, nbands)).transpose(2, 0, 1)  # Band Interleaved by Pixel
-    else:
-        raise ValueError(f"Unsupported interleave format: {interleave}")
-
-    return data
+    Returns a (band, y, x) view of the file; pages are only read when indexed.
+    """
+    return memmap_cube(binary_file, hdr_metadata)
 
 def scale_and_convert_to_int(data, scale_factor=1e2):
     """Scale the data by the scale factor and convert it to integers."""
     scaled_data = np.round(data * scale_factor).astype(int)
     return scaled_data
 
-def convert_to_netcdf(binary_file, hdr_file, output_nc_file):
-    """Convert binary and .hdr file data to a compressed NetCDF4 file."""
+# Candidate storage types, narrowest first; one code of each is reserved for _FillValue
+# (uint16 would give the same 65535 codes as int16, so it is not a candidate)
+INT_DTYPES = (np.int8, np.int16, np.int32)
+
+def band_ranges(cube, nodata=-9999, block_lines=256):
+    """Per-band (min, max) of the valid values, read a block of lines at a time.
+
+    NaN and `nodata` are ignored; bands without valid values get NaN.
+    """
+    nbands, nrows, _ = cube.shape
+    vmin = np.full(nbands, np.inf)
+    vmax = np.full(nbands, -np.inf)
+    for y0 in range(0, nrows, block_lines):
+        block = np.asarray(cube[:, y0:y0 + block_lines, :], dtype=np.float64).reshape(nbands, -1)
+        invalid = np.isnan(block) | (block == nodata)
+        vmin = np.minimum(vmin, np.where(invalid, np.inf, block).min(axis=1))
+        vmax = np.maximum(vmax, np.where(invalid, -np.inf, block).max(axis=1))
+    empty = vmin > vmax
+    vmin[empty], vmax[empty] = np.nan, np.nan
+    return vmin, vmax
+
+def int_dtype_range(dtype):
+    """(fill value, lowest code, highest code) of an integer storage type."""
+    info = np.iinfo(dtype)
+    if info.min == 0:
+        return info.max, 0, info.max - 1
+    return info.min, info.min + 1, info.max
+
+def choose_int_encoding(vmin, vmax, precision, dtypes=INT_DTYPES):
+    """Narrowest integer type that stores [vmin, vmax] to within `precision`, with CF attributes.
+
+    Values are stored as round((x - add_offset) / scale_factor) with
+    scale_factor = 2 * precision, so the decoded error is at most `precision`
+    (plus float32 rounding on decode). Returns a dict with `dtype`,
+    `scale_factor`, `add_offset` and `_FillValue`.
+    """
+    scale_factor = np.float32(2 * precision)
+    if np.isnan(vmin):
+        vmin = vmax = 0.0
+    levels = int(np.ceil((vmax - vmin) / scale_factor))
+    for dtype in dtypes:
+        fill_value, lowest, highest = int_dtype_range(dtype)
+        if levels <= highest - lowest:
+            # Centre the codes on zero where the type allows it, so add_offset stays small
+            first = max(lowest, -(levels // 2))
+            return {
+                'dtype': np.dtype(dtype),
+                'scale_factor': scale_factor,
+                'add_offset': np.float32(vmin - first * np.float64(scale_factor)),
+                '_FillValue': np.dtype(dtype).type(fill_value)
+            }
+    raise ValueError(f"Range {vmin}..{vmax} at precision {precision} does not fit in {dtypes[-1].__name__}")
+
+def quantize_block(block, int_encoding, nodata=-9999):
+    """Encode a float block with CF scale/offset into the chosen integer type; nodata becomes _FillValue."""
+    _, lowest, highest = int_dtype_range(int_encoding['dtype'])
+    values = (np.asarray(block, dtype=np.float64) - np.float64(int_encoding['add_offset'])) \
+        / np.float64(int_encoding['scale_factor'])
+    invalid = np.isnan(values) | (block == nodata)
+    np.rint(values, out=values)
+    np.clip(values, lowest, highest, out=values)
+    values[invalid] = int_encoding['_FillValue']
+    return values.astype(int_encoding['dtype'])
+
+def convert_to_netcdf_quantized(binary_file, hdr_file, output_nc_file, precision=1e-5, block_lines=None,
+                                block_bands=None, workers=None, chunksizes=None, codec='zlib', backend='netcdf',
+                                skip_nodata=False, pipeline=False, predictor=None):
+    """Convert binary and .hdr file data to compact integers with CF scale_factor/add_offset.
+
+    A first chunk-wise pass finds the per-band value ranges (ignoring -9999);
+    the narrowest integer type that covers them at an absolute `precision` is
+    chosen, and a second pass quantizes and writes block by block. CF
+    attributes are per variable, so one scale/offset covers all bands; the
+    per-band ranges are kept as `band_min`/`band_max` attributes. xarray
+    decodes the result back to float32 with nodata masked as NaN.
+    `skip_nodata=True` leaves chunks that are entirely -9999 unallocated, and
+    `pipeline=True` overlaps reading, quantizing, compression and writing.
+    `predictor` ('delta' or 'linear') stores band-to-band prediction residuals
+    of the integer codes (NetCDF only; open with chunk_reader.open_predicted_dataset).
+    """
+    if backend == 'zarr' and predictor is not None:
+        raise ValueError("Spectral prediction is NetCDF only")
     # Parse metadata from the .hdr file
     hdr_metadata = parse_hdr_file(hdr_file)
 
     # Load binary data
     data = load_binary_file(binary_file, hdr_metadata)
 
-    # Scale the data to 9 decimal places and convert to integers
-    data = scale_and_convert_to_int(data, scale_factor=1e10)
+    # Pass 1: per-band ranges and the narrowest integer type for the precision
+    with stage('analysis', bytes_in=data.nbytes):
+        vmin, vmax = band_ranges(data)
+    int_encoding = choose_int_encoding(np.nanmin(vmin) if np.isfinite(vmin).any() else np.nan,
+                                       np.nanmax(vmax) if np.isfinite(vmax).any() else np.nan, precision)
+
+    attrs = {"description": f"Binary data quantized to {int_encoding['dtype'].name} "
+                            f"with CF scale_factor/add_offset at {precision:g} absolute precision"}
+    var_attrs = {
+        'scale_factor': int_encoding['scale_factor'],
+        'add_offset': int_encoding['add_offset'],
+        'band_min': vmin.astype(np.float32),
+        'band_max': vmax.astype(np.float32)
+    }
+    compression = {'data': netcdf_encoding(codec, complevel=5, shuffle=True, chunksizes=chunksizes or (1, 100, 100))}
+
+    # Pass 2: quantize block by block
+    transform = partial(quantize_block, int_encoding=int_encoding)
+    if backend == 'zarr':
+        write_zarr_from_envi(binary_file, hdr_metadata, output_nc_file, compression['data'],
+                             dtype=int_encoding['dtype'], transform=transform, attrs=attrs, var_attrs=var_attrs,
+                             fill_value=int_encoding['_FillValue'], block_lines=block_lines,
+                             block_bands=block_bands, workers=workers, nodata=-9999 if skip_nodata else None)
+        print(f"Saved Zarr store to: {output_nc_file}")
+        return int_encoding
+    write_netcdf_stream(data, output_nc_file, compression['data'], dtype=int_encoding['dtype'], transform=transform,
+                        attrs=attrs, var_attrs=var_attrs, fill_value=int_encoding['_FillValue'],
+                        block_lines=block_lines, block_bands=block_bands, workers=workers,
+                        executor='pipeline' if pipeline else 'thread', nodata=-9999 if skip_nodata else None,
+                        predictor=predictor)
+    print(f"Saved NetCDF file to: {output_nc_file} ({int_encoding['dtype'].name})")
+    return int_encoding
+
+def convert_to_netcdf(binary_file, hdr_file, output_nc_file, stream=False, block_lines=None, block_bands=None,
+                      workers=None, chunksizes=None, codec='zlib', backend='netcdf', skip_nodata=False,
+                      pipeline=False, predictor=None):
+    """Convert binary and .hdr file data to a compressed NetCDF4 file.
+
+    With `stream=True` each block is scaled and written on its own, so memory
+    use stays bounded by the block size instead of the scene size. `workers`
+    compresses chunks on that many threads (implies streaming). `chunksizes`
+    overrides the default (1, 100, 100) chunks, e.g. with a shape from chunk_tuner.
+    `codec` selects zlib or Blosc ('blosc_zstd', 'blosc_lz4') with bitshuffle, and
+    `backend='zarr'` writes a Zarr store at `output_nc_file` instead, with
+    `workers` processes writing chunks concurrently. `skip_nodata=True` never
+    writes chunks that are entirely -9999 (they read back as the scaled
+    -9999 `_FillValue`) and implies streaming. `pipeline=True` overlaps reading,
+    scaling, compression and writing on threads (see pipeline.write_netcdf_pipelined).
+    `predictor` ('delta' or 'linear') stores band-to-band prediction residuals
+    of the integers and implies streaming (open with chunk_reader.open_predicted_dataset).
+    """
+    if backend == 'zarr' and predictor is not None:
+        raise ValueError("Spectral prediction is NetCDF only")
+    # Parse metadata from the .hdr file
+    hdr_metadata = parse_hdr_file(hdr_file)
 
-    # Convert to xarray Dataset
-    ds = xr.Dataset(
-        {"data": (["band", "y", "x"], data)},
-        coords={
-            "band": np.arange(1, data.shape[0] + 1),
-            "y": np.arange(data.shape[1]),
-            "x": np.arange(data.shape[2])
-        },
-        attrs={"description": "Binary data converted to NetCDF with scaling to preserve 9 decimal places and integer conversion"}
-    )
+    # Load binary data
+    data = load_binary_file(binary_file, hdr_metadata)
+
+    attrs = {"description": "Binary data converted to NetCDF with scaling to preserve 9 decimal places and integer conversion"}
 
     # Set compression settings for NetCDF4-CDF4
     compression = {
@@ -96,9 +179,50 @@ def convert_to_netcdf(binary_file, hdr_file, output_nc_file):
             'chunksizes' : (1, 100, 100) #chunk one band at a time at 100 x 100 pixels
         }
     }
+    if chunksizes is not None:
+        compression['data']['chunksizes'] = tuple(chunksizes)
+    if codec != 'zlib':
+        compression['data'] = netcdf_encoding(codec, complevel=5, shuffle=True,
+                                              chunksizes=compression['data']['chunksizes'])
+
+    if backend == 'zarr':
+        # Every chunk is its own object, so worker processes write without a file lock
+        write_zarr_from_envi(binary_file, hdr_metadata, output_nc_file, compression['data'], dtype=int,
+                             transform=partial(scale_and_convert_to_int, scale_factor=1e10),
+                             attrs=attrs, block_lines=block_lines, block_bands=block_bands, workers=workers,
+                             nodata=-9999 if skip_nodata else None)
+        print(f"Saved Zarr store to: {output_nc_file}")
+        return
+
+    # Blosc goes through the streaming writer, which compresses chunks itself
+    if stream or workers or codec != 'zlib' or skip_nodata or pipeline or predictor:
+        # Scale each block to integers as it is written
+        write_netcdf_stream(data, output_nc_file, compression['data'], dtype=int,
+                            transform=lambda block: scale_and_convert_to_int(block, scale_factor=1e10),
+                            attrs=attrs, block_lines=block_lines, block_bands=block_bands, workers=workers,
+                            executor='pipeline' if pipeline else 'thread', nodata=-9999 if skip_nodata else None,
+                            predictor=predictor)
+        print(f"Saved NetCDF file to: {output_nc_file}")
+        return
+
+    # Scale the data to 9 decimal places and convert to integers
+    with stage('transform', bytes_in=data.nbytes):
+        data = scale_and_convert_to_int(data, scale_factor=1e10)
+
+    # Convert to xarray Dataset
+    ds = xr.Dataset(
+        {"data": (["band", "y", "x"], data)},
+        coords={
+            "band": np.arange(1, data.shape[0] + 1),
+            "y": np.arange(data.shape[1]),
+            "x": np.arange(data.shape[2])
+        },
+        attrs=attrs
+    )
 
     # Save the dataset to NetCDF without compression (or with compression if needed)
-    ds.to_netcdf(output_nc_file, format='NETCDF4', encoding=compression)
+    with stage('write', bytes_in=data.nbytes):
+        ds.to_netcdf(output_nc_file, format='NETCDF4', encoding=compression)
     print(f"Saved NetCDF file to: {output_nc_file}")
 
 # Example usage
@@ -107,4 +231,7 @@ if __name__ == "__main__":
     hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'  # Replace with your header file path
     output_nc_file = '/Users/kitlewers/Desktop/naive_compression/imagery/int_10_output_data.nc'
 
-    convert_to_netcdf(binary_file, hdr_file, output_nc_file)
+    convert_to_netcdf(binary_file, hdr_file, output_nc_file, stream=True)
+
+    # Compact alternative: narrowest integer type at 1e-5 reflectance precision
+    convert_to_netcdf_quantized(binary_file, hdr_file, output_nc_file.replace('.nc', '_quantized.nc'), precision=1e-5)
@@ -1,31 +1,30 @@
 import matplotlib.pyplot as plt
-import numpy as np
-import xarray as xr
 import xbitinfo as xb
-from xbitinfo import get_bitinformation
+from bitinfo import bitinformation_dataset_from_counts, get_bitinformation
+from bitinfo_cache import cached_bitinformation
+from envi_reader import open_envi_dataarray
+from naive_compression import parse_hdr_file
+from parallel_analysis import SharedCube, parallel_bitpair_counts
 
 def load_hyperspectral_data(file_path, header_path):
-    with open(header_path, 'r') as f:
-        header = f.readlines()
+    # Extract metadata from header (shape, data type, interleave, offset, byte order)
+    hdr_metadata = parse_hdr_file(header_path)
     
-    # Extract metadata from header
-    samples = int([line.split('=')[1] for line in header if 'samples' in line][0])
-    lines = int([line.split('=')[1] for line in header if 'lines' in line][0])
-    bands = int([line.split('=')[1] for line in header if 'bands' in line][0])
-    dtype = np.float32  # Assuming data type is float32
-    
-    # Load binary data and mask -9999 values
-    data = np.fromfile(file_path, dtype=dtype).reshape((bands, lines, samples))
-    data = np.where(data == -9999, np.nan, data)  # Mask invalid values
-    
-    # Convert to xarray DataArray
-    da = xr.DataArray(data, dims=("band", "y", "x"))
+    # Lazily open the binary data; -9999 values are masked by the bit information engine
+    da = open_envi_dataarray(file_path, hdr_metadata)
     return da
 
-def plot_bit_information_figure2(data_array):
-    # Convert DataArray to Dataset if needed and calculate bit information
-    dataset = data_array.to_dataset(name="data")
-    bit_info = get_bitinformation(dataset, dim="band")
+def plot_bit_information_figure2(data_array=None, bit_info=None, workers=None):
+    # With workers, count bit pairs of band ranges on a process pool sharing one copy of the cube
+    if bit_info is None and workers:
+        with SharedCube(data_array.transpose("band", "y", "x")) as cube:
+            counts = parallel_bitpair_counts(cube, dim="band", workers=workers)
+        bit_info = bitinformation_dataset_from_counts(counts, cube.dtype, "band")
+
+    # Convert DataArray to Dataset if needed and calculate bit information, unless it was cached
+    if bit_info is None:
+        dataset = data_array.to_dataset(name="data")
+        bit_info = get_bitinformation(dataset, dim="band")
     
     # Plot bitwise information content using `plot_bitinformation`
     xb.plot_bitinformation(bit_info, cmap="turku", crop=64)  # Adjust `crop` if fewer bits are relevant
@@ -35,11 +34,11 @@ def main():
     binary_file_path = "/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT"
     header_file_path = "/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr"
     
-    # Load hyperspectral data
-    da = load_hyperspectral_data(binary_file_path, header_file_path)
+    # Bit information from the on-disk cache; only the first run reads the cube
+    bit_info = cached_bitinformation(binary_file_path, parse_hdr_file(header_file_path), dim="band")
     
     # Plot bitwise information content as in Figure 2
-    plot_bit_information_figure2(da)
+    plot_bit_information_figure2(bit_info=bit_info)
 
 # Run the main function
 if __name__ == "__main__":
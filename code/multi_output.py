@@ -0,0 +1,124 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import h5py
+import numpy as np
+
+from bitinfo import get_keepbits
+from compression_codecs import netcdf_encoding
+from envi_header import parse_hdr_file
+from envi_reader import memmap_cube
+from instrumentation import stage
+from int_compression import scale_and_convert_to_int
+from netcdf_writer import chunk_encoder, create_netcdf_cube, iter_blocks, iter_chunks, nodata_fill_value, prepare_block
+from rounding import bitround_inplace, round_sigfigs_inplace
+
+
+def output_variants(binary_file, hdr_metadata, output_prefix, lossless=True, sig_figs=(4,), int_scales=(1e10,),
+                    inflevels=(0.99,), chunksizes=(1, 100, 100), codec='zlib', complevel=5, bitinfo=None):
+    """Encoder specs for a comparison set of one scene, written as `{output_prefix}_{name}.nc`.
+
+    The variants match the single-method converters: `naive` (lossless),
+    `sigfigs{n}` for each number of significant figures, `int{k}` for each
+    integer scale 10**k and `bitround{inflevel}` for each information level.
+    Bitround keepbits come from `bitinfo` or from the cached bit information
+    of the scene (bitinfo_cache), which is read only once per scene ever.
+    Each spec is a dict of name, output_file, encoding, dtype, transform,
+    attrs and var_attrs.
+    """
+    encoding = netcdf_encoding(codec, complevel=complevel, shuffle=True, chunksizes=chunksizes)
+    variants = []
+
+    def add(name, description, dtype=np.float32, transform=None, var_attrs=None):
+        variants.append({'name': name, 'output_file': f"{output_prefix}_{name}.nc", 'encoding': encoding,
+                         'dtype': np.dtype(dtype), 'transform': transform,
+                         'attrs': {'description': description}, 'var_attrs': var_attrs})
+
+    if lossless:
+        add('naive', "Binary data converted to NetCDF4-CDF4")
+    for n in sig_figs:
+        add(f'sigfigs{n}', f"Binary data converted to NetCDF4-CDF4 with {n} significant figures",
+            transform=partial(round_sigfigs_inplace, sig_figs=n))
+    for scale in int_scales:
+        add(f'int{round(math.log10(scale))}',
+            f"Binary data converted to NetCDF with scaling by {scale:g} and integer conversion", dtype=int,
+            transform=partial(scale_and_convert_to_int, scale_factor=scale))
+    if inflevels:
+        if bitinfo is None:
+            from bitinfo_cache import cached_bitinformation
+            bitinfo = cached_bitinformation(binary_file, hdr_metadata, dim="band")
+        for inflevel in inflevels:
+            keep = int(get_keepbits(bitinfo, inflevel=inflevel)["data"])
+            add(f'bitround{inflevel:g}', f"Binary data bit-rounded to {inflevel:g} of its information",
+                transform=partial(bitround_inplace, keepbits=keep),
+                var_attrs={'_QuantizeBitRoundNumberOfSignificantDigits': keep})
+    return variants
+
+
+def convert_multi(binary_file, hdr_file, variants, block_lines=None, workers=None, nodata=None):
+    """Write every variant of a scene from a single read of the source cube.
+
+    Each block is read (and byte-swapped/transposed) once and handed to every
+    encoder: transforms that work in place get their own copy, the cast and
+    compression happen per variant, and the compressed chunks are written
+    straight into each output with HDF5 direct chunk writes. Chunks are
+    compressed on `workers` threads. `nodata` (e.g. -9999) skips all-nodata
+    chunks in every output. Returns {name: output_file}.
+    """
+    hdr_metadata = parse_hdr_file(hdr_file)
+    cube = memmap_cube(binary_file, hdr_metadata)
+
+    # Blocks must start on a chunk boundary of every output
+    chunk_lines = math.lcm(*(variant['encoding']['chunksizes'][1] for variant in variants))
+    block_lines = max(1, (block_lines or chunk_lines) // chunk_lines) * chunk_lines
+
+    encoders, pad_values = [], []
+    for variant in variants:
+        fill_value = None
+        if nodata is not None:
+            fill_value = nodata_fill_value(cube, nodata, variant['dtype'], variant['transform'])
+        nc = create_netcdf_cube(variant['output_file'], cube.shape, variant['dtype'], variant['encoding'],
+                                attrs=variant['attrs'], var_attrs=variant['var_attrs'], fill_value=fill_value)
+        pad_values.append(nc.variables['data']._FillValue if '_FillValue' in nc.variables['data'].ncattrs() else 0)
+        nc.close()
+        encoders.append(chunk_encoder(variant['encoding']))
+
+    files = [h5py.File(variant['output_file'], 'r+') for variant in variants]
+    try:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for band_slice, y_slice, source in iter_blocks(cube, block_lines=block_lines):
+                for variant, encode, pad_value, h5 in zip(variants, encoders, pad_values, files):
+                    block = source if variant['transform'] is None else source.copy()
+                    block, valid = prepare_block(block, band_slice, y_slice, variant['dtype'], variant['transform'],
+                                                 nodata=nodata, fill_value=pad_value)
+                    block_chunks = list(iter_chunks(block, band_slice.start, y_slice.start,
+                                                    variant['encoding']['chunksizes'], pad_value, valid))
+                    if not block_chunks:
+                        continue
+                    offsets, chunks = zip(*block_chunks)
+                    with stage('compress', bytes_in=sum(chunk.nbytes for chunk in chunks)) as info:
+                        encoded_chunks = list(pool.map(encode, chunks))
+                        info['bytes_out'] = sum(len(encoded) for encoded in encoded_chunks)
+                    with stage('write', bytes_in=info['bytes_out']):
+                        dset = h5['data']
+                        for offset, encoded in zip(offsets, encoded_chunks):
+                            dset.id.write_direct_chunk(offset, encoded, filter_mask=0)
+    finally:
+        for h5 in files:
+            h5.close()
+    return {variant['name']: variant['output_file'] for variant in variants}
+
+
+# Example usage
+if __name__ == "__main__":
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    output_prefix = '/Users/kitlewers/Desktop/naive_compression/imagery/comparison/ang20231109t092617'
+
+    os.makedirs(os.path.dirname(output_prefix), exist_ok=True)
+    variants = output_variants(binary_file, parse_hdr_file(hdr_file), output_prefix, sig_figs=(3, 4, 5),
+                               int_scales=(1e4, 1e10), inflevels=(0.9, 0.99, 0.999))
+    for name, output_file in convert_multi(binary_file, hdr_file, variants).items():
+        print(f"{name}: {output_file} ({os.path.getsize(output_file) / 1e6:.1f} MB)")
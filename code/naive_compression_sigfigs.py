@@ -1,67 +1,33 @@
 import numpy as np
 import xarray as xr
 import os
-
-def parse_hdr_file(hdr_file):
-    """Parse the ENVI .hdr file to extract metadata."""
-    metadata = {}
-    with open(hdr_file, 'r') as file:
-        for line in file:
-            key_value = line.strip().split('=')
-            if len(key_value) == 2:
-                key, value = key_value
-                key = key.strip().lower()
-                value = value.strip()
-                if '{' in value:  # Handle lists
-                    value = value.replace('{', '').replace('}', '').split(',')
-                    value = [v.strip() for v in value]
-                metadata[key] = value
-    return metadata
-
-def map_envi_data_type(envi_data_type):
-    """Map ENVI data types to numpy data types."""
-    data_type_mapping = {
-        '1': np.uint8,
-        '2': np.int16,
-        '3': np.int32,
-        '4': np.float32,  # Your data type
-        '5': np.float64,
-        '12': np.uint16,
-        '13': np.uint32,
-        '14': np.int64,
-        '15': np.uint64
-    }
-    return data_type_mapping.get(envi_data_type, None)
+from functools import partial
+from compression_codecs import netcdf_encoding
+from envi_header import parse_hdr_file
+from envi_reader import memmap_cube
+from instrumentation import stage
+from netcdf_writer import write_netcdf_stream
+from rounding import round_sigfigs_inplace
+from zarr_writer import write_zarr_from_envi
 
 def load_binary_file(binary_file, hdr_metadata):
-    """Load binary data using the metadata from the .hdr file."""
-    nrows = int(hdr_metadata['lines'])
-    ncols = int(hdr_metadata['samples'])
-    nbands = int(hdr_metadata['bands'])
-    dtype = map_envi_data_type(hdr_metadata['data type'][0])  # Map the ENVI data type
-
-    if dtype is None:
-        raise ValueError(f"Unsupported or unknown data type: {hdr_metadata['data type'][0]}")
-
-    interleave = hdr_metadata['interleave'].lower()
-
-    # Read the binary data
-    data = np.fromfile(binary_file, dtype=dtype)
-
-    # Reshape the data based on interleave format
-    if interleave == 'bil':
-        data = data.reshape((nrows, nbands, ncols)).transpose(1, 0, 2)  # Band Interleaved by Line
-    elif interleave == 'bsq':
-        data = data.reshape((nbands, nrows, ncols))  # Band Sequential
-    elif interleave == 'bip':
-        data = data.reshape((nrows, ncols, nbands)).transpose(2, 0, 1)  # Band Interleaved by Pixel
-    else:
-        raise ValueError(f"Unsupported interleave format: {interleave}")
-
-    return data
-
-def round_to_significant_figures(data, sig_figs):
-    """Round data to the specified number of significant figures."""
+    """Memory-map binary data using the metadata from the .hdr file.
+
+    Returns a (band, y, x) view of the file; pages are only read when indexed.
+    """
+    return memmap_cube(binary_file, hdr_metadata)
+
+def round_to_significant_figures(data, sig_figs, inplace=False):
+    """Round data to the specified number of significant figures.
+
+    float32 data goes through the chunked in-place kernel, on `data` itself with
+    `inplace=True` or else on a single copy; other dtypes use log10/power.
+    """
+    if np.dtype(data.dtype) == np.float32:
+        if not inplace:
+            data = np.array(data, dtype=np.float32, order='C')
+        return round_sigfigs_inplace(data, sig_figs)
+
     abs_data = np.abs(data)
     with np.errstate(divide='ignore', invalid='ignore'):  # Handle log10 for zero values
         order_of_magnitude = np.floor(np.log10(abs_data))
@@ -73,16 +39,67 @@ def round_to_significant_figures(data, sig_figs):
     rounded_data = np.round(data * factor) / factor
     return rounded_data
 
-def convert_to_netcdf_cdf4(binary_file, hdr_file, output_nc_file):
-    """Convert binary and .hdr file data to a compressed NetCDF4-CDF4 file."""
+def convert_to_netcdf_cdf4(binary_file, hdr_file, output_nc_file, stream=False, block_lines=None, block_bands=None,
+                           workers=None, chunksizes=None, codec='zlib', backend='netcdf',
+                           skip_nodata=False, pipeline=False):
+    """Convert binary and .hdr file data to a compressed NetCDF4-CDF4 file.
+
+    With `stream=True` each block is rounded and written on its own, so memory
+    use stays bounded by the block size instead of the scene size. `workers`
+    compresses chunks on that many threads (implies streaming). `chunksizes`
+    overrides the default (1, 100, 100) chunks, e.g. with a shape from chunk_tuner.
+    `codec` selects zlib or Blosc ('blosc_zstd', 'blosc_lz4') with bitshuffle, and
+    `backend='zarr'` writes a Zarr store at `output_nc_file` instead, with
+    `workers` processes writing chunks concurrently. `skip_nodata=True` never
+    writes chunks that are entirely -9999 (they read back as the -9999
+    `_FillValue`) and implies streaming. `pipeline=True` overlaps reading,
+    rounding, compression and writing on threads (see pipeline.write_netcdf_pipelined).
+    """
     # Parse metadata from the .hdr file
     hdr_metadata = parse_hdr_file(hdr_file)
 
     # Load binary data
     data = load_binary_file(binary_file, hdr_metadata)
 
+    attrs = {"description": "Binary data converted to NetCDF4-CDF4 with 4 significant figures"}
+
+    # Set compression settings for NetCDF4-CDF4
+    compression = {
+        'data': {
+            'zlib': True,       # Use zlib compression
+            'complevel': 5,     # Set compression level (1-9)
+            'shuffle': True,     # Enable shuffle filter to improve compression efficiency
+            'chunksizes' : (1, 100, 100) #chunk one band at a time at 100 x 100 pixels
+        }
+    }
+    if chunksizes is not None:
+        compression['data']['chunksizes'] = tuple(chunksizes)
+    if codec != 'zlib':
+        compression['data'] = netcdf_encoding(codec, complevel=5, shuffle=True,
+                                              chunksizes=compression['data']['chunksizes'])
+
+    if backend == 'zarr':
+        # Every chunk is its own object, so worker processes write without a file lock
+        write_zarr_from_envi(binary_file, hdr_metadata, output_nc_file, compression['data'],
+                             transform=partial(round_to_significant_figures, sig_figs=4, inplace=True),
+                             attrs=attrs, block_lines=block_lines, block_bands=block_bands, workers=workers,
+                             nodata=-9999 if skip_nodata else None)
+        print(f"Saved Zarr store to: {output_nc_file}")
+        return
+
+    # Blosc goes through the streaming writer, which compresses chunks itself
+    if stream or workers or codec != 'zlib' or skip_nodata or pipeline:
+        # Round each block to 4 significant figures in place as it is written
+        write_netcdf_stream(data, output_nc_file, compression['data'],
+                            transform=lambda block: round_to_significant_figures(block, 4, inplace=True),
+                            attrs=attrs, block_lines=block_lines, block_bands=block_bands, workers=workers,
+                            executor='pipeline' if pipeline else 'thread', nodata=-9999 if skip_nodata else None)
+        print(f"Saved compressed NetCDF4-CDF4 file to: {output_nc_file}")
+        return
+
     # Round data to 4 significant figures
-    data = round_to_significant_figures(data, 4)
+    with stage('transform', bytes_in=data.nbytes):
+        data = round_to_significant_figures(data, 4)
 
     # Convert to xarray Dataset
     ds = xr.Dataset(
@@ -92,21 +109,12 @@ def convert_to_netcdf_cdf4(binary_file, hdr_file, output_nc_file):
             "y": np.arange(data.shape[1]),
             "x": np.arange(data.shape[2])
         },
-        attrs={"description": "Binary data converted to NetCDF4-CDF4 with 4 significant figures"}
+        attrs=attrs
     )
 
-    # Set compression settings for NetCDF4-CDF4
-    compression = {
-        'data': {
-            'zlib': True,       # Use zlib compression
-            'complevel': 5,     # Set compression level (1-9)
-            'shuffle': True,     # Enable shuffle filter to improve compression efficiency
-            'chunksizes' : (1, 100, 100) #chunk one band at a time at 100 x 100 pixels
-        }
-    }
-
     # Save the dataset to NetCDF4-CDF4
-    ds.to_netcdf(output_nc_file, format='NETCDF4', encoding=compression)
+    with stage('write', bytes_in=data.nbytes):
+        ds.to_netcdf(output_nc_file, format='NETCDF4', encoding=compression)
     print(f"Saved compressed NetCDF4-CDF4 file to: {output_nc_file}")
 
 # Example usage
@@ -115,4 +123,4 @@ if __name__ == "__main__":
     hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'  # Replace with your header file path
     output_nc_file = '/Users/kitlewers/Desktop/naive_compression/imagery/output_data_four_sigfigs.nc'
 
-    convert_to_netcdf_cdf4(binary_file, hdr_file, output_nc_file)
+    convert_to_netcdf_cdf4(binary_file, hdr_file, output_nc_file, stream=True)
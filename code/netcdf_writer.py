@@ -0,0 +1,356 @@
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import h5py
+import numpy as np
+import netCDF4
+
+from compression_codecs import encoding_codec, numcodecs_compressor
+from instrumentation import stage
+from spectral_predictor import hidden_attr_name, hide_decoding_attrs, predictive_transform
+
+
+def iter_blocks(cube, block_lines=None, block_bands=None):
+    """Yield (band_slice, y_slice, block) over a (band, y, x) cube.
+
+    Blocks span either `block_lines` image lines (all bands) or `block_bands`
+    bands (all lines). Each block is read into a contiguous array, so a BIL/BIP
+    memory map is only transposed one block at a time. Blocks are always
+    writable copies, so transforms may round or scale them in place.
+    """
+    nbands, nrows, _ = cube.shape
+    if block_bands is not None:
+        for b0 in range(0, nbands, block_bands):
+            band_slice = slice(b0, min(b0 + block_bands, nbands))
+            yield band_slice, slice(0, nrows), read_block(cube[band_slice])
+    else:
+        block_lines = block_lines or nrows
+        for y0 in range(0, nrows, block_lines):
+            y_slice = slice(y0, min(y0 + block_lines, nrows))
+            yield slice(0, nbands), y_slice, read_block(cube[:, y_slice, :])
+
+
+def read_block(view):
+    """Contiguous, writable, native byte order copy of a cube view."""
+    with stage('read', bytes_in=view.nbytes) as info:
+        block = np.array(view, dtype=view.dtype.newbyteorder('='), order='C')
+        info['bytes_out'] = block.nbytes
+    return block
+
+
+def nodata_fill_value(cube, nodata, dtype, transform=None, transform_slices=False):
+    """Value a nodata pixel takes in the output, after `transform` and the cast to `dtype`.
+
+    Used as `_FillValue` when all-nodata chunks are skipped, so unwritten
+    chunks read back exactly as the converter would have stored them.
+    """
+    pixel = np.full((1, 1, 1), nodata, dtype=cube.dtype.newbyteorder('='))
+    if transform is not None:
+        pixel = transform(pixel, slice(0, 1), slice(0, 1)) if transform_slices else transform(pixel)
+    return np.asarray(pixel).astype(dtype).reshape(-1)[0]
+
+
+def prepare_block(block, band_slice, y_slice, dtype, transform=None, transform_slices=False, nodata=None,
+                  fill_value=None):
+    """Transform a block and cast it to `dtype`; returns (block, valid).
+
+    With `nodata` set, `valid` marks the pixels that are not nodata, and only
+    the columns between the first and last valid pixel are transformed; the
+    rest of the block is `fill_value` at no cost. Without it `valid` is None.
+    """
+    if nodata is None:
+        with stage('transform', bytes_in=block.nbytes) as info:
+            if transform is not None:
+                block = transform(block, band_slice, y_slice) if transform_slices else transform(block)
+            block = block.astype(dtype, copy=False)
+            info['bytes_out'] = block.nbytes
+        return block, None
+
+    valid = block != nodata
+    columns = np.flatnonzero(valid.any(axis=(0, 1)))
+    if columns.size and columns[0] == 0 and columns[-1] == block.shape[2] - 1:
+        return prepare_block(block, band_slice, y_slice, dtype, transform, transform_slices)[0], valid
+
+    out = np.full(block.shape, fill_value, dtype=dtype)
+    if columns.size:
+        x_slice = slice(columns[0], columns[-1] + 1)
+        out[:, :, x_slice] = prepare_block(np.ascontiguousarray(block[:, :, x_slice]), band_slice, y_slice, dtype,
+                                           transform, transform_slices)[0]
+    return out, valid
+
+
+def iter_chunk_runs(valid, chunksizes):
+    """Yield (band_slice, y_slice, x_slice) of a chunk-aligned block, one per run of non-empty chunks.
+
+    Chunks without a single valid pixel are left out, so they are never
+    allocated in the output. With `valid=None` the whole block is one run.
+    """
+    if valid is None:
+        yield slice(None), slice(None), slice(None)
+        return
+    cb, cy, cx = chunksizes
+    nbands, nrows, ncols = valid.shape
+    for b in range(0, nbands, cb):
+        for y in range(0, nrows, cy):
+            occupied = np.logical_or.reduceat(valid[b:b + cb, y:y + cy].any(axis=(0, 1)), np.arange(0, ncols, cx))
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], occupied.astype(np.int8), [0]))))
+            for start, stop in zip(edges[::2], edges[1::2]):
+                yield slice(b, b + cb), slice(y, y + cy), slice(start * cx, min(stop * cx, ncols))
+
+
+def create_netcdf_cube(output_nc_file, shape, dtype, encoding, attrs=None, var_attrs=None,
+                       fill_value=None):
+    """Create a NetCDF4 file laid out like xarray's output with an empty chunked `data` variable.
+
+    `encoding` is the same dict the converters pass to `to_netcdf` for `data`,
+    with zlib or a Blosc `compression` (see compression_codecs.netcdf_encoding).
+    Floating point data gets a NaN `_FillValue` unless another fill value is given,
+    matching what xarray writes by default.
+    """
+    nbands, nrows, ncols = shape
+    dtype = np.dtype(dtype)
+    if fill_value is None and dtype.kind == 'f':
+        fill_value = np.nan
+
+    nc = netCDF4.Dataset(output_nc_file, 'w', format='NETCDF4')
+    for name, size in (('band', nbands), ('y', nrows), ('x', ncols)):
+        nc.createDimension(name, size)
+    for name, values in (('band', np.arange(1, nbands + 1)), ('y', np.arange(nrows)), ('x', np.arange(ncols))):
+        coord = nc.createVariable(name, np.int64, (name,))
+        coord[:] = values
+
+    var = nc.createVariable(
+        'data', dtype, ('band', 'y', 'x'),
+        compression=encoding.get('compression', 'zlib' if encoding.get('zlib', False) else None),
+        complevel=encoding.get('complevel', 4),
+        shuffle=encoding.get('shuffle', False),
+        blosc_shuffle=encoding.get('blosc_shuffle', 1),
+        chunksizes=encoding.get('chunksizes'),
+        fill_value=fill_value if fill_value is not None else False
+    )
+    if var_attrs:
+        var.setncatts(var_attrs)
+    if attrs:
+        nc.setncatts(attrs)
+    return nc
+
+
+def write_netcdf_stream(cube, output_nc_file, encoding, dtype=None, transform=None, attrs=None,
+                        var_attrs=None, fill_value=None, block_lines=None, block_bands=None, workers=None,
+                        executor='thread', transform_slices=False, nodata=None, predictor=None):
+    """Stream a (band, y, x) cube into a compressed NetCDF4 file block by block.
+
+    `transform` is applied to each block before it is written (rounding,
+    scaling, ...) and `dtype` is the dtype it produces. With `transform_slices`
+    it is called as transform(block, band_slice, y_slice), for transforms that
+    depend on where the block sits in the scene. Peak memory is a few
+    blocks; by default a block is one row of chunks (all bands). With `workers`
+    set, chunks are compressed in parallel (see `write_netcdf_parallel`), and
+    `executor='pipeline'` also overlaps reading and writing with the
+    transform and compression (see pipeline.write_netcdf_pipelined).
+    Blosc chunks are always compressed here and written directly, since the
+    HDF5 Blosc filter fails on chunks it cannot compress.
+
+    With `nodata` set (e.g. -9999 for the orthorectified scenes), chunks that
+    hold only nodata are skipped and never allocated, partially filled blocks
+    are only transformed over their valid columns, and `_FillValue` defaults
+    to the transformed nodata value, so skipped chunks read back unchanged.
+
+    `predictor` ('delta' or 'linear', see spectral_predictor) stores the
+    residuals of a reversible band-to-band prediction instead of the values,
+    with the attributes chunk_reader needs to decode them; the fill value and
+    CF attributes are stored under `spectral_predictor_*` names, so generic
+    readers see the raw residuals (open with chunk_reader.open_predicted_dataset).
+    It needs line blocks and cannot be combined with `nodata` skipping.
+    """
+    if predictor is not None:
+        if nodata is not None or block_bands is not None:
+            raise ValueError("Spectral prediction needs line blocks and no nodata skipping")
+        transform, dtype, predictor_var_attrs = predictive_transform(cube, transform, dtype, predictor,
+                                                                     transform_slices)
+        # Fill value, CF scale/offset and quantization describe the decoded values, not the residuals
+        var_attrs = dict(hide_decoding_attrs(var_attrs), **predictor_var_attrs)
+        if fill_value is not None:
+            var_attrs[hidden_attr_name('_FillValue')] = fill_value
+            fill_value = None
+        transform_slices = True
+    if executor == 'pipeline':
+        from pipeline import write_netcdf_pipelined
+
+        return write_netcdf_pipelined(cube, output_nc_file, encoding, dtype=dtype, transform=transform,
+                                      attrs=attrs, var_attrs=var_attrs, fill_value=fill_value,
+                                      block_lines=block_lines, block_bands=block_bands, workers=workers,
+                                      transform_slices=transform_slices, nodata=nodata)
+    if not workers and encoding_codec(encoding).startswith('blosc_'):
+        workers = 1
+    if workers:
+        return write_netcdf_parallel(cube, output_nc_file, encoding, dtype=dtype, transform=transform,
+                                     attrs=attrs, var_attrs=var_attrs, fill_value=fill_value,
+                                     block_lines=block_lines, block_bands=block_bands, workers=workers,
+                                     executor=executor, transform_slices=transform_slices, nodata=nodata)
+    dtype = np.dtype(dtype or cube.dtype).newbyteorder('=')
+    chunksizes = encoding.get('chunksizes')
+    if block_lines is None and block_bands is None:
+        block_lines = chunksizes[1] if chunksizes else 100
+    if nodata is not None:
+        # Chunk-aligned blocks, so a skipped chunk is skipped as a whole
+        if fill_value is None:
+            fill_value = nodata_fill_value(cube, nodata, dtype, transform, transform_slices)
+        if block_bands is not None:
+            block_bands = max(1, block_bands // chunksizes[0]) * chunksizes[0]
+        else:
+            block_lines = max(1, block_lines // chunksizes[1]) * chunksizes[1]
+
+    nc = create_netcdf_cube(output_nc_file, cube.shape, dtype, encoding, attrs=attrs,
+                            var_attrs=var_attrs, fill_value=fill_value)
+    try:
+        var = nc.variables['data']
+        var.set_auto_maskandscale(False)
+        for band_slice, y_slice, block in iter_blocks(cube, block_lines=block_lines, block_bands=block_bands):
+            block, valid = prepare_block(block, band_slice, y_slice, dtype, transform, transform_slices, nodata,
+                                         fill_value)
+            # netCDF4 compresses inside the write, so the two are one stage here
+            with stage('compress_write', bytes_in=block.nbytes):
+                for run_bands, run_lines, run_x in iter_chunk_runs(valid, chunksizes):
+                    run = block[run_bands, run_lines, run_x]
+                    b0 = band_slice.start + (run_bands.start or 0)
+                    y0 = y_slice.start + (run_lines.start or 0)
+                    x0 = run_x.start or 0
+                    var[b0:b0 + run.shape[0], y0:y0 + run.shape[1], x0:x0 + run.shape[2]] = run
+    finally:
+        # netCDF-C deflates the chunks still in its chunk cache when the file is closed
+        with stage('compress_write'):
+            nc.close()
+
+
+def encode_blosc_chunk(chunk, compressor):
+    """Compress one chunk with numcodecs Blosc; the buffer is what the HDF5 Blosc filter stores."""
+    return compressor.encode(np.ascontiguousarray(chunk))
+
+
+def shuffle_chunk(chunk):
+    """Apply the HDF5 shuffle filter: byte k of every element is stored together."""
+    itemsize = chunk.dtype.itemsize
+    return np.ascontiguousarray(chunk.reshape(-1).view(np.uint8).reshape(-1, itemsize).T).tobytes()
+
+
+def encode_chunk(chunk, complevel=4, shuffle=True):
+    """Shuffle and deflate one chunk exactly as the HDF5 filter pipeline would."""
+    data = shuffle_chunk(chunk) if shuffle else np.ascontiguousarray(chunk).tobytes()
+    return zlib.compress(data, complevel)
+
+
+def chunk_encoder(encoding):
+    """Chunk compression function of a zlib or Blosc encoding, matching what the HDF5 filters store."""
+    codec = encoding_codec(encoding)
+    if codec == 'zlib':
+        return partial(encode_chunk, complevel=encoding.get('complevel', 4), shuffle=encoding.get('shuffle', False))
+    if codec.startswith('blosc_'):
+        return partial(encode_blosc_chunk, compressor=numcodecs_compressor(encoding))
+    raise ValueError("Parallel chunk compression requires zlib or Blosc in the encoding")
+
+
+def iter_chunks(block, band_start, y_start, chunksizes, fill_value=0, valid=None):
+    """Yield (offset, chunk) for every chunk of a chunk-aligned block.
+
+    Edge chunks are padded to the full chunk shape with the fill value, since
+    HDF5 always stores whole chunks. Chunks with no `valid` pixel are skipped.
+    """
+    cb, cy, cx = chunksizes
+    nbands, nrows, ncols = block.shape
+    for b in range(0, nbands, cb):
+        for y in range(0, nrows, cy):
+            for x in range(0, ncols, cx):
+                if valid is not None and not valid[b:b + cb, y:y + cy, x:x + cx].any():
+                    continue
+                chunk = block[b:b + cb, y:y + cy, x:x + cx]
+                if chunk.shape != (cb, cy, cx):
+                    padded = np.full((cb, cy, cx), fill_value, dtype=block.dtype)
+                    padded[:chunk.shape[0], :chunk.shape[1], :chunk.shape[2]] = chunk
+                    chunk = padded
+                yield (band_start + b, y_start + y, x), np.ascontiguousarray(chunk)
+
+
+def write_netcdf_parallel(cube, output_nc_file, encoding, dtype=None, transform=None, attrs=None,
+                          var_attrs=None, fill_value=None, block_lines=None, block_bands=None,
+                          workers=None, executor='thread', transform_slices=False, nodata=None):
+    """Stream a cube into NetCDF4 with shuffle+deflate done by a pool of workers.
+
+    The file and its empty `data` variable are created through netCDF4, then a
+    single writer inserts the pre-compressed chunks with HDF5 direct chunk
+    writes. zlib and Blosc release the GIL, so threads scale across cores; use
+    `executor='process'` to sidestep the GIL for the shuffle step as well.
+    `nodata` skips all-nodata chunks as in `write_netcdf_stream`.
+    """
+    dtype = np.dtype(dtype or cube.dtype).newbyteorder('=')
+    chunksizes = tuple(encoding['chunksizes'])
+    encode = chunk_encoder(encoding)
+
+    # Blocks must start on chunk boundaries so every chunk is written exactly once
+    if block_bands is not None:
+        block_bands = max(1, block_bands // chunksizes[0]) * chunksizes[0]
+    else:
+        block_lines = max(1, (block_lines or chunksizes[1]) // chunksizes[1]) * chunksizes[1]
+
+    if nodata is not None and fill_value is None:
+        fill_value = nodata_fill_value(cube, nodata, dtype, transform, transform_slices)
+
+    nc = create_netcdf_cube(output_nc_file, cube.shape, dtype, encoding, attrs=attrs,
+                            var_attrs=var_attrs, fill_value=fill_value)
+    pad_value = nc.variables['data']._FillValue if '_FillValue' in nc.variables['data'].ncattrs() else 0
+    nc.close()
+
+    workers = workers or os.cpu_count()
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with h5py.File(output_nc_file, 'r+') as h5, pool_class(max_workers=workers) as pool:
+        dset = h5['data']
+        for band_slice, y_slice, block in iter_blocks(cube, block_lines=block_lines, block_bands=block_bands):
+            block, valid = prepare_block(block, band_slice, y_slice, dtype, transform, transform_slices, nodata,
+                                         pad_value)
+            block_chunks = list(iter_chunks(block, band_slice.start, y_slice.start, chunksizes, pad_value, valid))
+            if not block_chunks:
+                continue
+            offsets, chunks = zip(*block_chunks)
+            with stage('compress', bytes_in=sum(chunk.nbytes for chunk in chunks)) as info:
+                encoded_chunks = list(pool.map(encode, chunks))
+                info['bytes_out'] = sum(len(encoded) for encoded in encoded_chunks)
+            with stage('write', bytes_in=info['bytes_out']):
+                for offset, encoded in zip(offsets, encoded_chunks):
+                    dset.id.write_direct_chunk(offset, encoded, filter_mask=0)
+
+
+def benchmark_parallel_writer(cube, output_dir, encoding, workers=None, executor='thread', transform=None):
+    """Time the serial streaming writer against the parallel one and report the speedup."""
+    serial_file = os.path.join(output_dir, 'benchmark_serial.nc')
+    parallel_file = os.path.join(output_dir, 'benchmark_parallel.nc')
+
+    start = time.perf_counter()
+    write_netcdf_stream(cube, serial_file, encoding, transform=transform)
+    serial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_netcdf_parallel(cube, parallel_file, encoding, transform=transform, workers=workers, executor=executor)
+    parallel_seconds = time.perf_counter() - start
+
+    # Both files must decode to the same values
+    with netCDF4.Dataset(serial_file) as a, netCDF4.Dataset(parallel_file) as b:
+        a.set_auto_mask(False)
+        b.set_auto_mask(False)
+        identical = np.array_equal(a.variables['data'][:], b.variables['data'][:], equal_nan=True)
+
+    report = {
+        'workers': workers or os.cpu_count(),
+        'executor': executor,
+        'serial_seconds': serial_seconds,
+        'parallel_seconds': parallel_seconds,
+        'speedup': serial_seconds / parallel_seconds,
+        'serial_bytes': os.path.getsize(serial_file),
+        'parallel_bytes': os.path.getsize(parallel_file),
+        'identical': bool(identical)
+    }
+    print(f"Serial: {serial_seconds:.2f} s, parallel ({report['workers']} {executor} workers): "
+          f"{parallel_seconds:.2f} s, speedup {report['speedup']:.2f}x")
+    return report
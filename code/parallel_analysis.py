@@ -0,0 +1,163 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from bitinfo import (bitinformation_from_counts, bitpair_counts_by_band, float_layout, info_by_band_dataframe,
+                     merge_bitpair_counts)
+from envi_header import parse_hdr_file
+from envi_reader import memmap_cube
+
+# Lines copied into shared memory at a time
+COPY_BLOCK_LINES = 256
+
+# Cube of this worker process, attached once by `_attach`
+_worker_cube = None
+_worker_shm = None
+
+
+class SharedCube:
+    """A (band, y, x) cube copied once into `multiprocessing.shared_memory` in BSQ order.
+
+    Worker processes attach to it by name (see `descriptor`) instead of
+    receiving a pickled copy, so the cube is in RAM once however many
+    workers there are. Use as a context manager; the memory is released on
+    exit.
+    """
+
+    def __init__(self, cube, block_lines=COPY_BLOCK_LINES):
+        self.shape = tuple(cube.shape)
+        self.dtype = np.dtype(cube.dtype).newbyteorder('=')
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        for y0 in range(0, self.shape[1], block_lines):
+            self.array[:, y0:y0 + block_lines] = cube[:, y0:y0 + block_lines]
+
+    @property
+    def descriptor(self):
+        return ('shared', self._shm.name, self.shape, self.dtype.str)
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach(descriptor):
+    """Pool initializer: open the cube of `descriptor` once per worker process."""
+    global _worker_cube, _worker_shm
+    kind, *args = descriptor
+    if kind == 'shared':
+        name, shape, dtype = args
+        _worker_shm = shared_memory.SharedMemory(name=name)
+        _worker_cube = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_worker_shm.buf)
+    else:
+        # A memory map of the file; the page cache is shared between processes
+        binary_file, hdr_metadata = args
+        _worker_cube = memmap_cube(binary_file, hdr_metadata)
+
+
+def _band_range_counts(task):
+    """Bit-pair counts of bands [b0, b1) (split='bands') or lines [b0, b1) (split='lines')."""
+    split, start, stop, dim, masked_value, block_lines = task
+    cube = _worker_cube
+    if split == 'lines':
+        return bitpair_counts_by_band(cube, dim=dim, masked_value=masked_value, block_lines=block_lines,
+                                      y_start=start, y_stop=stop)
+    # Pairs along band need the first band of the next range as well
+    stop_with_pair = min(stop + (dim == 'band'), cube.shape[0])
+    counts = bitpair_counts_by_band(cube[start:stop_with_pair], dim=dim, masked_value=masked_value,
+                                    block_lines=block_lines)
+    return counts[:stop - start]
+
+
+def _ranges(size, parts):
+    """(start, stop) of `parts` near-equal ranges covering [0, size)."""
+    edges = np.linspace(0, size, min(parts, size) + 1).astype(int)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def parallel_bitpair_counts(source, dim='y', masked_value=-9999, workers=None, split='bands', tasks_per_worker=4,
+                            block_lines=256):
+    """Per-band bit-pair counts (bands, nbits, 2, 2) computed on a process pool without copying the cube.
+
+    `source` is a SharedCube, or a (binary_file, hdr_metadata) pair whose
+    workers each memory-map the file. Band ranges (`split='bands'`) or line
+    ranges (`split='lines'`, the counts are additive over lines) are
+    dispatched `tasks_per_worker` per worker, so uneven ranges balance out.
+    The result equals bitpair_counts_by_band(cube, dim).
+    """
+    if isinstance(source, SharedCube):
+        descriptor, shape, dtype = source.descriptor, source.shape, source.dtype
+    else:
+        binary_file, hdr_metadata = source
+        cube = memmap_cube(binary_file, hdr_metadata)
+        descriptor, shape, dtype = ('memmap', binary_file, hdr_metadata), cube.shape, cube.dtype
+    float_layout(dtype)
+    workers = workers or os.cpu_count()
+    size = shape[0] if split == 'bands' else shape[1]
+    tasks = [(split, start, stop, dim, masked_value, block_lines)
+             for start, stop in _ranges(size, workers * tasks_per_worker)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(descriptor,)) as pool:
+        results = list(pool.map(_band_range_counts, tasks))
+    if split == 'bands':
+        return np.concatenate(results)
+    return merge_bitpair_counts(*results)
+
+
+def parallel_bit_information_by_band(binary_file, hdr_file, dim='y', masked_value=-9999, workers=None,
+                                     split='bands', shared=True, csv_file=None, set_zero_insignificant=True,
+                                     confidence=0.99):
+    """Per-band bit information of a scene in the bit_information_by_band.csv layout, on all cores.
+
+    With `shared=True` the cube is read once into shared memory (fastest
+    when the scene fits in RAM); otherwise every worker memory-maps the
+    file. The table is written to `csv_file` when given.
+    """
+    hdr_metadata = parse_hdr_file(hdr_file)
+    if shared:
+        with SharedCube(memmap_cube(binary_file, hdr_metadata)) as cube:
+            counts = parallel_bitpair_counts(cube, dim=dim, masked_value=masked_value, workers=workers, split=split)
+    else:
+        counts = parallel_bitpair_counts((binary_file, hdr_metadata), dim=dim, masked_value=masked_value,
+                                         workers=workers, split=split)
+    df = info_by_band_dataframe(bitinformation_from_counts(counts, set_zero_insignificant, confidence))
+    if csv_file:
+        df.to_csv(csv_file, index=False)
+    return df
+
+
+def scaling_benchmark(binary_file, hdr_file, worker_counts=(1, 2, 4, 8), dim='y'):
+    """Seconds and speedup of the per-band analysis for each number of workers (cube shared once)."""
+    hdr_metadata = parse_hdr_file(hdr_file)
+    report = []
+    with SharedCube(memmap_cube(binary_file, hdr_metadata)) as cube:
+        for workers in worker_counts:
+            start = time.perf_counter()
+            parallel_bitpair_counts(cube, dim=dim, workers=workers)
+            seconds = time.perf_counter() - start
+            baseline = report[0]['seconds'] if report else seconds
+            report.append({'workers': workers, 'seconds': seconds, 'speedup': baseline / seconds})
+            print(f"{workers} workers: {seconds:.1f} s, speedup {report[-1]['speedup']:.2f}x")
+    return report
+
+
+# Example usage
+if __name__ == "__main__":
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+
+    start = time.perf_counter()
+    df = parallel_bit_information_by_band(binary_file, hdr_file, dim='y',
+                                          csv_file='/Users/kitlewers/Desktop/naive_compression/code/bit_information_by_band.csv')
+    print(f"{len(df)} bands in {time.perf_counter() - start:.1f} s on {os.cpu_count()} cores")
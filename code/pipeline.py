@@ -0,0 +1,231 @@
+import os
+import queue
+import threading
+import time
+
+import h5py
+import numpy as np
+
+from instrumentation import record_queues, stage
+from netcdf_writer import chunk_encoder, create_netcdf_cube, iter_blocks, iter_chunks, nodata_fill_value, prepare_block
+
+# How often a blocked thread checks whether another stage has failed
+POLL_SECONDS = 0.1
+
+
+class PipelineAborted(Exception):
+    """Raised inside a pipeline thread when another stage has failed."""
+
+
+class StageQueue:
+    """Bounded queue between two pipeline stages that keeps depth and stall statistics.
+
+    `put_wait_seconds` is time producers spent blocked on a full queue (the
+    consumer is the bottleneck), `get_wait_seconds` time consumers spent
+    blocked on an empty one (the producer is). Depth is sampled at every put.
+    """
+
+    def __init__(self, name, maxsize, abort):
+        self.name = name
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._abort = abort
+        self._lock = threading.Lock()
+        self.items = 0
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.put_wait_seconds = 0.0
+        self.get_wait_seconds = 0.0
+
+    def put(self, item):
+        start = time.perf_counter()
+        while True:
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+                break
+            except queue.Full:
+                if self._abort.is_set():
+                    raise PipelineAborted
+        depth = self._queue.qsize()
+        with self._lock:
+            self.put_wait_seconds += time.perf_counter() - start
+            self.items += 1
+            self.depth_sum += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def get(self):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = self._queue.get(timeout=POLL_SECONDS)
+                break
+            except queue.Empty:
+                if self._abort.is_set():
+                    raise PipelineAborted
+        with self._lock:
+            self.get_wait_seconds += time.perf_counter() - start
+        return item
+
+    def stats(self):
+        return {
+            'maxsize': self.maxsize,
+            'items': self.items,
+            'max_depth': self.max_depth,
+            'mean_depth': self.depth_sum / self.items if self.items else 0.0,
+            'put_wait_seconds': self.put_wait_seconds,
+            'get_wait_seconds': self.get_wait_seconds
+        }
+
+
+def write_netcdf_pipelined(cube, output_nc_file, encoding, dtype=None, transform=None, attrs=None,
+                           var_attrs=None, fill_value=None, block_lines=None, block_bands=None, workers=None,
+                           transform_slices=False, nodata=None, prefetch=2, max_pending=None):
+    """Stream a cube into NetCDF4 with reading, transforming, compressing and writing overlapped.
+
+    A reader thread prefetches up to `prefetch` blocks ahead from the source;
+    `workers` threads each take a whole block, transform it (rounding,
+    scaling, ...) and compress its chunks; the calling thread writes the
+    finished chunks with HDF5 direct chunk writes as they arrive. Both
+    queues are bounded (`max_pending` compressed blocks, default `workers`),
+    so memory stays at a few blocks however fast the disk or the cores are.
+    The output decodes to the same values as write_netcdf_stream; only the
+    order of chunks in the file may differ. `nodata` skips all-nodata chunks.
+
+    Returns queue depth and stall statistics, and each stage's busy time;
+    inside an instrumentation.record_run they are also added to its report.
+    """
+    dtype = np.dtype(dtype or cube.dtype).newbyteorder('=')
+    chunksizes = tuple(encoding['chunksizes'])
+    encode = chunk_encoder(encoding)
+    workers = workers or os.cpu_count()
+
+    # Blocks must start on chunk boundaries so every chunk is written exactly once
+    if block_bands is not None:
+        block_bands = max(1, block_bands // chunksizes[0]) * chunksizes[0]
+    else:
+        block_lines = max(1, (block_lines or chunksizes[1]) // chunksizes[1]) * chunksizes[1]
+
+    if nodata is not None and fill_value is None:
+        fill_value = nodata_fill_value(cube, nodata, dtype, transform, transform_slices)
+
+    nc = create_netcdf_cube(output_nc_file, cube.shape, dtype, encoding, attrs=attrs,
+                            var_attrs=var_attrs, fill_value=fill_value)
+    pad_value = nc.variables['data']._FillValue if '_FillValue' in nc.variables['data'].ncattrs() else 0
+    nc.close()
+
+    abort = threading.Event()
+    errors = []
+    blocks = StageQueue('read', prefetch, abort)
+    encoded_blocks = StageQueue('compress', max_pending or workers, abort)
+    busy = {'read': 0.0, 'compress': 0.0, 'write': 0.0}
+    busy_lock = threading.Lock()
+
+    def add_busy(name, seconds):
+        with busy_lock:
+            busy[name] += seconds
+
+    def fail(error):
+        if not isinstance(error, PipelineAborted):
+            errors.append(error)
+        abort.set()
+
+    def read():
+        try:
+            start = time.perf_counter()
+            for item in iter_blocks(cube, block_lines=block_lines, block_bands=block_bands):
+                add_busy('read', time.perf_counter() - start)
+                blocks.put(item)
+                start = time.perf_counter()
+            for _ in range(workers):
+                blocks.put(None)
+        except BaseException as error:
+            fail(error)
+
+    def compress():
+        try:
+            while True:
+                item = blocks.get()
+                if item is None:
+                    break
+                start = time.perf_counter()
+                band_slice, y_slice, block = item
+                block, valid = prepare_block(block, band_slice, y_slice, dtype, transform, transform_slices, nodata,
+                                             pad_value)
+                chunks = list(iter_chunks(block, band_slice.start, y_slice.start, chunksizes, pad_value, valid))
+                with stage('compress', bytes_in=sum(chunk.nbytes for _, chunk in chunks)) as info:
+                    encoded = [(offset, encode(chunk)) for offset, chunk in chunks]
+                    info['bytes_out'] = sum(len(data) for _, data in encoded)
+                add_busy('compress', time.perf_counter() - start)
+                encoded_blocks.put(encoded)
+            encoded_blocks.put(None)
+        except BaseException as error:
+            fail(error)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=read, name='pipeline-read', daemon=True)]
+    threads += [threading.Thread(target=compress, name=f'pipeline-compress-{n}', daemon=True) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        with h5py.File(output_nc_file, 'r+') as h5:
+            dset = h5['data']
+            finished = 0
+            while finished < workers:
+                encoded = encoded_blocks.get()
+                if encoded is None:
+                    finished += 1
+                    continue
+                write_start = time.perf_counter()
+                with stage('write', bytes_in=sum(len(data) for _, data in encoded)):
+                    for offset, data in encoded:
+                        dset.id.write_direct_chunk(offset, data, filter_mask=0)
+                add_busy('write', time.perf_counter() - write_start)
+    except BaseException as error:
+        fail(error)
+    finally:
+        # Stops the other stages after a failure; after a clean run they have already exited
+        abort.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+    seconds = time.perf_counter() - start
+    stats = {
+        'seconds': seconds,
+        'workers': workers,
+        'queues': {stage_queue.name: stage_queue.stats() for stage_queue in (blocks, encoded_blocks)},
+        # Busy time of the compress stage is summed over its workers
+        'busy_seconds': busy,
+        'utilization': {'read': busy['read'] / seconds, 'compress': busy['compress'] / (seconds * workers),
+                        'write': busy['write'] / seconds}
+    }
+    record_queues(stats)
+    return stats
+
+
+def print_pipeline_stats(stats):
+    """Queue depths, stall times and stage utilization of a pipelined run."""
+    print(f"Pipeline: {stats['seconds']:.2f} s with {stats['workers']} compress workers")
+    for name, utilization in stats['utilization'].items():
+        print(f"  {name:>8} busy {stats['busy_seconds'][name]:7.2f} s ({100 * utilization:5.1f}%)")
+    for name, q in stats['queues'].items():
+        print(f"  {name:>8} queue: depth mean {q['mean_depth']:.1f} / max {q['max_depth']} of {q['maxsize']}, "
+              f"producers stalled {q['put_wait_seconds']:.2f} s, consumers stalled {q['get_wait_seconds']:.2f} s")
+
+
+# Example usage
+if __name__ == "__main__":
+    from envi_header import parse_hdr_file
+    from envi_reader import memmap_cube
+    from rounding import round_sigfigs_inplace
+
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    output_nc_file = '/Users/kitlewers/Desktop/naive_compression/imagery/output_data_four_sigfigs_pipelined.nc'
+
+    cube = memmap_cube(binary_file, parse_hdr_file(hdr_file))
+    encoding = {'zlib': True, 'complevel': 5, 'shuffle': True, 'chunksizes': (1, 100, 100)}
+    stats = write_netcdf_pipelined(cube, output_nc_file, encoding,
+                                   transform=lambda block: round_sigfigs_inplace(block, 4), prefetch=2)
+    print_pipeline_stats(stats)
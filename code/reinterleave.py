@@ -0,0 +1,156 @@
+import os
+import re
+import time
+
+import numpy as np
+
+from envi_header import parse_hdr_file
+from envi_reader import INTERLEAVE_LAYOUTS, cube_interleave, cube_shape, envi_dtype, header_value, memmap_cube
+
+# Tiles of this many bytes (all bands of a few samples) stay in L2 on both sides of the copy
+TILE_BYTES = 512 * 2**10
+# Default RAM for the source and destination line blocks together
+MAX_MEMORY = 256 * 2**20
+
+
+def tile_shape(shape, itemsize, tile_bytes=TILE_BYTES):
+    """(lines, samples) of an all-band tile of a (band, y, x) block holding about `tile_bytes`."""
+    nbands, nrows, ncols = shape
+    samples = int(min(ncols, max(16, tile_bytes // (nbands * itemsize))))
+    lines = int(min(nrows, max(1, tile_bytes // (nbands * samples * itemsize))))
+    return lines, samples
+
+
+def blocked_copy(src, dst, tile_bytes=TILE_BYTES):
+    """Copy a (band, y, x) view into another with a different memory order, one cache-sized tile at a time.
+
+    A plain `dst[...] = src` over a whole block walks one side with a large
+    stride and evicts lines before they are reused; copying all bands of a
+    few lines and samples at a time keeps both sides of each tile in cache.
+    """
+    itemsize = src.dtype.itemsize
+    if src.strides[2] == itemsize and dst.strides[2] == itemsize:
+        # Samples are contiguous on both sides (BSQ <-> BIL): whole rows copy at memory speed
+        dst[...] = src
+        return
+    tile_lines, tile_samples = tile_shape(src.shape, itemsize, tile_bytes)
+    _, nrows, ncols = src.shape
+    for y0 in range(0, nrows, tile_lines):
+        for x0 in range(0, ncols, tile_samples):
+            dst[:, y0:y0 + tile_lines, x0:x0 + tile_samples] = src[:, y0:y0 + tile_lines, x0:x0 + tile_samples]
+
+
+def block_lines_for(shape, itemsize, max_memory=MAX_MEMORY):
+    """Lines per block so that a source block and a destination block fit in `max_memory`."""
+    nbands, nrows, ncols = shape
+    return int(min(nrows, max(1, max_memory // (2 * nbands * ncols * itemsize))))
+
+
+def write_reinterleaved_header(hdr_file, output_hdr_file, interleave):
+    """Copy a header with the new interleave and no header offset; every other field is kept verbatim."""
+    with open(hdr_file, 'r') as f:
+        text = f.read()
+    for key, value in (('interleave', interleave), ('header offset', '0')):
+        pattern = re.compile(rf'^[ \t]*{key}[ \t]*=.*$', re.IGNORECASE | re.MULTILINE)
+        if pattern.search(text):
+            text = pattern.sub(f'{key} = {value}', text, count=1)
+        else:
+            text = text.rstrip('\n') + f'\n{key} = {value}\n'
+    with open(output_hdr_file, 'w') as f:
+        f.write(text)
+
+
+def _line_block_segments(axes, shape, y0, y1, itemsize):
+    """(byte offset, index) of the contiguous runs holding lines [y0, y1) in a file with axis order `axes`.
+
+    `index` selects the matching part of a block buffer in the same order.
+    Line-interleaved layouts (BIL, BIP) are a single run; BSQ is one run per band.
+    """
+    sizes = dict(zip(('band', 'y', 'x'), shape))
+    line_bytes = itemsize * sizes['x'] * (sizes['band'] if axes[0] == 'y' else 1)
+    if axes[0] == 'y':
+        return [(y0 * line_bytes, Ellipsis)]
+    return [((band * sizes['y'] + y0) * line_bytes, band) for band in range(sizes['band'])]
+
+
+def _lines_index(axes, nlines):
+    """Index of the first `nlines` lines of a buffer with axis order `axes`."""
+    index = [slice(None)] * 3
+    index[axes.index('y')] = slice(0, nlines)
+    return tuple(index)
+
+
+def reinterleave(binary_file, hdr_file, output_file, interleave='bsq', max_memory=MAX_MEMORY,
+                 tile_bytes=TILE_BYTES):
+    """Rewrite an ENVI cube on disk in another interleave ('bsq', 'bil' or 'bip').
+
+    The scene is processed a block of lines at a time: the block is read
+    with plain sequential reads, transposed tile by tile with `blocked_copy`
+    into a buffer in the target order, and written with plain writes, so RAM
+    stays under `max_memory` and the scene is never held twice. BSQ matches
+    the (1, y, x) chunks of the converters and BIP full-spectrum chunks, so
+    converting first makes every later block read contiguous. Writes
+    `output_file` and its .hdr and returns the throughput in MB/s; the
+    output must not be the source file, and a source shorter than its
+    header raises ValueError.
+    """
+    hdr_metadata = parse_hdr_file(hdr_file)
+    interleave = interleave.lower()
+    if interleave not in INTERLEAVE_LAYOUTS:
+        raise ValueError(f"Unsupported interleave format: {interleave}")
+    # Opening the output truncates it, so it must not be the source
+    if os.path.abspath(output_file) == os.path.abspath(binary_file) or \
+            (os.path.exists(output_file) and os.path.samefile(output_file, binary_file)):
+        raise ValueError(f"Output file is the source file: {output_file}")
+    shape = cube_shape(hdr_metadata)
+    dtype = envi_dtype(hdr_metadata)
+    offset = int(header_value(hdr_metadata, 'header offset', '0'))
+    source_axes, source_order = INTERLEAVE_LAYOUTS[cube_interleave(hdr_metadata)]
+    target_axes, target_order = INTERLEAVE_LAYOUTS[interleave]
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+
+    start = time.perf_counter()
+    block_lines = block_lines_for(shape, dtype.itemsize, max_memory)
+    # Both buffers are allocated once; fresh buffers per block would page-fault on every first touch
+    buffer_shape = {'band': shape[0], 'y': block_lines, 'x': shape[2]}
+    source_buffer = np.empty(tuple(buffer_shape[axis] for axis in source_axes), dtype=dtype)
+    target_buffer = np.empty(tuple(buffer_shape[axis] for axis in target_axes), dtype=dtype)
+    with open(binary_file, 'rb') as source, open(output_file, 'wb') as target:
+        target.truncate(nbytes)
+        for y0 in range(0, shape[1], block_lines):
+            y1 = min(y0 + block_lines, shape[1])
+            source_block = source_buffer[_lines_index(source_axes, y1 - y0)]
+            target_block = target_buffer[_lines_index(target_axes, y1 - y0)]
+            # Sequential reads straight into the buffer, no page faults through a memory map
+            for position, index in _line_block_segments(source_axes, shape, y0, y1, dtype.itemsize):
+                source.seek(offset + position)
+                segment = source_block[index]
+                if source.readinto(segment) != segment.nbytes:
+                    raise ValueError(f"Source file is shorter than its header describes: {binary_file}")
+            blocked_copy(source_block.transpose(source_order), target_block.transpose(target_order), tile_bytes)
+            for position, index in _line_block_segments(target_axes, shape, y0, y1, dtype.itemsize):
+                target.seek(position)
+                target.write(target_block[index])
+    seconds = time.perf_counter() - start
+
+    write_reinterleaved_header(hdr_file, output_file + '.hdr', interleave)
+    return nbytes / 1e6 / seconds
+
+
+def check_reinterleaved(binary_file, hdr_file, output_file, block_lines=256):
+    """True if the re-interleaved file holds the same (band, y, x) cube as the source."""
+    source = memmap_cube(binary_file, parse_hdr_file(hdr_file))
+    target = memmap_cube(output_file, parse_hdr_file(output_file + '.hdr'))
+    return all(np.array_equal(source[:, y0:y0 + block_lines], target[:, y0:y0 + block_lines])
+               for y0 in range(0, source.shape[1], block_lines))
+
+
+# Example usage
+if __name__ == "__main__":
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    output_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_RFL_ORT_bsq'
+
+    mbps = reinterleave(binary_file, hdr_file, output_file, interleave='bsq')
+    print(f"Re-interleaved to BSQ at {mbps:.0f} MB/s; identical: {check_reinterleaved(binary_file, hdr_file, output_file)}")
+    print(f"Output size: {os.path.getsize(output_file) / 1e9:.2f} GB")
@@ -0,0 +1,173 @@
+import numpy as np
+
+from bitinfo import float_layout
+
+# Elements processed per pass; scratch buffers are allocated once at this size
+CHUNK_SIZE = 1 << 16
+
+# Correctly rounded powers of ten, POW10[i] = 10**(i - POW10_OFFSET)
+POW10_OFFSET = 64
+POW10 = np.array([float(f"1e{i}") for i in range(-POW10_OFFSET, POW10_OFFSET + 1)])
+
+# floor(log10(2**(e - 127))) for every biased float32 exponent e
+FLOAT32_DECIMAL_EXPONENT = np.floor((np.arange(256) - 127) * np.log10(2.0)).astype(np.int64)
+
+
+def _flat_chunks(values, chunk_size):
+    """Yield writable flat views of at most `chunk_size` elements over a contiguous array."""
+    if not (values.flags.c_contiguous and values.flags.writeable):
+        raise ValueError("In-place rounding needs a writable, C-contiguous array")
+    flat = values.reshape(-1)
+    for start in range(0, flat.size, chunk_size):
+        yield flat[start:start + chunk_size]
+
+
+def bitround_inplace(values, keepbits, nodata=-9999, chunk_size=CHUNK_SIZE):
+    """Round float32/float64 values to `keepbits` mantissa bits in place and return them.
+
+    Round-to-nearest, ties-to-even on the unsigned view with a bit mask, the
+    same arithmetic as numcodecs BitRound (and so xb.xr_bitround). Values equal
+    to `nodata` are passed through unchanged. Work happens chunk by chunk in
+    two scratch buffers, so no full-size temporaries are created.
+    """
+    uint, _, nmant = float_layout(values.dtype)
+    maskbits = nmant - int(keepbits)
+    if maskbits <= 0:
+        return values
+    mask = uint(~np.array(0, dtype=uint) - uint((1 << maskbits) - 1))
+    half_quantum = uint((1 << (maskbits - 1)) - 1)
+
+    scratch = np.empty(min(chunk_size, values.size), dtype=uint)
+    is_nodata = np.empty(scratch.size, dtype=bool)
+    for chunk in _flat_chunks(values, chunk_size):
+        bits = chunk.view(uint)
+        tmp, nodata_mask = scratch[:chunk.size], is_nodata[:chunk.size]
+        if nodata is not None:
+            np.equal(chunk, nodata, out=nodata_mask)
+        # bits += ((bits >> maskbits) & 1) + half_quantum; bits &= mask
+        np.right_shift(bits, uint(maskbits), out=tmp)
+        np.bitwise_and(tmp, uint(1), out=tmp)
+        np.add(tmp, half_quantum, out=tmp)
+        np.add(bits, tmp, out=bits)
+        np.bitwise_and(bits, mask, out=bits)
+        if nodata is not None:
+            np.copyto(chunk, values.dtype.type(nodata), where=nodata_mask)
+    return values
+
+
+def bitround_bands_inplace(block, keepbits, tile_lines=None, y_start=0, nodata=-9999):
+    """Bit-round each band of a (band, y, x) block in place with its own keepbits.
+
+    `keepbits` has one entry per band of the block, or with `tile_lines` one
+    row per band and one column per strip of `tile_lines` lines, counted from
+    line 0 of the scene; `y_start` is the scene line of the block's first row.
+    """
+    keepbits = np.asarray(keepbits)
+    for band in range(block.shape[0]):
+        if tile_lines is None:
+            bitround_inplace(block[band], keepbits[band], nodata=nodata)
+            continue
+        nrows = block.shape[1]
+        y = 0
+        while y < nrows:
+            tile = (y_start + y) // tile_lines
+            y_end = min(nrows, (tile + 1) * tile_lines - y_start)
+            bitround_inplace(block[band, y:y_end], keepbits[band, tile], nodata=nodata)
+            y = y_end
+    return block
+
+
+def _sigfig_tables(sig_figs):
+    """Lookup tables for `round_sigfigs_inplace`, indexed by the biased float32 exponent.
+
+    `threshold[e]` holds the bits of the smallest float32 at or above the power
+    of ten that bumps the decimal exponent by one. `scale` at 2 * e + bump is
+    10**p for the scale exponent p; entries from `cutoff` on include p < 0,
+    which an exact power of ten cannot express, and go through the slow path.
+    """
+    powers = POW10[FLOAT32_DECIMAL_EXPONENT + 1 + POW10_OFFSET]
+    with np.errstate(over='ignore'):
+        threshold = powers.astype(np.float32)
+    threshold = np.where(threshold < powers, np.nextafter(threshold, np.float32(np.inf)), threshold)
+    threshold = threshold.view(np.uint32)
+
+    decimal_exponent = np.repeat(FLOAT32_DECIMAL_EXPONENT, 2) + np.tile([0, 1], 256)
+    p = sig_figs - 1 - decimal_exponent
+    scale = POW10[np.clip(p, 0, POW10_OFFSET) + POW10_OFFSET]
+    cutoff = int(np.argmax(p < 0)) if (p < 0).any() else len(p)
+    return threshold, scale, cutoff
+
+
+def _round_sigfigs_exact(values, sig_figs):
+    """Slow path of `round_sigfigs_inplace` for a few float32 values: log10 and exact powers of ten."""
+    work = values.astype(np.float64)
+    p = sig_figs - 1 - np.floor(np.log10(np.abs(work))).astype(np.int64)
+    up = POW10[np.clip(p, 0, POW10_OFFSET) + POW10_OFFSET]
+    down = POW10[np.clip(-p, 0, POW10_OFFSET) + POW10_OFFSET]
+    with np.errstate(over='ignore'):
+        return (np.rint(work * up / down) * down / up).astype(np.float32)
+
+
+def round_sigfigs_inplace(values, sig_figs, nodata=-9999, chunk_size=CHUNK_SIZE):
+    """Round float32 values to `sig_figs` significant decimal figures in place and return them.
+
+    Instead of `log10`/`power` per element, the decimal exponent comes from the
+    binary exponent through small lookup tables, corrected by one integer
+    comparison with the next power of ten. Subnormal values and values of
+    10**sig_figs and above are rare and go through `log10` instead. Rounding
+    is half-to-even in float64 scratch space, so results are the float32
+    nearest to the rounded decimal. Values equal to `nodata` pass through.
+    """
+    if values.dtype != np.float32:
+        raise ValueError(f"round_sigfigs_inplace works on float32 buffers, got {values.dtype}")
+    threshold, scale_table, cutoff = _sigfig_tables(sig_figs)
+
+    n = min(chunk_size, values.size)
+    abs_bits = np.empty(n, dtype=np.uint32)
+    bits_scratch = np.empty(n, dtype=np.uint32)
+    index = np.empty(n, dtype=np.intp)
+    work = np.empty(n, dtype=np.float64)
+    scale = np.empty(n, dtype=np.float64)
+    flag = np.empty(n, dtype=bool)
+    nodata_mask = np.empty(n, dtype=bool)
+    for chunk in _flat_chunks(values, chunk_size):
+        size = chunk.size
+        a, t, idx, w, s, f, nd = (abs_bits[:size], bits_scratch[:size], index[:size], work[:size],
+                                  scale[:size], flag[:size], nodata_mask[:size])
+        if nodata is not None:
+            np.equal(chunk, nodata, out=nd)
+
+        # Biased exponent of |x|, and whether |x| reaches the next power of ten
+        np.bitwise_and(chunk.view(np.uint32), np.uint32(0x7FFFFFFF), out=a)
+        np.right_shift(a, np.uint32(23), out=idx, casting='unsafe')
+        np.take(threshold, idx, out=t, mode='clip')
+        # (threshold - |x| - 1) has its top bit set exactly when |x| >= threshold
+        np.subtract(t, a, out=t)
+        np.subtract(t, np.uint32(1), out=t)
+        np.right_shift(t, np.uint32(31), out=t)
+        np.right_shift(a, np.uint32(22), out=a)
+        np.bitwise_and(a, np.uint32(~1 & 0x1FF), out=a)
+        np.bitwise_or(a, t, out=a)
+        np.copyto(idx, a, casting='unsafe')
+        np.take(scale_table, idx, out=s, mode='clip')
+
+        # Scale to an integer with sig_figs digits, round half to even, scale back
+        with np.errstate(invalid='ignore'):
+            np.multiply(chunk, s, out=w)
+        np.rint(w, out=w)
+        np.divide(w, s, out=w)
+
+        # Subnormals (index 0, 1) and large values (from cutoff on) take the exact path
+        np.subtract(a, np.uint32(2), out=a)
+        np.greater_equal(a, np.uint32(cutoff - 2), out=f)
+        rare = np.flatnonzero(f)
+        original = chunk[rare]
+        with np.errstate(over='ignore'):
+            np.copyto(chunk, w, casting='same_kind')
+        if rare.size:
+            exact = np.isfinite(original) & (original != 0)
+            original[exact] = _round_sigfigs_exact(original[exact], sig_figs)
+            chunk[rare] = original
+        if nodata is not None and nd.any():
+            np.copyto(chunk, np.float32(nodata), where=nd)
+    return values
@@ -0,0 +1,147 @@
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from envi_header import find_scenes, read_envi_header, wavelengths_nm
+from envi_reader import ENVI_DATA_TYPES, cube_interleave, envi_dtype
+
+# Columns of the `scenes` table; arrays and map info are stored as JSON text
+CATALOG_COLUMNS = {
+    'hdr_file': 'TEXT PRIMARY KEY',
+    'binary_file': 'TEXT',
+    'hdr_mtime': 'REAL',
+    'bands': 'INTEGER',
+    'lines': 'INTEGER',
+    'samples': 'INTEGER',
+    'data_type': 'INTEGER',
+    'dtype': 'TEXT',
+    'byte_order': 'INTEGER',
+    'header_offset': 'INTEGER',
+    'interleave': 'TEXT',
+    'nbytes': 'INTEGER',
+    'data_ignore_value': 'REAL',
+    'wavelength_nm': 'TEXT',
+    'fwhm': 'TEXT',
+    'bbl': 'TEXT',
+    'map_info': 'TEXT',
+    'description': 'TEXT',
+    'error': 'TEXT'
+}
+JSON_COLUMNS = ('wavelength_nm', 'fwhm', 'bbl', 'map_info')
+
+
+def _json_array(values):
+    return None if values is None else json.dumps(np.asarray(values).tolist())
+
+
+def catalog_row(scene):
+    """Catalog row of one (binary_file, hdr_file) pair; a header that fails to parse gets `error` set."""
+    binary_file, hdr_file = scene
+    row = dict.fromkeys(CATALOG_COLUMNS)
+    row.update(hdr_file=os.path.abspath(hdr_file), binary_file=os.path.abspath(binary_file),
+               hdr_mtime=os.path.getmtime(hdr_file))
+    try:
+        header = read_envi_header(hdr_file)
+        dtype = envi_dtype(header)
+        row.update(
+            bands=header['bands'], lines=header['lines'], samples=header['samples'],
+            data_type=header['data type'], dtype=dtype.str, byte_order=header.get('byte order', 0),
+            header_offset=header.get('header offset', 0), interleave=cube_interleave(header),
+            nbytes=header['bands'] * header['lines'] * header['samples'] * dtype.itemsize,
+            data_ignore_value=header.get('data ignore value'),
+            wavelength_nm=_json_array(wavelengths_nm(header)), fwhm=_json_array(header.get('fwhm')),
+            bbl=_json_array(header.get('bbl')),
+            map_info=json.dumps(header['map info']) if 'map info' in header else None,
+            description=header.get('description')
+        )
+    except (KeyError, ValueError) as error:
+        row['error'] = f"{type(error).__name__}: {error}"
+    return row
+
+
+def connect_catalog(catalog_file):
+    """Open (and create if needed) the SQLite catalog."""
+    connection = sqlite3.connect(catalog_file)
+    columns = ', '.join(f'"{name}" {kind}' for name, kind in CATALOG_COLUMNS.items())
+    connection.execute(f"CREATE TABLE IF NOT EXISTS scenes ({columns})")
+    return connection
+
+
+def build_catalog(root, catalog_file, workers=None, chunksize=64):
+    """Index every ENVI scene under `root` into a SQLite catalog and return the number of rows written.
+
+    Headers are parsed on a process pool. Headers whose modification time
+    matches the catalog are not reread, so refreshing a catalog of thousands
+    of scenes only parses the new or changed ones; scenes that disappeared
+    are removed.
+    """
+    scenes = find_scenes(root)
+    with connect_catalog(catalog_file) as connection:
+        known = dict(connection.execute("SELECT hdr_file, hdr_mtime FROM scenes"))
+        found = {os.path.abspath(hdr_file) for _, hdr_file in scenes}
+        root_prefix = os.path.join(os.path.abspath(root), '')
+        gone = [(hdr_file,) for hdr_file in known if hdr_file.startswith(root_prefix) and hdr_file not in found]
+        connection.executemany("DELETE FROM scenes WHERE hdr_file = ?", gone)
+
+        changed = [scene for scene in scenes
+                   if known.get(os.path.abspath(scene[1])) != os.path.getmtime(scene[1])]
+        if workers == 1 or len(changed) < chunksize:
+            rows = list(map(catalog_row, changed))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rows = list(pool.map(catalog_row, changed, chunksize=chunksize))
+
+        placeholders = ', '.join('?' for _ in CATALOG_COLUMNS)
+        connection.executemany(f"INSERT OR REPLACE INTO scenes VALUES ({placeholders})",
+                               [tuple(row[name] for name in CATALOG_COLUMNS) for row in rows])
+    connection.close()
+    return len(rows)
+
+
+def query_catalog(catalog_file, where=None, params=()):
+    """Catalog rows as dicts, with JSON columns decoded (wavelengths etc. as numpy arrays).
+
+    `where` is an SQL condition, e.g. "interleave = ? AND bands > ?".
+    """
+    connection = connect_catalog(catalog_file)
+    connection.row_factory = sqlite3.Row
+    query = "SELECT * FROM scenes" + (f" WHERE {where}" if where else "") + " ORDER BY hdr_file"
+    rows = []
+    for record in connection.execute(query, params):
+        row = dict(record)
+        for name in JSON_COLUMNS:
+            if row[name] is not None:
+                value = json.loads(row[name])
+                row[name] = value if name == 'map_info' else np.array(value)
+        rows.append(row)
+    connection.close()
+    return rows
+
+
+def catalog_metadata(row):
+    """Header metadata dict for a catalog row, usable with envi_reader without reopening the header."""
+    if row['data_type'] not in map(int, ENVI_DATA_TYPES):
+        raise ValueError(f"Catalog row has no usable data type: {row['hdr_file']}")
+    return {
+        'samples': str(row['samples']),
+        'lines': str(row['lines']),
+        'bands': str(row['bands']),
+        'data type': str(row['data_type']),
+        'byte order': str(row['byte_order']),
+        'header offset': str(row['header_offset']),
+        'interleave': row['interleave']
+    }
+
+
+# Example usage
+if __name__ == "__main__":
+    root = '/Users/kitlewers/Desktop/naive_compression/imagery'
+    catalog_file = '/Users/kitlewers/Desktop/naive_compression/scene_catalog.sqlite'
+
+    print(f"Indexed {build_catalog(root, catalog_file)} new or changed headers")
+    for row in query_catalog(catalog_file, "error IS NULL"):
+        print(f"{os.path.basename(row['hdr_file'])}: {row['bands']} x {row['lines']} x {row['samples']} "
+              f"{row['dtype']} {row['interleave']}, {row['nbytes'] / 1e9:.2f} GB")
@@ -0,0 +1,231 @@
+import time
+
+import numpy as np
+
+# Reversible spectral predictors; residuals are stored in place of the values
+PREDICTORS = ('delta', 'linear')
+# Lines sampled across the scene to fit the linear predictor
+FIT_LINES = 64
+# Attributes xarray and netCDF4 apply to the stored values; with a predictor they describe the decoded values
+CF_DECODING_ATTRS = ('scale_factor', 'add_offset', '_FillValue', 'missing_value', 'valid_min', 'valid_max',
+                     'valid_range', '_Unsigned')
+DECODING_ATTRS = CF_DECODING_ATTRS + ('_QuantizeBitRoundNumberOfSignificantDigits',)
+
+
+def residual_dtype(dtype):
+    """Storage type of the residuals: the unsigned integer of the same size."""
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iuf':
+        raise ValueError(f"Spectral prediction needs integer or float data, not {dtype}")
+    return np.dtype(f'u{dtype.itemsize}')
+
+
+def _integer_view(block):
+    """Integers the predictor works on; floats are reinterpreted bit for bit (bit-rounded mantissas keep their zeros)."""
+    return block.view(residual_dtype(block.dtype)) if block.dtype.kind == 'f' else block
+
+
+def _sign_magnitude(residuals):
+    """Code wrapped residuals as magnitude plus a sign in the top bit: -256 -> 0x8...0100.
+
+    Small residuals of either sign keep zero high bytes, and unlike a zigzag
+    code the trailing zero bits of bit-rounded or coarse residuals are kept,
+    so shuffle + deflate still see them. The most negative residual has no
+    magnitude and is coded as the sign bit alone.
+    """
+    signed = residuals.view(f'i{residuals.dtype.itemsize}')
+    unsigned = residual_dtype(residuals.dtype)
+    sign = unsigned.type(1 << (8 * unsigned.itemsize - 1))
+    negative = signed < 0
+    return np.where(negative, np.negative(signed).view(unsigned) | sign, signed.view(unsigned))
+
+
+def _from_sign_magnitude(codes, dtype):
+    """Inverse of `_sign_magnitude`, viewed as `dtype`."""
+    unsigned = residual_dtype(dtype)
+    codes = np.asarray(codes).astype(unsigned, copy=False)
+    sign = unsigned.type(1 << (8 * unsigned.itemsize - 1))
+    magnitude = codes & (sign - unsigned.type(1))
+    negated = np.where(magnitude == 0, sign, np.negative(magnitude))
+    return np.where(codes >= sign, negated, magnitude).view(dtype)
+
+
+def fit_linear_predictor(sample, nodata=None):
+    """Per-band (slope, intercept) predicting band b from band b - 1 by least squares.
+
+    `sample` is a (band, y, x) block of the values that will be stored
+    (after scaling/quantization). Pixels whose spectrum holds `nodata` are
+    left out. Band 0 has no predecessor and gets (0, 0).
+    """
+    values = sample.reshape(sample.shape[0], -1).astype(np.float64)
+    if nodata is not None:
+        values = values[:, (values != nodata).all(axis=0)]
+    nbands = values.shape[0]
+    slope, intercept = np.zeros(nbands), np.zeros(nbands)
+    if values.shape[1] < 2:
+        slope[1:] = 1.0
+        return slope, intercept
+    previous, current = values[:-1], values[1:]
+    previous_mean, current_mean = previous.mean(axis=1), current.mean(axis=1)
+    centered = previous - previous_mean[:, None]
+    variance = np.einsum('bi,bi->b', centered, centered)
+    covariance = np.einsum('bi,bi->b', centered, current - current_mean[:, None])
+    slope[1:] = np.where(variance > 0, covariance / np.where(variance > 0, variance, 1.0), 1.0)
+    intercept[1:] = current_mean - slope[1:] * previous_mean
+    return slope, intercept
+
+
+def _linear_prediction(previous, slope, intercept, dtype):
+    """Prediction of a band from the previous one, rounded and wrapped into `dtype`'s integers."""
+    return np.rint(slope * previous.astype(np.float64) + intercept).astype(np.int64).astype(dtype)
+
+
+def encode_spectral(block, predictor='delta', slope=None, intercept=None):
+    """Residuals of a (band, y, x) block holding every band, in `residual_dtype(block.dtype)`.
+
+    'delta' stores band b minus band b - 1 and 'linear' band b minus its
+    linear prediction from band b - 1 (integer data only). The arithmetic
+    wraps around in the integer type, so the residuals decode exactly; they
+    are stored sign-magnitude coded (see `_sign_magnitude`), so small negative
+    residuals have zero high bytes and bit-rounding zeros survive.
+    """
+    values = _integer_view(block)
+    residuals = np.empty_like(values)
+    residuals[0] = values[0]
+    if predictor == 'delta':
+        np.subtract(values[1:], values[:-1], out=residuals[1:])
+    elif predictor == 'linear':
+        if block.dtype.kind == 'f':
+            raise ValueError("The linear predictor works on integer data; use 'delta' for floats")
+        for band in range(1, values.shape[0]):
+            residuals[band] = values[band] - _linear_prediction(values[band - 1], slope[band], intercept[band],
+                                                                values.dtype)
+    else:
+        raise ValueError(f"Unknown spectral predictor: {predictor}. Choose from {PREDICTORS}")
+    return _sign_magnitude(residuals)
+
+
+def decode_spectral(residuals, predictor='delta', slope=None, intercept=None, dtype=None):
+    """Inverse of `encode_spectral`; `dtype` is the type of the original values."""
+    dtype = np.dtype(dtype or residuals.dtype)
+    residuals = _from_sign_magnitude(residuals, residual_dtype(dtype) if dtype.kind == 'f' else dtype)
+    if predictor == 'delta':
+        values = np.cumsum(residuals, axis=0, dtype=residuals.dtype)
+    elif predictor == 'linear':
+        values = np.empty_like(residuals)
+        values[0] = residuals[0]
+        for band in range(1, residuals.shape[0]):
+            values[band] = residuals[band] + _linear_prediction(values[band - 1], slope[band], intercept[band],
+                                                                residuals.dtype)
+    else:
+        raise ValueError(f"Unknown spectral predictor: {predictor}. Choose from {PREDICTORS}")
+    return values.view(dtype)
+
+
+def predictor_attrs(predictor, dtype, slope=None, intercept=None):
+    """Variable attributes a reader needs to undo the predictor."""
+    attrs = {'spectral_predictor': predictor, 'spectral_predictor_dtype': np.dtype(dtype).name}
+    if predictor == 'linear':
+        attrs.update(spectral_predictor_slope=np.asarray(slope, dtype=np.float64),
+                     spectral_predictor_intercept=np.asarray(intercept, dtype=np.float64))
+    return attrs
+
+
+def hidden_attr_name(name):
+    """Name a decoding attribute is stored under when the variable holds residuals."""
+    return 'spectral_predictor_fill_value' if name == '_FillValue' else f"spectral_predictor_{name.lstrip('_')}"
+
+
+def hide_decoding_attrs(var_attrs):
+    """Variable attributes with the DECODING_ATTRS moved under `spectral_predictor_*` names.
+
+    Readers that do not know the predictor then see the raw integer
+    residuals, instead of residuals scaled and masked as if they were values.
+    """
+    return {hidden_attr_name(name) if name in DECODING_ATTRS else name: value
+            for name, value in (var_attrs or {}).items()}
+
+
+def decoded_attrs(attrs):
+    """Inverse of `hide_decoding_attrs`: the attributes that apply to the decoded values."""
+    names = {hidden_attr_name(name): name for name in DECODING_ATTRS}
+    return {names.get(name, name): value for name, value in attrs.items()}
+
+
+def spectral_decoder(attrs):
+    """Function undoing the predictor described by a variable's attributes, or None if there is none."""
+    predictor = attrs.get('spectral_predictor')
+    if predictor is None:
+        return None
+    slope = attrs.get('spectral_predictor_slope')
+    intercept = attrs.get('spectral_predictor_intercept')
+    dtype = np.dtype(attrs['spectral_predictor_dtype'])
+    slope = None if slope is None else np.asarray(slope, dtype=np.float64)
+    intercept = None if intercept is None else np.asarray(intercept, dtype=np.float64)
+
+    def decode(residuals):
+        return decode_spectral(np.asarray(residuals), predictor, slope, intercept, dtype)
+    return decode
+
+
+def predictive_transform(cube, transform, dtype, predictor, transform_slices=False, nodata=-9999,
+                         fit_lines=FIT_LINES):
+    """Wrap a block transform so it also applies the spectral predictor.
+
+    Returns (transform, residual dtype, predictor attributes). Blocks must
+    hold every band. The linear predictor is fitted on `fit_lines` lines
+    spread over the scene, after `transform`; source `nodata` pixels are
+    left out of the fit.
+    """
+    dtype = np.dtype(dtype or cube.dtype).newbyteorder('=')
+
+    def stored(block, band_slice, y_slice):
+        if transform is not None:
+            block = transform(block, band_slice, y_slice) if transform_slices else transform(block)
+        return np.asarray(block).astype(dtype, copy=False)
+
+    slope = intercept = None
+    if predictor == 'linear':
+        lines = np.unique(np.linspace(0, cube.shape[1] - 1, min(fit_lines, cube.shape[1])).astype(int))
+        source = np.array(cube[:, lines, :], dtype=cube.dtype.newbyteorder('='))
+        sample = stored(source.copy(), slice(0, cube.shape[0]), slice(0, cube.shape[1]))
+        fit_sample = sample if nodata is None else np.where(source == nodata, nodata, sample)
+        slope, intercept = fit_linear_predictor(fit_sample, nodata=nodata)
+
+    def predictive(block, band_slice, y_slice):
+        if block.shape[0] != cube.shape[0]:
+            raise ValueError("Spectral prediction needs blocks that hold every band (use block_lines)")
+        return encode_spectral(stored(block, band_slice, y_slice), predictor, slope, intercept)
+
+    return predictive, residual_dtype(dtype), predictor_attrs(predictor, dtype, slope, intercept)
+
+
+def decode_throughput(path, block_lines=None, **reader_kwargs):
+    """MB/s of reading and decoding a whole converted output in line strips, through chunk_reader."""
+    from chunk_reader import CompressedCubeReader
+
+    with CompressedCubeReader(path, **reader_kwargs) as reader:
+        nbands, nrows, ncols = reader.shape
+        block_lines = block_lines or reader.chunks[1]
+        nbytes = 0
+        start = time.perf_counter()
+        for y0 in range(0, nrows, block_lines):
+            nbytes += reader.get_roi(y0, min(y0 + block_lines, nrows), 0, ncols).nbytes
+        return nbytes / 1e6 / (time.perf_counter() - start)
+
+
+# Example usage
+if __name__ == "__main__":
+    import os
+
+    from int_compression import convert_to_netcdf_quantized
+
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    output_nc_file = '/Users/kitlewers/Desktop/naive_compression/imagery/output_data_quantized{}.nc'
+
+    for predictor in (None, 'delta', 'linear'):
+        path = output_nc_file.format(f'_{predictor}' if predictor else '')
+        convert_to_netcdf_quantized(binary_file, hdr_file, path, precision=1e-5, predictor=predictor)
+        print(f"{predictor or 'none'}: {os.path.getsize(path) / 1e6:.1f} MB, "
+              f"decode {decode_throughput(path):.0f} MB/s")
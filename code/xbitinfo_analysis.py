@@ -1,74 +1,29 @@
+import netCDF4
 import numpy as np
 import xarray as xr
-import xbitinfo as xb
-import os
-import julia
-julia.install()
-os.environ["PATH"] += os.pathsep + "/Users/kitlewers/.juliaup/bin"
+from bitinfo import (bitpair_counts_by_band, bitpair_counts_by_tile, get_bitinformation, get_keepbits,
+                     keepbits_by_band, merge_bitpair_counts)
+from bitinfo_cache import cached_bitinformation, cached_bitpair_counts
+from compression_codecs import netcdf_encoding
+from envi_header import parse_hdr_file
+from envi_reader import memmap_cube, open_envi_dataset
+from instrumentation import stage
+from netcdf_writer import write_netcdf_stream
+from rounding import bitround_bands_inplace, bitround_inplace
+from zarr_writer import write_zarr_stream
 
 
-# Step 1: Parse the ENVI .hdr file (from your existing code)
-def parse_hdr_file(hdr_file):
-    """Parse the ENVI .hdr file to extract metadata."""
-    metadata = {}
-    with open(hdr_file, 'r') as file:
-        for line in file:
-            key_value = line.strip().split('=')
-            if len(key_value) == 2:
-                key, value = key_value
-                key = key.strip().lower()
-                value = value.strip()
-                if '{' in value:  # Handle lists
-                    value = value.replace('{', '').replace('}', '').split(',')
-                    value = [v.strip() for v in value]
-                metadata[key] = value
-    return metadata
+# Step 1: Parse the ENVI .hdr file with envi_header.parse_hdr_file (imported above)
 
-# Step 2: Map ENVI data types to numpy types (from your existing code)
-def map_envi_data_type(envi_data_type):
-    """Map ENVI data types to numpy data types."""
-    data_type_mapping = {
-        '1': np.uint8,
-        '2': np.int16,
-        '3': np.int32,
-        '4': np.float32,
-        '5': np.float64,
-        '12': np.uint16,
-        '13': np.uint32,
-        '14': np.int64,
-        '15': np.uint64
-    }
-    return data_type_mapping.get(envi_data_type, None)
-
-# Step 3: Load the binary file (from your existing code)
+# Step 2: Load the binary file as a memory map
 def load_binary_file(binary_file, hdr_metadata):
-    """Load binary data using the metadata from the .hdr file."""
-    nrows = int(hdr_metadata['lines'])
-    ncols = int(hdr_metadata['samples'])
-    nbands = int(hdr_metadata['bands'])
-    dtype = map_envi_data_type(hdr_metadata['data type'][0])
-
-    if dtype is None:
-        raise ValueError(f"Unsupported or unknown data type: {hdr_metadata['data type'][0]}")
-
-    interleave = hdr_metadata['interleave'].lower()
-
-    # Read the binary data
-    data = np.fromfile(binary_file, dtype=dtype)
+    """Memory-map binary data using the metadata from the .hdr file.
 
-    # Reshape the data based on interleave format
-    if interleave == 'bil':
-        data = data.reshape((nrows, nbands, ncols)).transpose(1, 0, 2)  # Band Interleaved by Line
-    elif interleave == 'bsq':
-        data = data.reshape((nbands, nrows, ncols))  # Band Sequential
-    elif interleave == 'bip':
-        data = data.reshape((nrows, ncols, nbands)).transpose(2, 0, 1)  # Band Interleaved by Pixel
-    else:
-        raise ValueError(f"Unsupported interleave format: {interleave}")
+    Returns a (band, y, x) view of the file; pages are only read when indexed.
+    """
+    return memmap_cube(binary_file, hdr_metadata)
 
-    return data
-
-# Step 4: Convert the binary data to an xarray Dataset
+# Step 3: Convert the binary data to an xarray Dataset
 def convert_to_xarray(binary_data, hdr_metadata):
     nrows = int(hdr_metadata['lines'])
     ncols = int(hdr_metadata['samples'])
@@ -85,16 +40,35 @@ def convert_to_xarray(binary_data, hdr_metadata):
     )
     return ds
 
-# Step 5: Use xbitinfo for compression with chunking
-def compress_with_xbitinfo(ds, output_nc_file, inflevel=0.99, chunksizes=(1, 100, 100)):
-    # Analyze bit information
-    bitinfo = xb.get_bitinformation(ds, dim="band")
+# Bit-round a Dataset with the native in-place kernel
+def bitround_dataset(ds, keepbits):
+    """Bit-round every variable of `ds` to its keepbits, like xb.xr_bitround.
+
+    Uses one copy per variable and the chunked in-place kernel; -9999 nodata
+    values are kept as they are instead of being rounded.
+    """
+    ds_bitrounded = ds.copy()
+    for var in ds.data_vars:
+        keep = int(keepbits[var])
+        values = bitround_inplace(np.array(ds[var].values, order='C'), keep)
+        ds_bitrounded[var] = ds[var].copy(data=values)
+        ds_bitrounded[var].attrs["_QuantizeBitRoundNumberOfSignificantDigits"] = keep
+    return ds_bitrounded
+
+# Step 4: Use xbitinfo for compression with chunking
+def compress_with_xbitinfo(ds, output_nc_file, inflevel=0.99, chunksizes=(1, 100, 100), stream=False,
+                           block_lines=None, block_bands=None, workers=None, bitinfo=None, codec='zlib',
+                           backend='netcdf', skip_nodata=False, pipeline=False, predictor=None):
+    if backend == 'zarr' and predictor is not None:
+        raise ValueError("Spectral prediction is NetCDF only")
+    # Analyze bit information (native NumPy engine, -9999 nodata excluded) unless it was precomputed,
+    # e.g. by cached_bitinformation, in which case changing inflevel costs milliseconds
+    if bitinfo is None:
+        with stage('analysis', bytes_in=ds['data'].nbytes):
+            bitinfo = get_bitinformation(ds, dim="band")
     
     # Get the number of bits to keep for the specified information level
-    keepbits = xb.get_keepbits(bitinfo, inflevel=inflevel)
-    
-    # Apply bit rounding to the dataset
-    ds_bitrounded = xb.xr_bitround(ds, keepbits)
+    keepbits = get_keepbits(bitinfo, inflevel=inflevel)
     
     # Set chunk sizes and compression settings
     compression = {
@@ -105,9 +79,103 @@ def compress_with_xbitinfo(ds, output_nc_file, inflevel=0.99, chunksizes=(1, 100
             'chunksizes': chunksizes
         }
     }
+    if codec != 'zlib':
+        # Blosc (zstd/lz4) with bitshuffle, see compression_codecs
+        compression['data'] = netcdf_encoding(codec, complevel=5, shuffle=True, chunksizes=chunksizes)
+    
+    keep = int(keepbits["data"])
+    var_attrs = dict(ds["data"].attrs, _QuantizeBitRoundNumberOfSignificantDigits=keep)
+    if backend == 'zarr':
+        # Chunk-aligned blocks are rounded and written by `workers` threads without a lock
+        write_zarr_stream(ds["data"], output_nc_file, compression['data'], dtype=ds["data"].dtype,
+                          transform=lambda block: bitround_inplace(block, keep), attrs=ds.attrs,
+                          var_attrs=var_attrs, block_lines=block_lines, block_bands=block_bands, workers=workers,
+                          nodata=-9999 if skip_nodata else None)
+        return
+    
+    # Blosc, skipping all-nodata chunks, the overlapped pipeline and spectral prediction ('delta' on the
+    # bit patterns, decoded by chunk_reader) go through the streaming writer
+    if stream or workers or codec != 'zlib' or skip_nodata or pipeline or predictor:
+        # Bit-round each block in place as it is appended
+        write_netcdf_stream(ds["data"], output_nc_file, compression['data'], dtype=ds["data"].dtype,
+                            transform=lambda block: bitround_inplace(block, keep),
+                            attrs=ds.attrs, var_attrs=var_attrs,
+                            block_lines=block_lines, block_bands=block_bands, workers=workers,
+                            executor='pipeline' if pipeline else 'thread', nodata=-9999 if skip_nodata else None,
+                            predictor=predictor)
+        return
+    
+    # Apply bit rounding to the dataset
+    with stage('transform', bytes_in=ds['data'].nbytes):
+        ds_bitrounded = bitround_dataset(ds, keepbits)
     
     # Save the bit-rounded dataset with compression and chunking
-    ds_bitrounded.to_netcdf(output_nc_file, format='NETCDF4', encoding=compression)
+    with stage('write', bytes_in=ds['data'].nbytes):
+        ds_bitrounded.to_netcdf(output_nc_file, format='NETCDF4', encoding=compression)
+
+# Step 4b: Bitround each band (or band x line strip) with its own keepbits
+def compress_with_band_keepbits(ds, output_nc_file, inflevel=0.99, chunksizes=(1, 100, 100), dim="y",
+                                tile_lines=None, counts=None, block_lines=None, block_bands=None, workers=None,
+                                skip_nodata=False, pipeline=False):
+    """Stream `ds` to NetCDF4, bit-rounding every band with the keepbits of its own information.
+
+    Information is measured within each band along `dim` (default `y`, as in
+    compressed_bit_information_by_band.csv), so noisy water-absorption bands
+    get few or no mantissa bits while informative bands keep their precision.
+    With `tile_lines`, keepbits are chosen per band and strip of `tile_lines`
+    lines, capped at the keepbits of the band's counts summed over its
+    tiles, and also written as a `keepbits(band, tile)` variable. `counts` can
+    be precomputed per-band counts, e.g. from cached_bitpair_counts(dim="y").
+    The per-band keepbits (from the summed counts) are stored in the
+    `keepbits` attribute of `data`. `skip_nodata=True` leaves all -9999 chunks
+    unwritten, and `pipeline=True` overlaps reading, rounding, compression
+    and writing (see pipeline.write_netcdf_pipelined). Returns the keepbits array.
+    """
+    data = ds["data"]
+    if counts is None:
+        with stage('analysis', bytes_in=data.nbytes):
+            if tile_lines is None:
+                counts = bitpair_counts_by_band(data, dim=dim)
+            else:
+                counts = bitpair_counts_by_tile(data, tile_lines, dim=dim)
+    keepbits = keepbits_by_band(counts, data.dtype, inflevel=inflevel)
+    band_keepbits = keepbits
+    if tile_lines is not None:
+        # A small tile can pass the significance test by chance, so the band's keepbits come from the counts
+        # of all its tiles and tiles only keep fewer bits where their own information allows it
+        band_keepbits = keepbits_by_band(merge_bitpair_counts(*counts.transpose(1, 0, 2, 3, 4)), data.dtype,
+                                         inflevel=inflevel)
+        keepbits = np.minimum(keepbits, band_keepbits[:, None])
+    
+    compression = {
+        'data': {
+            'zlib': True,
+            'complevel': 5,
+            'shuffle': True,
+            'chunksizes': chunksizes
+        }
+    }
+    var_attrs = dict(data.attrs, keepbits=band_keepbits.astype(np.int32), keepbits_inflevel=inflevel,
+                     keepbits_dim=dim)
+    if tile_lines is not None:
+        var_attrs['keepbits_tile_lines'] = tile_lines
+    
+    def bitround_block(block, band_slice, y_slice):
+        return bitround_bands_inplace(block, keepbits[band_slice], tile_lines=tile_lines, y_start=y_slice.start)
+    
+    write_netcdf_stream(data, output_nc_file, compression['data'], dtype=data.dtype, transform=bitround_block,
+                        transform_slices=True, attrs=ds.attrs, var_attrs=var_attrs, block_lines=block_lines,
+                        block_bands=block_bands, workers=workers, executor='pipeline' if pipeline else 'thread',
+                        nodata=-9999 if skip_nodata else None)
+    
+    if tile_lines is not None:
+        # Keep the full per-tile choice next to the data
+        with netCDF4.Dataset(output_nc_file, 'a') as nc:
+            nc.createDimension('tile', keepbits.shape[1])
+            var = nc.createVariable('keepbits', np.int32, ('band', 'tile'))
+            var[:] = keepbits
+            var.setncatts({'long_name': "mantissa bits kept per band and line strip", 'tile_lines': tile_lines})
+    return keepbits
 
 # Example usage
 if __name__ == "__main__":
@@ -118,11 +186,17 @@ if __name__ == "__main__":
     # Step 1: Parse the .hdr file to extract metadata
     hdr_metadata = parse_hdr_file(hdr_file)
     
-    # Step 2: Load the binary data using the metadata
-    binary_data = load_binary_file(binary_file, hdr_metadata)
+    # Step 2: Open the binary data as a lazily indexed xarray Dataset
+    ds = open_envi_dataset(binary_file, hdr_metadata)
+    
+    # Step 3: Bit information from the on-disk cache (computed on the first run only)
+    bitinfo = cached_bitinformation(binary_file, hdr_metadata, dim="band")
     
-    # Step 3: Convert the loaded binary data to an xarray Dataset
-    ds = convert_to_xarray(binary_data, hdr_metadata)
+    # Step 4: Bitround, compress, and ensure consistent chunking
+    compress_with_xbitinfo(ds, output_nc_file, inflevel=0.99, chunksizes=(1, 100, 100), stream=True, bitinfo=bitinfo)
     
-    # Step 4: Use xbitinfo to analyze, compress, and ensure consistent chunking
-    compress_with_xbitinfo(ds, output_nc_file, inflevel=0.99, chunksizes=(1, 100, 100))
+    # Step 4b: Same scene with keepbits chosen band by band from cached within-band counts
+    band_counts = cached_bitpair_counts(binary_file, hdr_metadata, dim="y")
+    keepbits = compress_with_band_keepbits(ds, output_nc_file.replace('.nc', '_per_band.nc'), inflevel=0.99,
+                                           counts=band_counts)
+    print(f"Per-band keepbits: {keepbits.tolist()}")
@@ -0,0 +1,182 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+import zarr
+
+from compression_codecs import numcodecs_compressor, numcodecs_filters
+from envi_reader import memmap_cube
+from instrumentation import merge_stages, record_run, stage
+from netcdf_writer import iter_chunk_runs, nodata_fill_value, prepare_block, read_block
+
+
+# CF attributes stored as float32 in the NetCDF outputs
+FLOAT32_ATTRS = ('scale_factor', 'add_offset')
+
+
+def _json_attrs(attrs):
+    """Attributes with numpy scalars and arrays turned into JSON-serializable Python values.
+
+    JSON has no float32, so CF scale_factor/add_offset are rounded to float32
+    first; the store then holds the same constants as the NetCDF output
+    (xarray still decodes them in float64).
+    """
+    attrs = {key: np.float32(value) if key in FLOAT32_ATTRS else value for key, value in (attrs or {}).items()}
+    return {key: value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value
+            for key, value in attrs.items()}
+
+
+def create_zarr_cube(store_path, shape, dtype, encoding, attrs=None, var_attrs=None, fill_value=None):
+    """Create a Zarr store laid out like the NetCDF outputs: `data` (band, y, x) plus coordinates.
+
+    The store uses the Zarr v2 format with `_ARRAY_DIMENSIONS`, so xarray opens
+    it directly; chunks, filters and compressor come from the same encoding
+    dict the NetCDF writers use. Floating point data gets a NaN fill value by default.
+    """
+    nbands, nrows, ncols = shape
+    dtype = np.dtype(dtype).newbyteorder('=')
+    if fill_value is None and dtype.kind == 'f':
+        fill_value = np.nan
+
+    group = zarr.open_group(store_path, mode='w', zarr_format=2)
+    for name, size, first in (('band', nbands, 1), ('y', nrows, 0), ('x', ncols, 0)):
+        coord = group.create_array(name, shape=(size,), chunks=(size,), dtype=np.int64, fill_value=None)
+        coord[:] = np.arange(first, size + first)
+        coord.attrs['_ARRAY_DIMENSIONS'] = [name]
+
+    compressor = numcodecs_compressor(encoding)
+    data = group.create_array(
+        'data', shape=shape, chunks=tuple(encoding['chunksizes']), dtype=dtype,
+        compressors=[compressor] if compressor is not None else None,
+        filters=numcodecs_filters(encoding, dtype), fill_value=fill_value
+    )
+    data.attrs.update(dict(_json_attrs(var_attrs), _ARRAY_DIMENSIONS=['band', 'y', 'x']))
+    if attrs:
+        group.attrs.update(_json_attrs(attrs))
+    return group
+
+
+def _write_zarr_block(store_path, band_slice, y_slice, block, valid=None):
+    """Write one chunk-aligned block; every chunk is its own object, so no lock is needed.
+
+    With a `valid` mask only runs of chunks holding valid pixels are written.
+    """
+    data = zarr.open_array(store_path, path='data', mode='r+')
+    with stage('compress_write', bytes_in=block.nbytes):
+        for run_bands, run_lines, run_x in iter_chunk_runs(valid, data.chunks):
+            run = block[run_bands, run_lines, run_x]
+            b0 = band_slice.start + (run_bands.start or 0)
+            y0 = y_slice.start + (run_lines.start or 0)
+            x0 = run_x.start or 0
+            data[b0:b0 + run.shape[0], y0:y0 + run.shape[1], x0:x0 + run.shape[2]] = run
+
+
+def _write_envi_block(binary_file, hdr_metadata, store_path, band_slice, y_slice, dtype, transform, nodata=None,
+                      fill_value=None):
+    """Read, transform and write one block in a worker process that opens the ENVI file itself.
+
+    Returns the stages of the block, for the parent's recorder (see instrumentation.merge_stages).
+    """
+    with record_run('block') as recorder:
+        cube = memmap_cube(binary_file, hdr_metadata)
+        block, valid = prepare_block(read_block(cube[band_slice, y_slice]), band_slice, y_slice, dtype, transform,
+                                     nodata=nodata, fill_value=fill_value)
+        _write_zarr_block(store_path, band_slice, y_slice, block, valid)
+    return recorder.stages
+
+
+def _aligned_blocks(shape, chunksizes, block_lines=None, block_bands=None):
+    """(band_slice, y_slice) of chunk-aligned blocks covering a (band, y, x) cube."""
+    nbands, nrows, _ = shape
+    if block_bands is not None:
+        block_bands = max(1, block_bands // chunksizes[0]) * chunksizes[0]
+        return [(slice(b, min(b + block_bands, nbands)), slice(0, nrows)) for b in range(0, nbands, block_bands)]
+    block_lines = max(1, (block_lines or chunksizes[1]) // chunksizes[1]) * chunksizes[1]
+    return [(slice(0, nbands), slice(y, min(y + block_lines, nrows))) for y in range(0, nrows, block_lines)]
+
+
+def write_zarr_stream(cube, store_path, encoding, dtype=None, transform=None, attrs=None, var_attrs=None,
+                      fill_value=None, block_lines=None, block_bands=None, workers=None, nodata=None):
+    """Stream a (band, y, x) cube into a Zarr store, block by block.
+
+    Blocks are chunk-aligned, so with `workers` they are transformed,
+    compressed and written by a thread pool with no shared lock; numcodecs
+    releases the GIL while compressing. With `nodata` set, all-nodata chunks
+    are never written and the fill value is the transformed nodata value.
+    """
+    dtype = np.dtype(dtype or cube.dtype).newbyteorder('=')
+    chunksizes = tuple(encoding['chunksizes'])
+    if nodata is not None and fill_value is None:
+        fill_value = nodata_fill_value(cube, nodata, dtype, transform)
+    create_zarr_cube(store_path, cube.shape, dtype, encoding, attrs=attrs, var_attrs=var_attrs,
+                     fill_value=fill_value)
+
+    def write(block_slices):
+        band_slice, y_slice = block_slices
+        block, valid = prepare_block(read_block(cube[band_slice, y_slice]), band_slice, y_slice, dtype, transform,
+                                     nodata=nodata, fill_value=fill_value)
+        _write_zarr_block(store_path, band_slice, y_slice, block, valid)
+
+    blocks = _aligned_blocks(cube.shape, chunksizes, block_lines, block_bands)
+    if workers:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(write, blocks))
+    else:
+        for block_slices in blocks:
+            write(block_slices)
+    zarr.consolidate_metadata(store_path)
+
+
+def write_zarr_from_envi(binary_file, hdr_metadata, store_path, encoding, dtype=None, transform=None, attrs=None,
+                         var_attrs=None, fill_value=None, block_lines=None, block_bands=None, workers=None,
+                         executor='process', nodata=None):
+    """Convert an ENVI cube to a Zarr store with `workers` processes writing blocks concurrently.
+
+    Each process memory-maps the ENVI file itself and writes whole chunks, so
+    nothing but block coordinates crosses process boundaries and no global
+    file lock is involved. `transform` must be picklable (a module-level
+    function or functools.partial). `executor='thread'` uses write_zarr_stream.
+    """
+    cube = memmap_cube(binary_file, hdr_metadata)
+    if not workers or executor != 'process':
+        return write_zarr_stream(cube, store_path, encoding, dtype=dtype, transform=transform, attrs=attrs,
+                                 var_attrs=var_attrs, fill_value=fill_value, block_lines=block_lines,
+                                 block_bands=block_bands, workers=workers, nodata=nodata)
+
+    dtype = np.dtype(dtype or cube.dtype).newbyteorder('=')
+    if nodata is not None and fill_value is None:
+        fill_value = nodata_fill_value(cube, nodata, dtype, transform)
+    create_zarr_cube(store_path, cube.shape, dtype, encoding, attrs=attrs, var_attrs=var_attrs,
+                     fill_value=fill_value)
+    blocks = _aligned_blocks(cube.shape, tuple(encoding['chunksizes']), block_lines, block_bands)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_write_envi_block, binary_file, hdr_metadata, store_path, band_slice, y_slice,
+                               dtype, transform, nodata, fill_value)
+                   for band_slice, y_slice in blocks]
+        for future in futures:
+            merge_stages(future.result())
+    zarr.consolidate_metadata(store_path)
+
+
+def open_zarr_cube(store_path):
+    """Open a converted Zarr store as a Dataset backed by dask, one task per stored chunk.
+
+    Computations on it (e.g. `.load()` or reductions) decompress chunks in parallel.
+    """
+    return xr.open_zarr(store_path, chunks={})
+
+
+# Example usage
+if __name__ == "__main__":
+    from compression_codecs import netcdf_encoding, set_blosc_threads
+    from naive_compression import parse_hdr_file
+
+    binary_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT'
+    hdr_file = '/Users/kitlewers/Desktop/naive_compression/imagery/ang20231109t092617_027_L2A_OE_main_27577724_RFL_ORT.hdr'
+    store_path = '/Users/kitlewers/Desktop/naive_compression/imagery/output_data.zarr'
+
+    set_blosc_threads(1)  # one Blosc thread per process; the processes provide the parallelism
+    encoding = netcdf_encoding('blosc_zstd', complevel=5, shuffle=True, chunksizes=(1, 100, 100))
+    write_zarr_from_envi(binary_file, parse_hdr_file(hdr_file), store_path, encoding, workers=os.cpu_count())
+    print(open_zarr_cube(store_path))